@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Runs many accounts (diaries, bots) from one process, checking for each one's
+posts every minute, like clock.py does for a single account.
+
+Each section of the accounts config file (accounts.cfg by default, see
+accounts_example.cfg) is one account, with the same settings as config.cfg.
+Settings in its [DEFAULT] section apply to every account unless an account
+sets its own. eg:
+
+    [DEFAULT]
+    RedisURL = redis://redis:6379/0
+    Timezone = Europe/London
+
+    [pepys]
+    PostsDir = posts
+    YearsAhead = 363
+    MastodonClientId = ...
+
+Each account's keys in Redis start with its section's name, eg
+"pepys:last_run_time", "pepys:toot_state" and "pepys:outbox:mastodon".
+
+Accounts that use the same PostsDir share one parsed post index, and, if
+their limits are the same, its renders (see render.py). All of them share
+their Redis connection pools and HTTP connection pools, so that hundreds of
+accounts need no more memory or connections than a few.
+On every run the accounts are started, --threads at a time.
+
+    $ ./accounts.py
+    $ ./accounts.py --config other_accounts.cfg --threads 16
+"""
+
+import argparse
+import configparser
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import redis
+from apscheduler.schedulers.blocking import BlockingScheduler
+from requests.adapters import HTTPAdapter
+
+import poster
+from post_index import PostIndex
+from render import RenderIndex
+
+logging.basicConfig()
+
+ACCOUNTS_FILE = "accounts.cfg"
+
+
+class SharedClients:
+    """
+    The connection pools, post indexes and renders that several Posters can
+    share.
+
+    pool_size - How many connections to keep open to each host. There's no
+        point in having more than the number of accounts that run at once.
+    """
+
+    def __init__(self, pool_size=10):
+        self.lock = threading.Lock()
+
+        # (host, port, password) -> redis.Redis
+        self.redis_clients = {}
+        # posts_dir -> PostIndex
+        self.post_indexes = {}
+        # (posts_dir, limits) -> RenderIndex
+        self.render_indexes = {}
+
+        # For the requests sessions that tweepy and Mastodon.py use. Each
+        # session keeps its own hooks, so each account is paced separately.
+        self.http_adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        # For the httpx clients that atproto uses:
+        self.httpx_transport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            )
+        )
+
+    def get_redis(self, host, port, password):
+        "Returns the redis.Redis client, and its pool, for this server."
+        key = (host, port, password)
+        with self.lock:
+            if key not in self.redis_clients:
+                self.redis_clients[key] = redis.Redis(
+                    host=host,
+                    port=port,
+                    password=password,
+                    decode_responses=True,
+                )
+            return self.redis_clients[key]
+
+    def get_post_index(self, posts_dir, index_dir):
+        "Returns the PostIndex for posts_dir, so it's only loaded once."
+        key = os.path.realpath(posts_dir)
+        with self.lock:
+            if key not in self.post_indexes:
+                self.post_indexes[key] = PostIndex(posts_dir, index_dir)
+            return self.post_indexes[key]
+
+    def get_render_index(self, post_index, limits):
+        """
+        Returns the RenderIndex of post_index's posts for these limits, so
+        each year's renders are only loaded once.
+        """
+        key = (os.path.realpath(post_index.posts_dir), tuple(sorted(limits.items())))
+        with self.lock:
+            if key not in self.render_indexes:
+                self.render_indexes[key] = RenderIndex(post_index, limits)
+            return self.render_indexes[key]
+
+    def use_http_pool(self, session):
+        "Make a requests session use the shared connection pool."
+        session.mount("https://", self.http_adapter)
+        session.mount("http://", self.http_adapter)
+
+
+def load_accounts(config_file, shared):
+    "Returns a list of a Poster for each account in config_file."
+    config = configparser.ConfigParser()
+    if not config.read(config_file):
+        msg = f"Can't read the accounts config file {config_file}"
+        raise FileNotFoundError(msg)
+
+    return [
+        poster.Poster(settings=config[name], name=name, shared=shared)
+        for name in config.sections()
+    ]
+
+
+def run_account(p):
+    "Run one account, logging rather than raising any error."
+    try:
+        p.start()
+    except Exception:
+        p.logger.exception("Run failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many accounts' posts.")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ACCOUNTS_FILE),
+        help="The accounts config file (accounts.cfg)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=10,
+        help="How many accounts to run at once (10)",
+    )
+    args = parser.parse_args()
+
+    shared = SharedClients(pool_size=args.threads)
+    posters = load_accounts(args.config, shared)
+
+    executor = ThreadPoolExecutor(max_workers=args.threads)
+    scheduler = BlockingScheduler()
+
+    @scheduler.scheduled_job("interval", minutes=1, max_instances=1, coalesce=True)
+    def timed_job():
+        # Wait for every account, so a slow run isn't overlapped by the next.
+        list(executor.map(run_account, posters))
+
+    scheduler.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Keeps track of the posts that were missed because Poster didn't run for
+longer than max_time_window minutes (eg, because Redis, the process or the
+network was down), so that they can be sent later, a few at a time, along
+with the posts that are due then. Only used if CatchUp / CATCH_UP is 1.
+
+Each missed period is stored as a pair of UTC times: posts whose modern time
+is after the first and no later than the second are still to be sent. As
+posts are sent the first time moves on, until the period is done. These, and
+when we last sent a missed post, are kept in Redis as JSON, eg:
+
+    backlog = {
+        "periods": [["2024-03-01 09:12:00", "2024-03-01 15:40:00"]],
+        "sent_at": "2024-03-01 15:41:00"
+    }
+
+so sending them carries on where it left off after a restart.
+"""
+
+import datetime
+import json
+import math
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Backlog:
+    """
+    redis - A redis.Redis object
+    key - The Redis key the backlog is stored in
+    """
+
+    def __init__(self, redis, key="backlog"):
+        self.redis = redis
+        self.key = key
+        # List of [start, end] UTC datetimes of periods whose posts we missed:
+        self.periods = []
+        # When we last sent posts from the backlog (a UTC datetime) or None:
+        self.sent_at = None
+
+    def queue_load(self, pipe):
+        """
+        Add the command needed to load the backlog to a Redis pipeline.
+        Pass its result to loaded() once it's been executed.
+        """
+        pipe.get(self.key)
+
+    def loaded(self, value):
+        "Use the result of the command added by queue_load()."
+        data = json.loads(value) if value else {}
+        self.periods = [
+            [parse_time(start), parse_time(end)]
+            for start, end in data.get("periods", [])
+        ]
+        self.sent_at = parse_time(data["sent_at"]) if data.get("sent_at") else None
+
+    def save(self, pipe):
+        "Add the command to save the backlog to a Redis pipeline."
+        data = {
+            "periods": [
+                [start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)]
+                for start, end in self.periods
+            ],
+            "sent_at": self.sent_at.strftime(TIME_FORMAT) if self.sent_at else None,
+        }
+        pipe.set(self.key, json.dumps(data))
+
+    def add(self, start, end):
+        "Add a period whose posts we've missed, if it's not already in one."
+        if self.periods and start <= self.periods[-1][1]:
+            self.periods[-1][1] = max(self.periods[-1][1], end)
+        else:
+            self.periods.append([start, end])
+
+    def take_allowance(self, time_now, rate):
+        """
+        Returns how many missed posts we can send now, so that, on average,
+        we send no more than `rate` a minute, and no more than that in one go.
+        Assumes that many will be sent.
+        """
+        minute = datetime.timedelta(minutes=1)
+        most = max(1, math.ceil(rate))
+
+        # Don't save up more than `most` while we weren't sending any:
+        earliest = time_now - most * minute / rate
+        if self.sent_at is None or self.sent_at < earliest:
+            self.sent_at = earliest
+
+        allowance = min(int((time_now - self.sent_at) / minute * rate), most)
+        self.sent_at += allowance * minute / rate
+        return allowance
+
+    def sent_up_to(self, time):
+        """
+        We've sent the posts in the first period up to and including the one
+        at `time` (a UTC datetime), or all of them if `time` is None.
+        """
+        if time is None:
+            self.periods.pop(0)
+        else:
+            self.periods[0][0] = time
+
+
+def parse_time(t):
+    "Turns a string stored in Redis into a UTC datetime."
+    return datetime.datetime.strptime(t, TIME_FORMAT).replace(tzinfo=datetime.UTC)
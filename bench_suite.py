@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# ruff: noqa: T201
+"""
+Times each stage of a Poster run against a synthetic month of posts, offline.
+
+Writes a month file with --lines posts (see synthetic_posts.py) for the
+current month, and points a Poster at it with years_ahead set so that it's
+"now". Redis and the Twitter, Mastodon and Bluesky clients are the fakes in
+fakes.py, so nothing leaves this machine.
+
+Each stage is timed with timeit and the median time per call is reported.
+The time taken to import poster.py and worker.py, as a cron job or a restarted
+process does before anything else, is also timed, in new Python processes,
+using `python -X importtime`; --imports lists the slowest modules they import.
+With --json the results are also written to a file; with --baseline they're
+compared with an earlier --json file, and we exit with 1 if any stage is
+more than --tolerance slower than it was.
+
+    $ ./bench_suite.py --lines 300
+    $ ./bench_suite.py --lines 1000000 --json baseline.json
+    $ ./bench_suite.py --lines 1000000 --baseline baseline.json
+    $ ./bench_suite.py --imports 20
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from contextlib import closing
+
+import benchmark
+from post_index import PostIndex
+from post_parser import parse_line, parse_posts
+from synthetic_posts import write_month
+
+# The year of the synthetic posts:
+YEAR = 1660
+
+# Modules whose import time is timed, as stages called eg "import_poster":
+IMPORTS = ("poster", "worker")
+
+
+def make_suite_poster(root, lines):
+    """
+    A Poster that uses a synthetic month file, of `lines` posts, in
+    root/posts/, fake Redis and fake clients, and no pacing.
+    """
+    p = benchmark.make_burst_poster(latency=0)
+    p.logger.setLevel(logging.WARNING)
+
+    p.use_outbox = False
+
+    local_time_now = datetime.datetime.now(p.local_tz)
+    p.years_ahead = local_time_now.year - YEAR
+    write_month(root, YEAR, local_time_now.month, lines)
+
+    p.posts_dir = os.path.join(root, "posts")
+    p.post_index = PostIndex(p.posts_dir, os.path.join(root, ".post_index"))
+    benchmark.make_unpaced(p)
+    return p
+
+
+def get_stages(p):
+    """
+    Returns a dict of stage name -> function to time, for Poster `p`.
+    """
+    local_time_now = datetime.datetime.now(p.local_tz)
+    last_run_time = (local_time_now - datetime.timedelta(minutes=1)).astimezone(
+        datetime.UTC
+    )
+
+    with open(p.get_month_path(local_time_now), "rb") as file:
+        content = file.read()
+    posts = list(parse_posts(content))
+    line = content[: content.index(b"\n") + 1]
+    post = posts[len(posts) // 2]
+
+    def get_posts_to_send():
+        with closing(p.iter_month_posts(local_time_now)) as month_posts:
+            return p.get_posts_to_send(month_posts, last_run_time, local_time_now)
+
+    def start(*, use_post_index):
+        def run():
+            p.use_post_index = use_post_index
+            p.redis.set(
+                "last_run_time",
+                (
+                    datetime.datetime.now(datetime.UTC) - datetime.timedelta(minutes=1)
+                ).strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            p.start()
+
+        return run
+
+    # Make sure the index has been built before we time using it.
+    p.post_index.get_year(YEAR)
+
+    return {
+        "parse_line": lambda: parse_line(line),
+        "parse_posts": lambda: list(parse_posts(content)),
+        "iter_month_posts": lambda: list(p.iter_month_posts(local_time_now)),
+        "modernize_time": lambda: p.modernize_time(post),
+        "get_posts_to_send": get_posts_to_send,
+        "get_posts_to_send_from_index": lambda: p.get_posts_to_send_from_index(
+            last_run_time, local_time_now
+        ),
+        "start_month_file": start(use_post_index=False),
+        "start_post_index": start(use_post_index=True),
+    }
+
+
+def time_stage(func, repeat):
+    """
+    Returns a dict of the median seconds per call of func(), and how many
+    times it was called.
+    """
+    timer = timeit.Timer(func)
+    # Enough calls to take at least 0.2 seconds:
+    number, _ = timer.autorange()
+    timings = [seconds / number for seconds in timer.repeat(repeat, number)]
+    return {"seconds": statistics.median(timings), "calls": number * repeat}
+
+
+def get_import_times(module):
+    """
+    Imports `module` in a new Python process and returns a list of
+    (name, self seconds, cumulative seconds) for it and every module it
+    imported, as reported by `python -X importtime`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = []
+    # Lines are like "import time:       278 |       3015 |   zoneinfo",
+    # in microseconds, after a header line.
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        if own.strip().isdigit():
+            times.append(
+                (name.strip(), int(own) / 1_000_000, int(cumulative) / 1_000_000)
+            )
+    return times
+
+
+def time_import(module, repeat):
+    """
+    Returns a dict of the median seconds it takes to import `module` in a new
+    process, and how many times it was imported.
+    """
+    timings = []
+    for _ in range(repeat):
+        times = get_import_times(module)
+        timings.append(next(t for name, _, t in times if name == module))
+    return {"seconds": statistics.median(timings), "calls": repeat}
+
+
+def print_slowest_imports(count):
+    "Prints the `count` modules that take longest to import themselves."
+    times = {}
+    for module in IMPORTS:
+        times.update((name, own) for name, own, _ in get_import_times(module))
+
+    print(f"\n{'slowest imports':<30} {'ms':>12}")
+    for name, own in sorted(times.items(), key=lambda t: -t[1])[:count]:
+        print(f"{name:<30} {own * 1000:12.4f}")
+
+
+def run_suite(lines, repeat):
+    "Returns a dict of the results of timing every stage."
+    stages = {f"import_{module}": time_import(module, repeat) for module in IMPORTS}
+
+    with tempfile.TemporaryDirectory() as root:
+        p = make_suite_poster(root, lines)
+        stages.update(
+            (name, time_stage(func, repeat)) for name, func in get_stages(p).items()
+        )
+
+    return {
+        "lines": lines,
+        "python": platform.python_version(),
+        "stages": stages,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each stage's time compared with the baseline's.
+    Returns a list of the names of stages that are slower than `tolerance`
+    allows.
+    """
+    regressions = []
+
+    print(f"\n{'stage':<30} {'ms per call':>12} {'baseline':>12} {'change':>8}")
+
+    for name, stage in results["stages"].items():
+        base = baseline["stages"].get(name)
+
+        if base is None:
+            print(f"{name:<30} {stage['seconds'] * 1000:12.4f} {'-':>12}")
+            continue
+
+        change = stage["seconds"] / base["seconds"] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  SLOWER"
+
+        print(
+            f"{name:<30} {stage['seconds'] * 1000:12.4f} "
+            f"{base['seconds'] * 1000:12.4f} {change:+8.1%}{flag}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--lines", type=int, default=1000, help="Posts in the month file (1000)"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Times to time each stage (5)"
+    )
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare with results in this file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="How much slower than the baseline a stage can be (0.25 = 25%%)",
+    )
+    parser.add_argument(
+        "--imports",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Also list the N modules that are slowest to import",
+    )
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["lines"] != args.lines:
+            parser.error(f"The baseline is for --lines {baseline['lines']}")
+
+    results = run_suite(args.lines, args.repeat)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.imports:
+        print_slowest_imports(args.imports)
+
+    if baseline is None:
+        print(f"\n{'stage':<30} {'ms per call':>12}")
+        for name, stage in results["stages"].items():
+            print(f"{name:<30} {stage['seconds'] * 1000:12.4f}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if regressions:
+        print(
+            f"\n{len(regressions)} stage(s) more than {args.tolerance:.0%} slower "
+            "than the baseline."
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# ruff: noqa: T201
+"""
+Measures how long it takes Poster to work out which posts are due on each run.
+
+Compares reading and parsing the whole of the month's file with looking the
+posts up in the prebuilt post index (see post_index.py).
+
+Also measures how fast post_parser.py parses every file in posts/, compared
+with matching each line on its own.
+
+With --burst it also times sending a burst of posts to all three networks, one
+network after another and all at the same time, using the fake clients in
+fakes.py. Or, with --servers, using the real clients, paced as usual, sending
+to the fake APIs in fake_servers.py, which can also fail some requests.
+
+    $ ./benchmark.py
+    $ ./benchmark.py --ticks 5000
+    $ ./benchmark.py --burst 3 --latency 0.5
+    $ ./benchmark.py --burst 10 --latency 0.1 --servers --error-rate 0.1
+"""
+
+import argparse
+import datetime
+import os
+import random
+import re
+import statistics
+import time
+from contextlib import closing
+from glob import glob
+
+import fake_servers
+import fakes
+import poster
+from pacer import Pacer
+from post_parser import POST_PATTERN, parse_posts
+
+
+def make_poster():
+    "A Poster that won't post anything, whatever's in config/environment."
+    p = poster.Poster()
+    # FakeRedis can't run the lease's scripts, and there's only one of us.
+    p.run_lease_seconds = 0
+    p.setup_state()
+    p.twitter_api = None
+    p.mastodon_api = None
+    p.atproto_handle = ""
+    return p
+
+
+def random_ticks(p, count, seed=1):
+    """
+    Returns a list of `count` (last_run_time, local_time_now) tuples, for
+    times spread across all the years of posts, each one minute apart.
+    """
+    rng = random.Random(seed)
+    years = sorted(int(d) for d in os.listdir(p.posts_dir) if d.isdigit())
+    ticks = []
+
+    while len(ticks) < count:
+        year = rng.choice(years)
+        month = rng.randint(1, 12)
+        if not os.path.exists(os.path.join(p.posts_dir, str(year), f"{month:02d}.txt")):
+            continue
+        local_time_now = datetime.datetime(
+            year + p.years_ahead,
+            month,
+            rng.randint(1, 28),
+            rng.randint(0, 23),
+            rng.randint(0, 59),
+            rng.randint(0, 59),
+            tzinfo=p.local_tz,
+        )
+        last_run_time = (local_time_now - datetime.timedelta(minutes=1)).astimezone(
+            datetime.UTC
+        )
+        ticks.append((last_run_time, local_time_now))
+
+    return ticks
+
+
+def time_ticks(func, ticks):
+    "Calls func(last_run_time, local_time_now) for each tick; returns timings."
+    timings = []
+    for last_run_time, local_time_now in ticks:
+        start = time.perf_counter()
+        func(last_run_time, local_time_now)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_month_file(p, ticks):
+    "Read and parse the month's file, as far as we need to."
+
+    def run(last_run_time, local_time_now):
+        with closing(p.iter_month_posts(local_time_now)) as month_posts:
+            return p.get_posts_to_send(month_posts, last_run_time, local_time_now)
+
+    return time_ticks(run, ticks)
+
+
+def bench_post_index(p, ticks):
+    "Using the post index; includes checking the index is up to date."
+    return time_ticks(p.get_posts_to_send_from_index, ticks)
+
+
+def read_posts_files(p):
+    "Returns a list of the contents (bytes) of every file in posts/."
+    contents = []
+    for path in sorted(glob(os.path.join(p.posts_dir, "*", "*.txt"))):
+        with open(path, "rb") as file:
+            contents.append(file.read())
+    return contents
+
+
+def parse_by_line(content):
+    """
+    For comparison, the way posts used to be parsed: searching each line on
+    its own, with an uncompiled pattern, and building a dict per post.
+    """
+    pattern = POST_PATTERN.pattern.decode()
+    posts = []
+    for line in content.decode("utf-8").splitlines():
+        line_match = re.search(pattern, line.strip(), re.VERBOSE)
+        if line_match:
+            y, m, d, hh, mm, kind, text = line_match.groups()
+            posts.append(
+                {
+                    "time": f"{y}-{m}-{d} {hh}:{mm}",
+                    "text": text.strip(),
+                    "is_reply": kind == "r",
+                }
+            )
+    return posts
+
+
+def bench_parser(contents, parse, repeat=5):
+    """
+    Returns (fastest seconds, number of posts) for parsing all of `contents`
+    with parse(content), which returns an iterable of posts.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(len(list(parse(content))) for content in contents)
+        timings.append(time.perf_counter() - start)
+    return min(timings), count
+
+
+def make_burst_poster(latency):
+    "A Poster that sends to fake clients that each take `latency` seconds."
+    p = make_poster()
+    p.redis = fakes.FakeRedis()
+    p.setup_state()
+    p.twitter_api = fakes.FakeTwitterClient(latency)
+    p.mastodon_api = fakes.FakeMastodon(latency)
+    p.atproto_handle = "benchmark"
+    p.make_atproto_client = lambda: fakes.FakeATProtoClient(latency)
+    return p
+
+
+def make_unpaced(p):
+    "Make Poster p send as fast as it can, never waiting or retrying."
+    p.pacers = {
+        name: Pacer(name, p.logger, lambda e: False, rate=1e9, burst=1e9)
+        for name in p.pacers
+    }
+
+
+def make_server_poster(url):
+    """
+    A Poster that sends to the fake_servers.py server at `url`, using the real
+    API clients.
+    """
+    p = make_poster()
+    p.twitter_consumer_key = p.twitter_consumer_secret = "benchmark"
+    p.twitter_access_token = p.twitter_access_token_secret = "benchmark"
+    p.mastodon_client_id = p.mastodon_client_secret = "benchmark"
+    p.mastodon_access_token = "benchmark"
+    p.atproto_handle = p.atproto_password = "benchmark"
+    p.twitter_api_base_url = p.mastodon_api_base_url = p.atproto_base_url = url
+    p.setup_clients()
+    p.redis = fakes.FakeRedis()
+    p.setup_state()
+    return p
+
+
+def bench_burst(count, latency, *, servers=False, error_rate=0):
+    """
+    Returns the seconds it takes to send `count` posts to all three networks,
+    first one network after another, and then concurrently.
+
+    If `servers` is True, the posts are sent to fake_servers.py, which fails
+    `error_rate` of the requests, and its stats are printed after each run.
+    """
+    posts = [
+        {
+            "time": f"1660-01-01 12:{n:02d}",
+            "text": f"Post {n}",
+            "is_reply": n > 0,
+            "in_reply_to_time": f"1660-01-01 12:{n - 1:02d}" if n > 0 else None,
+        }
+        for n in range(count)
+    ]
+
+    def send(one_at_a_time):
+        server = None
+        if servers:
+            networks = fake_servers.FakeNetworks(latency, error_rate, seed=1)
+            server = fake_servers.FakeServer(networks)
+            server.start()
+            p = make_server_poster(server.url)
+        else:
+            p = make_burst_poster(latency)
+
+        start = time.perf_counter()
+        if one_at_a_time:
+            p.send_tweets(posts)
+            p.send_toots(posts)
+            p.send_skeets(posts)
+        else:
+            p.send_to_networks(posts)
+        seconds = time.perf_counter() - start
+
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            for network, stats in networks.get_stats().items():
+                print(f"  {network:<10} {stats}")
+
+        return seconds
+
+    return send(one_at_a_time=True), send(one_at_a_time=False)
+
+
+def report(name, timings):
+    print(
+        f"{name:<12} "
+        f"mean {statistics.mean(timings) * 1000:8.3f} ms  "
+        f"median {statistics.median(timings) * 1000:8.3f} ms  "
+        f"max {max(timings) * 1000:8.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--ticks", type=int, default=1000, help="How many runs to time (1000)"
+    )
+    parser.add_argument(
+        "--burst", type=int, default=0, help="Also time sending this many posts"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.3,
+        help="Seconds each fake API call takes, with --burst (0.3)",
+    )
+    parser.add_argument(
+        "--servers",
+        action="store_true",
+        help="With --burst, send to fake_servers.py using the real clients",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Fraction of requests that fail, with --servers (0)",
+    )
+    args = parser.parse_args()
+
+    p = make_poster()
+    ticks = random_ticks(p, args.ticks)
+
+    # Make sure the index is built, so we're only timing using it:
+    for _, local_time_now in ticks:
+        p.post_index.get_year(local_time_now.year - p.years_ahead)
+
+    print(f"Per-run cost of finding due posts, over {len(ticks):,} runs:\n")
+    report("month file", bench_month_file(p, ticks))
+    report("post index", bench_post_index(p, ticks))
+
+    contents = read_posts_files(p)
+    megabytes = sum(len(content) for content in contents) / 1_000_000
+    print(f"\nParsing all {len(contents)} files in posts/ ({megabytes:.1f} MB):\n")
+    for name, parse in (("by line", parse_by_line), ("post_parser", parse_posts)):
+        seconds, count = bench_parser(contents, parse)
+        print(
+            f"{name:<12} {seconds * 1000:8.1f} ms  "
+            f"{megabytes / seconds:6.1f} MB/s  {count / seconds:10,.0f} posts/s"
+        )
+
+    if args.burst:
+        sequential, concurrent = bench_burst(
+            args.burst, args.latency, servers=args.servers, error_rate=args.error_rate
+        )
+        print(
+            f"\nEnd-to-end time to send a burst of {args.burst} posts to three "
+            f"networks, with {args.latency}s API latency:\n"
+        )
+        print(f"{'sequential':<12} {sequential:8.2f} s")
+        print(f"{'concurrent':<12} {concurrent:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
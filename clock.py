@@ -1,23 +1,30 @@
 #!/usr/bin/env python
 import logging
 
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
 
 import poster
+from due_scheduler import DueScheduler
 
 logging.basicConfig()
-scheduler = BackgroundScheduler()
+scheduler = BlockingScheduler()
 
+# One Poster for the life of the process, so that its config, Redis
+# connection pool, API clients and parsed posts are reused by every run.
+p = poster.Poster()
 
-@scheduler.scheduled_job("interval", minutes=1)
+if p.metrics_port:
+    p.metrics.serve(p.metrics_port)
+
+
+@scheduler.scheduled_job("interval", minutes=1, max_instances=1, coalesce=True)
 def timed_job():
-    # Yes, this should add this stuff to a queue, rather than running it
-    # directly. It doesn't.
-    p = poster.Poster()
+    # If UseOutbox is set, this only queues posts for worker.py to publish.
+    p.refresh()
     p.start()
 
 
-scheduler.start()
-
-while True:
-    pass
+if p.clock_mode == "due":
+    DueScheduler(p).run()
+else:
+    scheduler.start()
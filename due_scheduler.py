@@ -0,0 +1,217 @@
+"""
+Runs Poster.start() when the next post is due, rather than once a minute.
+
+Upcoming due times are read from the post index, using the same
+Poster.modernize_time() rules as when posting (so `years_ahead`, the
+`timezone`, and skipped 29ths of February all behave the same). They're kept
+in a min-heap and we sleep until the earliest one.
+
+If CatchUp / CATCH_UP is on we also run at least every half of
+max_time_window, even if nothing's due, so that last_run_time keeps moving.
+Otherwise a gap of hours between posts would look like missed runs, and open
+a backlog of posts that weren't actually missed.
+
+Used by clock.py if the ClockMode / CLOCK_MODE setting is "due".
+"""
+
+import collections
+import datetime
+import heapq
+import statistics
+import threading
+import time
+
+
+class DueScheduler:
+    """
+    poster - A Poster object
+    horizon - timedelta; how far ahead to load due times from the index
+    max_sleep - most seconds to sleep before checking the clock again, so
+        that we notice if the system clock jumps.
+    """
+
+    def __init__(self, poster, horizon=None, max_sleep=300):
+        self.poster = poster
+        self.horizon = horizon or datetime.timedelta(hours=6)
+        self.max_sleep = max_sleep
+
+        # Min-heap of (due timestamp, post time string) tuples:
+        self.heap = []
+        # The post time strings that are in the heap:
+        self.queued = set()
+        # Timestamp up to which we've loaded due times into the heap:
+        self.loaded_until = None
+        # When we last checked the time, to spot the clock going backwards:
+        self.last_checked = None
+        # When we last ran the Poster:
+        self.last_started = None
+
+        # Seconds between each post being due and the run for it finishing:
+        self.drifts = collections.deque(maxlen=1000)
+
+        self.stopping = threading.Event()
+
+    def run(self):
+        "Keep running until stop() is called."
+        # Send anything that's due now, and make sure last_run_time is set.
+        self.start()
+
+        while not self.stopping.is_set():
+            self.tick()
+
+    def stop(self):
+        self.stopping.set()
+
+    def start(self):
+        self.last_started = time.time()
+        self.poster.start()
+
+    def get_keepalive(self):
+        """
+        Most seconds to go between runs, even if nothing's due, or None if
+        there's no limit.
+        """
+        if not self.poster.catch_up:
+            return None
+        return self.poster.max_time_window * 60 / 2
+
+    def tick(self):
+        """
+        Either sleep until the next post is due (or for max_sleep seconds,
+        whichever is sooner) or, if posts are due, run the Poster.
+        """
+        now = time.time()
+
+        if self.last_checked is not None and now < self.last_checked - 60:
+            self.poster.logger.warning(
+                "The clock has gone backwards; reloading due times"
+            )
+            self.heap = []
+            self.queued = set()
+            self.loaded_until = None
+        self.last_checked = now
+
+        if self.loaded_until is None or self.loaded_until < now:
+            self.load(now, now + self.horizon.total_seconds())
+        elif self.loaded_until - now < self.horizon.total_seconds() / 2:
+            self.load(self.loaded_until, now + self.horizon.total_seconds())
+
+        if not self.heap or self.heap[0][0] > now:
+            keepalive = self.get_keepalive()
+            if keepalive is None or self.last_started is None:
+                next_run = now + self.max_sleep
+            else:
+                next_run = self.last_started + keepalive
+                if next_run <= now:
+                    # Nothing's due, but keep last_run_time moving.
+                    self.poster.refresh()
+                    self.start()
+                    return
+
+            next_due = self.heap[0][0] if self.heap else next_run
+            self.stopping.wait(min(next_due - now, next_run - now, self.max_sleep))
+            return
+
+        due_posts = []
+        while self.heap and self.heap[0][0] <= now:
+            due, post_time = heapq.heappop(self.heap)
+            self.queued.discard(post_time)
+            due_posts.append((due, post_time))
+
+        self.poster.refresh()
+        self.start()
+        finished = time.time()
+
+        for due, post_time in due_posts:
+            drift = finished - due
+            self.drifts.append(drift)
+            self.poster.logger.info(
+                "Finished the run for post %s %.3f seconds after it was due",
+                post_time,
+                drift,
+            )
+
+        summary = self.drift_summary()
+        self.poster.logger.info(
+            "Drift over last %s posts: mean %.3fs, median %.3fs, max %.3fs",
+            summary["count"],
+            summary["mean"],
+            summary["median"],
+            summary["max"],
+        )
+
+    def load(self, start, end):
+        """
+        Add the due times of all posts that are due between the `start` and
+        `end` timestamps to the heap.
+        """
+        local_tz = self.poster.local_tz
+        local_start = datetime.datetime.fromtimestamp(start, local_tz)
+        local_end = datetime.datetime.fromtimestamp(end, local_tz)
+
+        first_year = local_start.year - self.poster.years_ahead
+        last_year = local_end.year - self.poster.years_ahead
+
+        for year in range(first_year, last_year + 1):
+            year_index = self.poster.post_index.get_year(year)
+
+            if year_index is None:
+                self.poster.logger.debug("No posts directory for %s", year)
+                continue
+
+            from_key = self.poster.get_index_key(local_start, year)
+            before_key = self.poster.get_index_key(local_end, year, round_up=True)
+
+            for i in year_index.range(from_key, before_key):
+                post_time = year_index.time(i)
+
+                if post_time in self.queued:
+                    continue
+
+                local_modern_post_time = self.poster.modernize_time(post_time)
+
+                if local_modern_post_time:
+                    heapq.heappush(
+                        self.heap,
+                        (self.due_timestamp(local_modern_post_time), post_time),
+                    )
+                    self.queued.add(post_time)
+
+        self.loaded_until = end
+        self.poster.logger.debug(
+            "Loaded due times until %s; %s posts queued", local_end, len(self.heap)
+        )
+
+    def due_timestamp(self, local_modern_post_time):
+        """
+        The timestamp at which the local wall-clock time first passes
+        local_modern_post_time, which is when Poster.start() will find it due.
+
+        If the time is repeated when the clocks go back, that's the first
+        occurrence. If the time doesn't exist because the clocks go forward,
+        that's the moment they go forward.
+        """
+        naive = local_modern_post_time.replace(tzinfo=None)
+        utc_time = local_modern_post_time.replace(fold=0).astimezone(datetime.UTC)
+
+        if utc_time.astimezone(self.poster.local_tz).replace(tzinfo=None) == naive:
+            return utc_time.timestamp()
+
+        # It's in a gap. Step forward a minute at a time from the earlier of
+        # the two possible UTC times until the clocks have passed it.
+        utc_time = local_modern_post_time.replace(fold=1).astimezone(datetime.UTC)
+        while utc_time.astimezone(self.poster.local_tz).replace(tzinfo=None) < naive:
+            utc_time += datetime.timedelta(minutes=1)
+        return utc_time.timestamp()
+
+    def drift_summary(self):
+        "Returns a dict of stats about how late we've been running for posts."
+        if len(self.drifts) == 0:
+            return {"count": 0, "mean": 0, "median": 0, "max": 0}
+
+        return {
+            "count": len(self.drifts),
+            "mean": statistics.mean(self.drifts),
+            "median": statistics.median(self.drifts),
+            "max": max(self.drifts),
+        }
@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+# ruff: noqa: T201
+"""
+A local HTTP server that stands in for the Twitter, Mastodon and Bluesky APIs,
+for load testing Poster end to end without touching the real ones.
+
+It implements only the endpoints that Poster's clients use:
+
+    Twitter   POST /2/tweets                                (tweepy)
+    Mastodon  POST /api/v1/statuses                         (Mastodon.py)
+    Bluesky   POST /xrpc/com.atproto.server.createSession   (atproto)
+              POST /xrpc/com.atproto.server.refreshSession
+              GET  /xrpc/app.bsky.actor.getProfile
+              POST /xrpc/com.atproto.repo.createRecord
+
+and replies with IDs, URIs and CIDs that look like the real ones, and with
+each network's own style of rate limit headers. Replies to posts it hasn't
+seen are rejected, as they would be, so broken reply threading shows up.
+
+Each response can be delayed by --latency seconds, and a fraction of them
+can fail with a 503 (--error-rate) or a 429 (--throttle-rate). With --limit,
+each network allows that many requests per --window seconds, and then 429s.
+
+    $ ./fake_servers.py --port 8000 --latency 0.2 --error-rate 0.05
+
+Then point Poster at it with these settings (or their config file
+equivalents, TwitterApiBaseUrl, MastodonApiBaseUrl and ATProtoBaseUrl):
+
+    TWITTER_API_BASE_URL=http://127.0.0.1:8000
+    MASTODON_API_BASE_URL=http://127.0.0.1:8000
+    ATPROTO_BASE_URL=http://127.0.0.1:8000
+
+Any credentials will do. GET /_fake/stats returns how many responses of each
+status each network has sent, and how many posts it has.
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import html
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# (method, path) -> (network, name of the FakeNetworks method that handles it)
+ROUTES = {
+    ("POST", "/2/tweets"): ("twitter", "create_tweet"),
+    ("POST", "/api/v1/statuses"): ("mastodon", "status_post"),
+    ("POST", "/xrpc/com.atproto.server.createSession"): ("bluesky", "create_session"),
+    ("POST", "/xrpc/com.atproto.server.refreshSession"): (
+        "bluesky",
+        "refresh_session",
+    ),
+    ("GET", "/xrpc/app.bsky.actor.getProfile"): ("bluesky", "get_profile"),
+    ("POST", "/xrpc/com.atproto.repo.createRecord"): ("bluesky", "create_record"),
+}
+
+NETWORKS = ("twitter", "mastodon", "bluesky")
+
+# Twitter's IDs count milliseconds from this time, in ms:
+TWITTER_EPOCH = 1288834974657
+
+# The characters of an AT Protocol record key (a TID):
+TID_CHARS = "234567abcdefghijklmnopqrstuvwxyz"
+
+
+class FakeNetworks:
+    """
+    What the fake networks have been sent, and how they should behave.
+    Shared by all the server's request handler threads.
+
+    latency - Seconds to wait before each response.
+    error_rate - Fraction of requests that fail with a 503.
+    throttle_rate - Fraction of requests that fail with a 429.
+    limit - Requests each network allows per `window`, or None for no limit.
+    window - Length of each network's rate limit window, in seconds.
+    seed - For the random errors, so that a run can be repeated.
+    """
+
+    def __init__(
+        self,
+        latency=0,
+        error_rate=0,
+        throttle_rate=0,
+        limit=None,
+        window=900,
+        seed=None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.limit = limit
+        self.window = window
+
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.sequence = itertools.count()
+
+        # network -> {id: (text, id it replied to, or None)}
+        # (For Bluesky the id is the post's URI.)
+        self.posts = {network: {} for network in NETWORKS}
+        # network -> Counter of response statuses
+        self.statuses = {network: Counter() for network in NETWORKS}
+        # network -> [time the window resets, requests left in it]
+        self.windows = {}
+        # Bluesky URI -> CID
+        self.cids = {}
+
+    def check_limits(self, network):
+        """
+        Decide whether to fail this request.
+        Returns a tuple of (status, or None to carry on; rate limit headers).
+        """
+        now = time.time()
+
+        with self.lock:
+            headers = {}
+
+            if self.limit is not None:
+                reset, remaining = self.windows.get(network, (0, 0))
+                if now >= reset:
+                    reset, remaining = now + self.window, self.limit
+                remaining -= 1
+                self.windows[network] = [reset, remaining]
+                headers = rate_limit_headers(
+                    network, self.limit, max(remaining, 0), reset, self.window
+                )
+                if remaining < 0:
+                    return 429, headers
+
+            chance = self.random.random()
+
+        if chance < self.throttle_rate:
+            return 429, headers
+        if chance < self.throttle_rate + self.error_rate:
+            return 503, headers
+        return None, headers
+
+    def record_status(self, network, status):
+        with self.lock:
+            self.statuses[network][status] += 1
+
+    def get_stats(self):
+        "Returns a dict of the statuses each network has sent, and its posts."
+        with self.lock:
+            return {
+                network: {
+                    "statuses": {str(k): v for k, v in self.statuses[network].items()},
+                    "posts": len(self.posts[network]),
+                }
+                for network in NETWORKS
+            }
+
+    def add_post(self, network, post_id, text, reply_to):
+        """
+        Store a new post. Returns False if it replies to a post we don't have.
+        """
+        with self.lock:
+            if reply_to is not None and reply_to not in self.posts[network]:
+                return False
+            self.posts[network][post_id] = (text, reply_to)
+            return True
+
+    # Twitter
+
+    def create_tweet(self, request):
+        body = request.json()
+        tweet_id = str(
+            ((int(time.time() * 1000) - TWITTER_EPOCH) << 22)
+            | (next(self.sequence) % (1 << 22))
+        )
+        reply_to = body.get("reply", {}).get("in_reply_to_tweet_id")
+
+        if not self.add_post("twitter", tweet_id, body["text"], reply_to):
+            return 400, {
+                "title": "Invalid Request",
+                "detail": "The tweet you are replying to does not exist.",
+            }
+
+        return 201, {
+            "data": {
+                "id": tweet_id,
+                "text": body["text"],
+                "edit_history_tweet_ids": [tweet_id],
+            }
+        }
+
+    # Mastodon
+
+    def status_post(self, request):
+        body = request.form_or_json()
+        status_id = str(
+            (int(time.time() * 1000) << 16) | (next(self.sequence) % (1 << 16))
+        )
+        reply_to = body.get("in_reply_to_id") or None
+        if reply_to is not None:
+            reply_to = str(reply_to)
+
+        if not self.add_post("mastodon", status_id, body["status"], reply_to):
+            return 404, {"error": "Record not found"}
+
+        base_url = f"http://{request.headers['Host']}"
+        return 200, {
+            "id": status_id,
+            "uri": f"{base_url}/users/fake/statuses/{status_id}",
+            "url": f"{base_url}/@fake/{status_id}",
+            "created_at": now_iso(),
+            "content": f"<p>{html.escape(body['status'])}</p>",
+            "in_reply_to_id": reply_to,
+            "visibility": body.get("visibility") or "public",
+            "account": {"id": "1", "username": "fake", "acct": "fake"},
+        }
+
+    # Bluesky
+
+    def create_session(self, request):
+        body = request.json()
+        handle = body["identifier"]
+        if "." not in handle:
+            handle = f"{handle}.test"
+        return 200, make_session(handle)
+
+    def refresh_session(self, request):
+        payload = read_jwt(request.headers.get("Authorization", ""))
+        if payload is None:
+            return 400, {"error": "ExpiredToken", "message": "Token is invalid"}
+        return 200, make_session(payload["handle"])
+
+    def get_profile(self, request):
+        handle = request.query().get("actor", ["fake.test"])[0]
+        if handle.startswith("did:"):
+            handle = "fake.test"
+        return 200, {"did": make_did(handle), "handle": handle, "displayName": handle}
+
+    def create_record(self, request):
+        payload = read_jwt(request.headers.get("Authorization", ""))
+        if payload is None:
+            return 401, {"error": "AuthenticationRequired", "message": "No token"}
+
+        body = request.json()
+        record = body["record"]
+        uri = f"at://{body['repo']}/{body['collection']}/{make_tid()}"
+        cid = make_cid(json.dumps(record, sort_keys=True).encode())
+
+        parent = record.get("reply", {}).get("parent")
+        reply_to = None
+        if parent is not None:
+            reply_to = parent["uri"]
+            if self.cids.get(reply_to) != parent["cid"]:
+                return 400, {
+                    "error": "InvalidRequest",
+                    "message": "Could not find the post being replied to",
+                }
+
+        if not self.add_post("bluesky", uri, record["text"], reply_to):
+            return 400, {"error": "InvalidRequest", "message": "Unknown parent"}
+
+        with self.lock:
+            self.cids[uri] = cid
+
+        return 200, {
+            "uri": uri,
+            "cid": cid,
+            "commit": {"cid": make_cid(uri.encode()), "rev": make_tid()},
+            "validationStatus": "valid",
+        }
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    "Handles one request to a FakeServer."
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/_fake/stats":
+            self.respond(200, self.server.networks.get_stats())
+        else:
+            self.handle_route("GET")
+
+    def do_POST(self):
+        self.handle_route("POST")
+
+    def handle_route(self, method):
+        # Always read the body, so the connection can be reused.
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length)
+
+        route = ROUTES.get((method, urlsplit(self.path).path))
+        if route is None:
+            self.respond(404, {"error": "MethodNotImplemented"})
+            return
+
+        network, name = route
+        networks = self.server.networks
+
+        if networks.latency:
+            time.sleep(networks.latency)
+
+        status, headers = networks.check_limits(network)
+        if status == 429:
+            body = {"error": "RateLimitExceeded", "message": "Too Many Requests"}
+        elif status is not None:
+            body = {"error": "ServiceUnavailable", "message": "Try again later"}
+        else:
+            status, body = getattr(networks, name)(self)
+
+        networks.record_status(network, status)
+        self.respond(status, body, headers)
+
+    def respond(self, status, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def json(self):
+        return json.loads(self.body or b"{}")
+
+    def form_or_json(self):
+        "The body's fields, whether it was sent as JSON or as a form."
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return self.json()
+        fields = parse_qs(self.body.decode(), keep_blank_values=True)
+        return {k: v[0] for k, v in fields.items()}
+
+    def query(self):
+        return parse_qs(urlsplit(self.path).query)
+
+    def log_message(self, format, *args):
+        # Don't print a line for every request.
+        pass
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    The server. Use serve_forever(), or start() to run it in a background
+    thread, eg in a benchmark:
+
+        server = FakeServer(FakeNetworks(latency=0.1))
+        server.start()
+        ... point Poster at server.url ...
+        server.shutdown()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, networks, host="127.0.0.1", port=0):
+        super().__init__((host, port), FakeRequestHandler)
+        self.networks = networks
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        "Serve requests in a background thread."
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def rate_limit_headers(network, limit, remaining, reset, window):
+    "Returns a dict of rate limit headers in the style `network` uses."
+    if network == "twitter":
+        return {
+            "x-rate-limit-limit": str(limit),
+            "x-rate-limit-remaining": str(remaining),
+            "x-rate-limit-reset": str(int(reset)),
+        }
+    elif network == "mastodon":
+        reset_time = datetime.datetime.fromtimestamp(reset, datetime.UTC)
+        return {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": reset_time.isoformat(timespec="microseconds"),
+        }
+    else:
+        return {
+            "RateLimit-Limit": str(limit),
+            "RateLimit-Remaining": str(remaining),
+            "RateLimit-Reset": str(int(reset)),
+            "RateLimit-Policy": f"{limit};w={window}",
+        }
+
+
+def now_iso():
+    return datetime.datetime.now(datetime.UTC).isoformat(timespec="milliseconds")
+
+
+def b32(data):
+    return base64.b32encode(data).decode().lower().rstrip("=")
+
+
+def make_did(handle):
+    "A did:plc that's always the same for the same handle."
+    return f"did:plc:{b32(hashlib.sha256(handle.encode()).digest())[:24]}"
+
+
+def make_cid(data):
+    "A CIDv1 (dag-cbor, sha-256) for some bytes, as used for AT Protocol records."
+    return "b" + b32(bytes([0x01, 0x71, 0x12, 0x20]) + hashlib.sha256(data).digest())
+
+
+# So that TIDs made in the same microsecond are still different:
+tid_clock = itertools.count()
+
+
+def make_tid():
+    "A timestamp identifier, which is what a post's record key is."
+    n = (time.time_ns() // 1000) << 10 | (next(tid_clock) % 1024)
+    return "".join(TID_CHARS[(n >> (5 * i)) & 31] for i in reversed(range(13)))
+
+
+def make_jwt(payload):
+    "An unsigned JWT; the atproto client only reads the payload."
+    header = base64.urlsafe_b64encode(b'{"alg":"none","typ":"JWT"}').rstrip(b"=")
+    body = base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b"=")
+    return f"{header.decode()}.{body.decode()}.fake"
+
+
+def read_jwt(authorization):
+    "Returns the payload of a 'Bearer <jwt>' header, or None if it's expired."
+    try:
+        payload = authorization.removeprefix("Bearer ").split(".")[1]
+        payload = json.loads(base64.urlsafe_b64decode(payload + "=="))
+    except (IndexError, ValueError):
+        return None
+    if payload.get("exp", 0) < time.time():
+        return None
+    return payload
+
+
+def make_session(handle):
+    "The response to createSession or refreshSession."
+    did = make_did(handle)
+    now = int(time.time())
+    claims = {"sub": did, "handle": handle, "iat": now}
+    return {
+        "did": did,
+        "handle": handle,
+        "accessJwt": make_jwt(
+            {**claims, "scope": "com.atproto.access", "exp": now + 2 * 60 * 60}
+        ),
+        "refreshJwt": make_jwt(
+            {**claims, "scope": "com.atproto.refresh", "exp": now + 90 * 24 * 60 * 60}
+        ),
+        "active": True,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1", help="(127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="(8000)")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Seconds per response (0)"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="Fraction of 503s (0)"
+    )
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0, help="Fraction of 429s (0)"
+    )
+    parser.add_argument(
+        "--limit", type=int, help="Requests per window for each network (no limit)"
+    )
+    parser.add_argument(
+        "--window", type=int, default=900, help="Rate limit window in seconds (900)"
+    )
+    parser.add_argument("--seed", type=int, help="For repeatable random errors")
+    args = parser.parse_args()
+
+    networks = FakeNetworks(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        limit=args.limit,
+        window=args.window,
+        seed=args.seed,
+    )
+    server = FakeServer(networks, args.host, args.port)
+    print(f"Serving fake Twitter, Mastodon and Bluesky APIs at {server.url}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(networks.get_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
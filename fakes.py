@@ -0,0 +1,163 @@
+"""
+In-memory stand-ins for Redis and the Twitter, Mastodon and Bluesky clients,
+so that Poster can be benchmarked without a database or network.
+
+Each fake client waits for `latency` seconds per call, to act like a remote
+API, and records what it was sent in its `posts` list.
+"""
+
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+from atproto import SessionEvent
+
+
+class FakeRedis:
+    "Enough of redis.Redis (with decode_responses=True) for Poster."
+
+    def __init__(self):
+        self.data = {}
+        self.mutex = threading.RLock()
+        # How many times we've been called, as if over the network:
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        # Count calls to any of the commands below as round trips.
+        command = getattr(self, f"_{name}", None)
+        if command is None:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.round_trips += 1
+            with self.mutex:
+                return command(*args, **kwargs)
+
+        return call
+
+    def pipeline(self, transaction=True):  # noqa: FBT002
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return self.mutex
+
+    def _get(self, key):
+        return self.data.get(key)
+
+    def _set(self, key, value):
+        self.data[key] = str(value)
+
+    def _mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def _hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {})
+        if field is not None:
+            fields[field] = str(value)
+        for k, v in (mapping or {}).items():
+            fields[k] = str(v)
+
+    def _expire(self, key, seconds):
+        return int(key in self.data)
+
+    def _getbit(self, key, offset):
+        return int(offset in self.data.get(key, set()))
+
+    def _setbit(self, key, offset, value):
+        bits = self.data.setdefault(key, set())
+        old = int(offset in bits)
+        if value:
+            bits.add(offset)
+        else:
+            bits.discard(offset)
+        return old
+
+    def _append(self, key, value):
+        self.data[key] = self.data.get(key, "") + str(value)
+        return len(self.data[key])
+
+
+class FakePipeline:
+    "Queues commands and runs them all, atomically, in one round trip."
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, f"_{name}")
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        self.redis.round_trips += 1
+        with self.redis.mutex:
+            results = [command(*args, **kw) for command, args, kw in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeClient:
+    def __init__(self, latency=0):
+        self.latency = latency
+        # List of (text, what it replied to) tuples:
+        self.posts = []
+        self.ids = itertools.count(1)
+
+    def record(self, text, reply_to):
+        time.sleep(self.latency)
+        self.posts.append((text, reply_to))
+        return next(self.ids)
+
+
+class FakeTwitterClient(FakeClient):
+    "Acts like tweepy.Client."
+
+    def create_tweet(self, text, in_reply_to_tweet_id=None):
+        tweet_id = self.record(text, in_reply_to_tweet_id)
+        return SimpleNamespace(data={"id": str(tweet_id), "text": text})
+
+
+class FakeMastodon(FakeClient):
+    "Acts like mastodon.Mastodon."
+
+    def status_post(self, status, in_reply_to_id=None):
+        status_id = self.record(status, in_reply_to_id)
+        return SimpleNamespace(id=status_id, content=status)
+
+
+class FakeATProtoClient(FakeClient):
+    "Acts like atproto.Client."
+
+    # How many times any FakeATProtoClient has logged in with a password:
+    password_logins = 0
+
+    def __init__(self, latency=0):
+        super().__init__(latency)
+        self.session_callbacks = []
+
+    def on_session_change(self, callback):
+        self.session_callbacks.append(callback)
+
+    def login(self, login=None, password=None, session_string=None):
+        time.sleep(self.latency)
+        if session_string is None:
+            FakeATProtoClient.password_logins += 1
+            session = SimpleNamespace(export=lambda: f"session-for-{login}")
+            for callback in self.session_callbacks:
+                callback(SessionEvent.CREATE, session)
+
+    def send_post(self, text, reply_to=None, facets=None):
+        post_id = self.record(text, reply_to)
+        return {
+            "uri": f"at://did:plc:fake/app.bsky.feed.post/{post_id}",
+            "cid": f"bafyfake{post_id}",
+        }
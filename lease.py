@@ -0,0 +1,197 @@
+"""
+A lease on running Poster.start(), kept in Redis, so that if several
+processes (eg redundant clock.py replicas) run at once only one of them, the
+leader, chooses and sends posts. Otherwise two runs could read the same
+last_run_time and send every post twice.
+
+The lease is a Redis key whose value is its owner's ID and a fencing token,
+eg "host:1234:9f2c 17", and which expires after `seconds`. Each time it's
+taken by a new owner the token goes up by one. While a run is going on the
+lease is renewed in a thread, and the leader keeps renewing it at the start
+of every run, so stays the leader until it stops or dies, when another
+process takes over after up to `seconds`.
+
+Before saving state the owner checks that the lease still has its token, and
+the transaction that saves it fails if anyone takes the lease in the
+meantime. So a process that has lost the lease (say, it was paused for longer
+than `seconds`) can't save a last_run_time over the new leader's.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+# Take the lease if it's free, or renew it if it's already ours.
+# Returns the fencing token, or nil if someone else has the lease.
+ACQUIRE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    local owner, token = string.match(value, '^(%S+) (%d+)$')
+    if owner == ARGV[1] then
+        redis.call('PEXPIRE', KEYS[1], ARGV[2])
+        return tonumber(token)
+    end
+    return nil
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1] .. ' ' .. token, 'PX', ARGV[2])
+return token
+"""
+
+# Renew the lease if it's still ours, with this token. Returns 1 if so, or 0.
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the lease if it's still ours, with this token.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLostError(Exception):
+    "Raised when saving state with a lease that's no longer ours."
+
+
+class Lease:
+    """
+    redis - A redis.Redis object
+    key - The Redis key of the lease. Its fencing token is kept at
+        "<key>:token".
+    seconds - How long the lease lasts unless it's renewed.
+    logger - For logging if we lose the lease.
+    """
+
+    def __init__(self, redis, key, seconds, logger):
+        self.redis = redis
+        self.key = key
+        self.token_key = f"{key}:token"
+        self.seconds = seconds
+        self.logger = logger
+
+        # Unique to this Poster, in this process, on this host:
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # The fencing token we got when we last took the lease, or None:
+        self.token = None
+        # time.monotonic() by when we must have renewed the lease:
+        self.expires_at = 0.0
+
+        # So that only one run in this process uses the lease at a time:
+        self.local_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.renewer = None
+
+        self.acquire_script = redis.register_script(ACQUIRE_SCRIPT)
+        self.renew_script = redis.register_script(RENEW_SCRIPT)
+        self.release_script = redis.register_script(RELEASE_SCRIPT)
+
+    @property
+    def value(self):
+        return f"{self.owner} {self.token}"
+
+    @property
+    def held(self):
+        "Do we still have the lease, as far as we know?"
+        return self.token is not None and time.monotonic() < self.expires_at
+
+    @property
+    def lost(self):
+        "Have we lost the lease during the run that's using it?"
+        return self.local_lock.locked() and not self.held
+
+    def acquire(self):
+        """
+        Take the lease, or renew it if we're already the leader, and keep
+        renewing it until done() is called.
+        Returns False if another process, or another run in this one, has it.
+        """
+        if not self.local_lock.acquire(blocking=False):
+            return False
+
+        try:
+            start = time.monotonic()
+            token = self.acquire_script(
+                keys=[self.key, self.token_key],
+                args=[self.owner, int(self.seconds * 1000)],
+            )
+        except BaseException:
+            self.local_lock.release()
+            raise
+
+        if token is None:
+            self.token = None
+            self.local_lock.release()
+            return False
+
+        if token != self.token:
+            self.logger.info("Took the run lease with fencing token %s", token)
+        self.token = token
+        self.expires_at = start + self.seconds
+
+        self.stopping.clear()
+        self.renewer = threading.Thread(
+            target=self.keep_renewing, name="lease", daemon=True
+        )
+        self.renewer.start()
+        return True
+
+    def keep_renewing(self):
+        "Renew the lease every third of its length until we're stopping."
+        while not self.stopping.wait(self.seconds / 3):
+            start = time.monotonic()
+            try:
+                renewed = self.renew_script(
+                    keys=[self.key], args=[self.value, int(self.seconds * 1000)]
+                )
+            except RedisError as e:
+                self.logger.warning("Couldn't renew the run lease: %s", e)
+                continue
+
+            if not renewed:
+                self.logger.error("Lost the run lease with token %s", self.token)
+                self.token = None
+                return
+            self.expires_at = start + self.seconds
+
+    def done(self):
+        "Stop renewing the lease, but keep it, so we stay the leader."
+        self.stopping.set()
+        if self.renewer is not None:
+            self.renewer.join()
+            self.renewer = None
+        self.local_lock.release()
+
+    def release(self):
+        "Give up the lease, so another process can take it straight away."
+        if self.token is not None:
+            self.release_script(keys=[self.key], args=[self.value])
+            self.token = None
+
+    def fence(self, pipe):
+        """
+        Make a transaction, in Redis pipeline `pipe`, only happen if we still
+        have the lease with our fencing token. Call this before adding the
+        transaction's commands. Raises LeaseLostError if we don't have it now,
+        and pipe.execute() raises WatchError if anyone else takes it before
+        then.
+
+        We watch the fencing token's key rather than the lease's, as renewing
+        the lease changes that, so our own renewals would make the
+        transaction fail. The token only changes when someone takes it.
+        """
+        pipe.watch(self.token_key)
+        if pipe.get(self.key) != self.value:
+            pipe.reset()
+            msg = f"The run lease with token {self.token} is no longer ours"
+            raise LeaseLostError(msg)
+        pipe.multi()
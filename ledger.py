@@ -0,0 +1,136 @@
+"""
+A record of every post that's been sent to each network, checked before
+sending, so a post is never sent twice. Otherwise the only record is each
+network's most recent post (see state.py), so a retry, an overlapping run, or
+widening max_time_window, could send a post again without anyone noticing.
+Only used if UsePostedLedger / USE_POSTED_LEDGER is 1 (the default).
+
+For each network, each year of the diary, and each YearsAhead that year has
+been posted with, a Bloom filter and twelve short strings are kept, eg:
+
+    posted:mastodon:1660:365 - A Bloom filter of the times of the posts sent:
+        65,536 bits, with 4 bits set for each post. So checking a post that
+        hasn't been sent costs one round trip, whatever the size of the
+        ledger, and with 2,000 posts in a year is wrongly "maybe" about
+        once in 5,000 checks.
+    posted:mastodon:1660:365:01 - Every post in January that's been sent,
+        in the order they were sent, as 8 hex digits each: its minute of the
+        month (4), and a hash of its text (4). Only read, with one GET of a
+        couple of KB, when the Bloom filter says "maybe", to be sure.
+
+A post is identified by its time, as no two posts have the same time. The
+hash of its text is so that if a post was edited after it was sent, we can
+say so, rather than send it again.
+
+Because YearsAhead is in the keys, replaying a year of the diary again later,
+with a new YearsAhead, starts a new ledger. The keys also expire a couple of
+years after their last post was added, so old ones don't pile up.
+
+A year of about 2,000 posts is about 8KB of filter and 16KB of records per
+network, so a decade is about 240KB per network, or 720KB for all three.
+"""
+
+import hashlib
+
+from post_parser import parse_time
+
+# Bits in each Bloom filter, and how many are set for each post. Each bit's
+# position is 16 bits of a hash of the post's time.
+FILTER_BITS = 2**16
+FILTER_HASHES = 4
+
+MINUTE_DIGITS = 4
+HASH_DIGITS = 4
+RECORD_DIGITS = MINUTE_DIGITS + HASH_DIGITS
+
+# How long a year's keys last after a post was last added to them:
+EXPIRE_SECONDS = 800 * 24 * 60 * 60
+
+
+class Ledger:
+    """
+    redis - A redis.Redis object
+    logger - For logging posts that have already been sent.
+    key - The start of the Redis keys of the filters and hashes.
+    years_ahead - The YearsAhead setting the posts are being sent with.
+    """
+
+    def __init__(self, redis, logger, key="posted", years_ahead=0):
+        self.redis = redis
+        self.logger = logger
+        self.key = key
+        self.years_ahead = years_ahead
+
+    def has(self, network, post):
+        """
+        Has `post` (a dict with "time" and "text") already been sent to
+        `network`, eg "bluesky"?
+        """
+        filter_key = self.get_filter_key(network, post)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for bit in get_bits(post["time"]):
+            pipe.getbit(filter_key, bit)
+        if not all(pipe.execute()):
+            return False
+
+        records = self.redis.get(self.get_records_key(network, post)) or ""
+        minute = get_minute(post["time"])
+        text_hash = None
+        for i in range(0, len(records), RECORD_DIGITS):
+            if records[i : i + MINUTE_DIGITS] == minute:
+                text_hash = records[i + MINUTE_DIGITS : i + RECORD_DIGITS]
+        if text_hash is None:
+            return False
+
+        if text_hash != get_text_hash(post["text"]):
+            self.logger.warning(
+                "%s was edited after it was sent to %s; not sending it again",
+                post["time"],
+                network,
+            )
+        return True
+
+    def add(self, network, post):
+        "Record that `post` has been sent to `network`."
+        filter_key = self.get_filter_key(network, post)
+        records_key = self.get_records_key(network, post)
+
+        pipe = self.redis.pipeline(transaction=True)
+        for bit in get_bits(post["time"]):
+            pipe.setbit(filter_key, bit, 1)
+        pipe.append(records_key, get_minute(post["time"]) + get_text_hash(post["text"]))
+        pipe.expire(filter_key, EXPIRE_SECONDS)
+        pipe.expire(records_key, EXPIRE_SECONDS)
+        pipe.execute()
+
+    def get_filter_key(self, network, post):
+        "eg 'posted:mastodon:1660:365'"
+        return f"{self.key}:{network}:{post['time'][:4]}:{self.years_ahead}"
+
+    def get_records_key(self, network, post):
+        "eg 'posted:mastodon:1660:365:01'"
+        return f"{self.get_filter_key(network, post)}:{post['time'][5:7]}"
+
+
+def get_bits(post_time):
+    "Returns the positions of the Bloom filter bits for post_time."
+    digest = hashlib.sha256(post_time.encode()).digest()
+    return [
+        int.from_bytes(digest[i * 2 : i * 2 + 2]) % FILTER_BITS
+        for i in range(FILTER_HASHES)
+    ]
+
+
+def get_minute(post_time):
+    """
+    Returns the minute of its month of post_time, in hex, eg
+    '1660-01-01 01:00' is '003c'.
+    """
+    _, _, day, hour, minute = parse_time(post_time)
+    return f"{((day - 1) * 24 + hour) * 60 + minute:0{MINUTE_DIGITS}x}"
+
+
+def get_text_hash(text):
+    "Returns a short hash of a post's text."
+    return hashlib.sha256(text.encode()).hexdigest()[:HASH_DIGITS]
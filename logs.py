@@ -0,0 +1,162 @@
+"""
+Sets up Poster's logging once per process, however many Posters it makes.
+
+Every Poster logs through the same "poster" logger (or, for one of several
+accounts, a child of it, like "poster.pepys"), which has a single handler: a
+QueueHandler. That only puts each record on a queue, and a QueueListener
+thread writes them to stdout, so a slow or blocked stdout never holds up
+finding or sending posts. Anything still queued is written when the process
+exits.
+
+Each Poster's logger is a RunLogger, which adds its account's name, and the
+ID of the run that's going on (see Poster.start()), to every record, and
+logs at the level of that account's Verbose setting. Lines
+are plain text, as they always were:
+
+    2025-01-01 12:00:30,123 | INFO | pepys | Tooting: ...
+
+or, if LogFormat / LOG_FORMAT is "json", one JSON object per line, so that
+all the lines from one run can be found by their "run_id":
+
+    {"time": "2025-01-01T12:00:30.123+00:00", "level": "INFO",
+     "logger": "poster.pepys", "account": "pepys", "run_id": "3f2a9c1b7d4e",
+     "message": "Tooting: ..."}
+"""
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import uuid
+
+# Verbose / VERBOSE setting -> the level to log at:
+LEVELS = {0: logging.WARNING, 1: logging.INFO, 2: logging.DEBUG}
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(account_prefix)s%(message)s"
+
+# Logger name -> its stdout handler, for loggers that are set up:
+_handlers = {}
+_lock = threading.Lock()
+
+
+class TextFormatter(logging.Formatter):
+    "The plain text format, with the account's name if there is one."
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        account = getattr(record, "account", "")
+        record.account_prefix = f"{account} | " if account else ""
+        return super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    "One JSON object per line."
+
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.UTC
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "account": getattr(record, "account", "") or None,
+            "run_id": getattr(record, "run_id", None),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        # QueueingHandler has already formatted any exception:
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data)
+
+
+FORMATTERS = {"text": TextFormatter, "json": JSONFormatter}
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue with their message, and any exception, already
+    formatted, as they can't be once they're on another thread. Unlike
+    QueueHandler, it keeps the exception separate from the message, as
+    exc_text, so JSONFormatter can put it in its own field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class RunLogger(logging.LoggerAdapter):
+    """
+    A Poster's logger. Adds `account` and `run_id` to every record it logs.
+    Set the run's ID with new_run() and clear it with end_run().
+    """
+
+    def __init__(self, logger, account=""):
+        super().__init__(logger, {"account": account, "run_id": None})
+
+    def set_verbose(self, verbose):
+        "Log at the level for the Verbose setting, for this account only."
+        self.setLevel(LEVELS.get(verbose, logging.DEBUG))
+
+    def new_run(self):
+        "Start a new run, with a new ID, and return the ID."
+        self.extra["run_id"] = uuid.uuid4().hex[:12]
+        return self.extra["run_id"]
+
+    def end_run(self):
+        self.extra["run_id"] = None
+
+    @property
+    def run_id(self):
+        return self.extra["run_id"]
+
+
+def setup_logging(name, log_format="text"):
+    """
+    Make the logger called `name`, and its children, log to stdout, through a
+    queue, in `log_format` ("text" or "json"). The first call for a logger
+    adds the handler; later calls, eg from more Posters or when the config is
+    reloaded, only change its format. So the format is the same for every
+    account in a process: whichever was set last. Each account's level is its
+    own; see RunLogger.set_verbose().
+    """
+    if log_format not in FORMATTERS:
+        msg = f"LogFormat should be one of {', '.join(FORMATTERS)}, not {log_format!r}"
+        raise ValueError(msg)
+
+    logger = logging.getLogger(name)
+
+    with _lock:
+        handler = _handlers.get(name)
+        if handler is None:
+            handler = logging.StreamHandler(stream=sys.stdout)
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(
+                log_queue, handler, respect_handler_level=True
+            )
+            listener.start()
+            atexit.register(listener.stop)
+
+            logger.addHandler(QueueingHandler(log_queue))
+            # Our handler writes everything, so the root logger needn't
+            # write it all again.
+            logger.propagate = False
+            _handlers[name] = handler
+
+        handler.setFormatter(FORMATTERS[log_format]())
+
+    return logger
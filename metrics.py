@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""
+Counters and histograms of what Poster does on each run: how long each stage
+takes, how long each send takes and whether it worked, and how late each post
+is published compared with its modernized time.
+
+They're kept in memory, in Prometheus's text format's terms, and can be:
+
+- Served over HTTP, at /metrics, by long-running processes (clock.py and
+  worker.py) if MetricsPort / METRICS_PORT is set.
+- Pushed to a Redis hash, "metrics" (after the account's key prefix, if
+  any), by one-shot runs of poster.py if PushMetrics / PUSH_METRICS is 1,
+  adding to what's there. Then this prints them all, for a Prometheus
+  textfile collector or similar:
+
+    $ ./metrics.py
+"""
+
+import bisect
+import itertools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The Redis hash that one-shot runs push their metrics to, after the
+# account's key prefix (see Poster.redis_key()):
+REDIS_KEY = "metrics"
+
+# Upper bounds of the histograms' buckets, in seconds. From 1ms (for reading
+# state) up to an hour (for posts that were published very late):
+BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1,
+    5,
+    10,
+    30,
+    60,
+    300,
+    3600,
+    float("inf"),
+)
+
+# Name -> (type, help text) of every metric.
+METRICS = {
+    "poster_runs_total": ("counter", "Runs of Poster.start()."),
+    "poster_stage_seconds": (
+        "histogram",
+        "Time spent in each stage of Poster.start().",
+    ),
+    "poster_posts_sent_total": ("counter", "Posts sent successfully."),
+    "poster_posts_skipped_total": (
+        "counter",
+        "Posts not sent because the ledger says they already were.",
+    ),
+    "poster_send_errors_total": ("counter", "Posts that failed to send."),
+    "poster_send_seconds": (
+        "histogram",
+        "Time taken to send each post, including waiting and retries.",
+    ),
+    "poster_publish_drift_seconds": (
+        "histogram",
+        "How long after its modernized time each post was published.",
+    ),
+}
+
+# Matches a sample's name, from the start of a line like 'name{labels} value':
+SAMPLE_NAME_PATTERN = re.compile(r"[a-z_]+")
+
+
+class Metrics:
+    "The values of all the metrics, which several threads can update."
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # (name, tuple of label (name, value) pairs) -> value
+        self.counters = {}
+        # (name, labels, as for counters) -> [
+        #   list of how many observations were in each of BUCKETS, sum, count]
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        "Add `value` to a counter."
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        "Add an observation to a histogram."
+        key = (name, tuple(labels.items()))
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        "Observe how long the `with` block takes, in histogram `name`."
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get_samples(self, *, reset=False):
+        """
+        Returns a dict of every sample, like 'poster_runs_total' or
+        'poster_stage_seconds_bucket{stage="select",le="0.01"}', -> its value.
+        If reset is True, all the metrics then start again from zero.
+        """
+        with self.lock:
+            samples = {
+                format_sample(name, dict(labels)): value
+                for (name, labels), value in self.counters.items()
+            }
+
+            for (name, labels), (counts, total, count) in self.histograms.items():
+                labels = dict(labels)
+                # Each bucket counts everything up to its bound:
+                for le, cumulative in zip(
+                    BUCKETS, itertools.accumulate(counts), strict=True
+                ):
+                    sample = format_sample(
+                        f"{name}_bucket", {**labels, "le": format_le(le)}
+                    )
+                    samples[sample] = cumulative
+                samples[format_sample(f"{name}_sum", labels)] = total
+                samples[format_sample(f"{name}_count", labels)] = count
+
+            if reset:
+                self.reset()
+
+        return samples
+
+    def render(self):
+        "Returns all the samples in Prometheus's text format."
+        return render(self.get_samples())
+
+    def push(self, redis, key=REDIS_KEY):
+        """
+        Add all the samples to those in the Redis hash `key`, and start again
+        from zero, so that the next push doesn't add them again.
+        """
+        samples = self.get_samples(reset=True)
+
+        if samples:
+            pipe = redis.pipeline(transaction=True)
+            for sample, value in samples.items():
+                pipe.hincrbyfloat(key, sample, value)
+            pipe.execute()
+
+    def serve(self, port):
+        "Serve the metrics at http://0.0.0.0:<port>/metrics, in a thread."
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                content = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class TimedFile:
+    """
+    Wraps a file that's open for reading, adding up the seconds spent in its
+    read(), starting from `seconds`.
+    """
+
+    def __init__(self, file, seconds=0.0):
+        self.file = file
+        self.seconds = seconds
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        try:
+            return self.file.read(size)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def format_sample(name, labels):
+    "eg 'poster_send_seconds_count{network=\"twitter\"}'"
+    if not labels:
+        return name
+    pairs = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    return f"{name}{{{pairs}}}"
+
+
+def format_le(le):
+    "A bucket's upper bound as Prometheus writes it, eg '0.5', '1', '+Inf'."
+    if le == float("inf"):
+        return "+Inf"
+    return f"{le:g}"
+
+
+def render(samples):
+    """
+    Returns a dict of samples (as kept by Metrics, or in the Redis hash) in
+    Prometheus's text format, with each metric's HELP and TYPE first.
+    """
+    by_name = {}
+    for sample, value in samples.items():
+        name = SAMPLE_NAME_PATTERN.match(sample).group()
+        by_name.setdefault(name, []).append((sample, value))
+
+    lines = []
+
+    for name, (kind, help_text) in METRICS.items():
+        if kind == "histogram":
+            names = (f"{name}_bucket", f"{name}_sum", f"{name}_count")
+        else:
+            names = (name,)
+
+        metric_samples = [
+            s for n in names for s in sorted(by_name.get(n, []), key=sort_key)
+        ]
+        if not metric_samples:
+            continue
+
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(
+            f"{sample} {format_value(value)}" for sample, value in metric_samples
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def sort_key(sample_and_value):
+    "Sorts samples by their labels, with a histogram's buckets in order."
+    sample = sample_and_value[0]
+    labels, _, le = sample.partition(',le="')
+    return labels, float(le.rstrip('"}').replace("+Inf", "inf") or "-inf")
+
+
+def format_value(value):
+    "eg '3' or '0.0123'"
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def main():
+    import poster
+
+    p = poster.Poster()
+    print(render(p.redis.hgetall(p.redis_key(REDIS_KEY))), end="")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
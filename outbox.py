@@ -0,0 +1,280 @@
+"""
+A durable queue of posts waiting to be published, using Redis Streams.
+
+When UseOutbox / USE_OUTBOX is set, Poster.start() doesn't send posts itself.
+Instead it adds one job per post per network to that network's stream (eg
+"outbox:mastodon"), in the same transaction as setting last_run_time, and
+worker.py processes publish them.
+
+Each job stays pending until it's acknowledged after being published. If
+publishing fails, or the worker dies, the job is tried again once its retry
+delay has passed, which doubles each time. After max_deliveries attempts it's
+moved to the "outbox:dead" stream.
+
+Posts must be published to a network in order, so that replies can be
+threaded, so only one worker at a time publishes to each network, and a
+network's later jobs wait while an earlier one is waiting to be retried.
+Running more workers means networks are published to in parallel, and that
+publishing carries on if a worker dies.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from redis.exceptions import LockError, ResponseError
+
+GROUP = "publishers"
+
+DEAD_LETTER_STREAM = "outbox:dead"
+
+
+class Outbox:
+    """
+    redis - A redis.Redis object, with decode_responses=True
+    logger - For logging
+    visibility_timeout - Seconds a worker can go without renewing its lock on
+        a network before other workers assume it's died and can take over.
+        While a job is being published the lock is renewed every third of
+        this, however long the send takes with rate limits and retries.
+    retry_delay - Seconds before the first retry of a failed job.
+    max_deliveries - How many times to try a job before giving up on it.
+    max_length - Roughly how many jobs to keep in each stream.
+    prefix - Put at the start of every Redis key, for one account's outbox
+        when there are several.
+    """
+
+    def __init__(
+        self,
+        redis,
+        logger,
+        visibility_timeout=120,
+        retry_delay=30,
+        max_deliveries=5,
+        max_length=10000,
+        prefix="",
+    ):
+        self.redis = redis
+        self.logger = logger
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.max_deliveries = max_deliveries
+        self.max_length = max_length
+        self.prefix = prefix
+
+        # Unique to this Outbox, in this process, on this host:
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def stream(self, network):
+        return f"{self.prefix}outbox:{network}"
+
+    def queue_posts(self, pipe, posts, networks):
+        """
+        Add the commands to queue a job for each post, for each network, to a
+        Redis pipeline.
+
+        posts - list of post dicts, in the order they should be published
+        networks - list of network names, eg ["mastodon", "bluesky"]
+        """
+        for network in networks:
+            for post in posts:
+                pipe.xadd(
+                    self.stream(network),
+                    self.encode(post),
+                    maxlen=self.max_length,
+                    approximate=True,
+                )
+
+    def encode(self, post):
+        "Turns a post dict into a dict of strings for a stream entry."
+        return {
+            "time": post["time"],
+            "text": post["text"],
+            "is_reply": "1" if post["is_reply"] else "0",
+            "in_reply_to_time": post["in_reply_to_time"] or "",
+        }
+
+    def decode(self, fields):
+        "Turns a stream entry's fields back into a post dict."
+        return {
+            "time": fields["time"],
+            "text": fields["text"],
+            "is_reply": fields["is_reply"] == "1",
+            "in_reply_to_time": fields["in_reply_to_time"] or None,
+        }
+
+    def work(self, network, send, stopping):
+        """
+        Keep publishing jobs for network until the `stopping` Event is set.
+
+        send - A function that takes a post dict, publishes it, and returns
+            True if that worked.
+        """
+        stream = self.stream(network)
+
+        try:
+            self.redis.xgroup_create(stream, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            # The group already exists.
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        # The Poster's pacers space out the posts themselves.
+        while not stopping.is_set():
+            try:
+                tried = self.process_next(network, send)
+            except Exception:
+                # Eg, Redis is down. Keep going, so this network's jobs
+                # aren't left waiting while the others carry on.
+                self.logger.exception("Error processing the %s outbox", network)
+                tried = False
+            if not tried:
+                stopping.wait(1)
+
+    def process_next(self, network, send):
+        """
+        Publish the next job for network, if there is one and no other worker
+        is publishing to that network.
+        Returns True if we tried to publish a job.
+        """
+        lock = self.redis.lock(
+            f"{self.stream(network)}:lock",
+            timeout=self.visibility_timeout,
+            blocking_timeout=1,
+            # So keep_lock()'s thread can renew it:
+            thread_local=False,
+        )
+
+        if not lock.acquire():
+            return False
+
+        try:
+            job = self.next_job(network)
+
+            if job is None:
+                return False
+
+            job_id, fields, deliveries = job
+            post = self.decode(fields)
+
+            with self.keep_lock(lock, network):
+                try:
+                    sent = send(post)
+                except Exception:
+                    # It'll be retried, like any other failure.
+                    self.logger.exception(
+                        "Error publishing %s to %s", post["time"], network
+                    )
+                    sent = False
+
+            if sent:
+                self.redis.xack(self.stream(network), GROUP, job_id)
+            else:
+                self.logger.warning(
+                    "Failed to publish %s to %s (attempt %s of %s)",
+                    post["time"],
+                    network,
+                    deliveries,
+                    self.max_deliveries,
+                )
+            return True
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                self.logger.warning("Lost the %s outbox lock", network)
+
+    @contextmanager
+    def keep_lock(self, lock, network):
+        """
+        Keep renewing `lock` in a thread until the with block is done, so no
+        other worker takes over the network while we're still publishing.
+        """
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.visibility_timeout / 3):
+                try:
+                    lock.extend(self.visibility_timeout, replace_ttl=True)
+                except LockError:
+                    self.logger.warning("Couldn't renew the %s outbox lock", network)
+                    return
+
+        renewer = threading.Thread(target=renew, name=f"outbox-{network}", daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            done.set()
+            renewer.join()
+
+    def next_job(self, network):
+        """
+        Returns the next job to publish for network as a tuple of
+        (job ID, fields dict, number of attempts including this one), or None.
+
+        If a job's already pending (it failed, or its worker died) we only
+        return it once its retry delay has passed, and never return later
+        jobs until it's done.
+        """
+        stream = self.stream(network)
+
+        pending = self.redis.xpending_range(stream, GROUP, min="-", max="+", count=1)
+
+        if pending:
+            entry = pending[0]
+            job_id = entry["message_id"]
+            deliveries = entry["times_delivered"]
+
+            if entry["time_since_delivered"] < self.get_retry_delay(deliveries) * 1000:
+                return None
+
+            claimed = self.redis.xclaim(
+                stream, GROUP, self.consumer, min_idle_time=0, message_ids=[job_id]
+            )
+
+            if not claimed or claimed[0][1] is None:
+                # It's been trimmed from the stream.
+                self.redis.xack(stream, GROUP, job_id)
+                return None
+
+            fields = claimed[0][1]
+
+            if deliveries >= self.max_deliveries:
+                self.dead_letter(network, job_id, fields)
+                return None
+
+            return job_id, fields, deliveries + 1
+
+        messages = self.redis.xreadgroup(GROUP, self.consumer, {stream: ">"}, count=1)
+
+        if not messages or not messages[0][1]:
+            return None
+
+        job_id, fields = messages[0][1][0]
+        return job_id, fields, 1
+
+    def get_retry_delay(self, deliveries):
+        "Seconds to wait after the nth failed attempt; at most 15 minutes."
+        return min(self.retry_delay * 2 ** (deliveries - 1), 15 * 60)
+
+    def dead_letter(self, network, job_id, fields):
+        "Give up on a job, moving it to the dead letter stream."
+        self.logger.error(
+            "Giving up on publishing %s to %s after %s attempts",
+            fields.get("time"),
+            network,
+            self.max_deliveries,
+        )
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(
+            f"{self.prefix}{DEAD_LETTER_STREAM}",
+            {**fields, "network": network, "job_id": job_id, "failed_at": time.time()},
+            maxlen=self.max_length,
+            approximate=True,
+        )
+        pipe.xack(self.stream(network), GROUP, job_id)
+        pipe.execute()
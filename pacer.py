@@ -0,0 +1,236 @@
+"""
+Paces the requests we make to each network, and retries them if they're
+throttled or fail because of a temporary problem at the other end.
+
+Each network has a Pacer, which is a token bucket: it holds up to `burst`
+tokens, gains `rate` tokens a second, and each request uses one. So we can
+send a few posts at once, but no more than `rate` a second on average.
+
+Each network also says, in the headers of its responses, how many requests
+we have left until some time when that allowance resets. The Pacer reads
+those (see response_hook()) and slows down to spread what's left over the
+time until then, or stops until then if there's nothing left.
+
+If a request is throttled (a 429), or fails with a 5xx error, we wait and try
+again, up to max_retries times. The wait doubles each time, with some random
+jitter, and is longer if the network asked us to wait longer.
+"""
+
+import datetime
+import random
+import threading
+import time
+
+# The rate limit headers each network uses.
+# Twitter: x-rate-limit-*, Mastodon: x-ratelimit-*, Bluesky: ratelimit-*.
+REMAINING_HEADERS = (
+    "x-rate-limit-remaining",
+    "x-ratelimit-remaining",
+    "ratelimit-remaining",
+)
+RESET_HEADERS = ("x-rate-limit-reset", "x-ratelimit-reset", "ratelimit-reset")
+
+
+class RateLimitedError(Exception):
+    "Raised if we'd have to wait longer than max_wait to make a request."
+
+
+class Pacer:
+    """
+    name - eg "twitter", for logging
+    logger - For logging
+    is_retryable - A function that takes an exception raised by a request and
+        returns True if it's worth trying the request again.
+    rate - Most requests a second, on average.
+    burst - Most requests we can make one after the other.
+    max_retries - Most times to retry one request.
+    backoff - Seconds to wait before the first retry. Doubles each time.
+    max_wait - Most seconds to wait before making a request. If we'd have to
+        wait longer then RateLimitedError is raised instead.
+    """
+
+    def __init__(
+        self,
+        name,
+        logger,
+        is_retryable,
+        rate=1,
+        burst=3,
+        max_retries=3,
+        backoff=2,
+        max_wait=60,
+    ):
+        self.name = name
+        self.logger = logger
+        self.is_retryable = is_retryable
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+
+        self.lock = threading.Lock()
+
+        self.tokens = burst
+        # When we last added tokens (all times are time.monotonic()):
+        self.refilled = time.monotonic()
+        # The rate we're using, which is lower than `rate` if the network
+        # says we're running out of requests, until `slowed_until`:
+        self.current_rate = rate
+        self.slowed_until = 0
+        # We can't make any requests until this time:
+        self.blocked_until = 0
+
+        # Totals, to see how much time is spent waiting vs sending:
+        self.requests = 0
+        self.retries = 0
+        self.waiting_time = 0.0
+        self.sending_time = 0.0
+
+    def call(self, func, *args, **kwargs):
+        """
+        Returns func(*args, **kwargs), once we're allowed to make a request.
+        If it raises a retryable exception it's called again, after a delay,
+        until we run out of retries, when the last exception is raised.
+        """
+        for attempt in range(1, self.max_retries + 2):
+            self.wait()
+
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt > self.max_retries or not self.is_retryable(e):
+                    raise
+
+                delay = self.get_retry_delay(attempt)
+                self.logger.warning(
+                    "Request to %s failed (%s); retrying in at least %.1f seconds",
+                    self.name,
+                    e,
+                    delay,
+                )
+                with self.lock:
+                    self.retries += 1
+                    self.block(delay)
+            finally:
+                with self.lock:
+                    self.requests += 1
+                    self.sending_time += time.monotonic() - start
+
+    def wait(self):
+        "Sleep until we're allowed to make a request, and use up a token."
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+
+            delay = max(
+                self.blocked_until - now,
+                (1 - self.tokens) / self.current_rate,
+                0,
+            )
+
+            if delay > self.max_wait:
+                msg = f"Can't send to {self.name} for another {delay:.0f} seconds"
+                raise RateLimitedError(msg)
+
+            # This can go below zero, reserving tokens for those waiting.
+            self.tokens -= 1
+            self.waiting_time += delay
+
+        if delay > 0:
+            self.logger.debug("Waiting %.2f seconds to send to %s", delay, self.name)
+            time.sleep(delay)
+
+    def refill(self, now):
+        "Add the tokens we've gained since we last did this."
+        if self.current_rate != self.rate and now >= self.slowed_until:
+            self.tokens = min(
+                self.burst,
+                self.tokens + (self.slowed_until - self.refilled) * self.current_rate,
+            )
+            self.refilled = self.slowed_until
+            self.current_rate = self.rate
+
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.refilled) * self.current_rate
+        )
+        self.refilled = now
+
+    def block(self, seconds):
+        "Don't make any more requests for this many seconds."
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def get_retry_delay(self, attempt):
+        "Seconds to wait after the nth failed attempt, with jitter."
+        delay = self.backoff * 2 ** (attempt - 1)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def response_hook(self, response, *args, **kwargs):
+        """
+        Called with every HTTP response from this network (it works as both a
+        requests and an httpx response hook) to use its rate limit headers.
+        """
+        headers = response.headers
+        remaining = get_number(headers, REMAINING_HEADERS)
+        reset = get_reset_time(headers)
+        retry_after = get_number(headers, ("retry-after",))
+
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+
+            if remaining is not None and reset is not None:
+                seconds = max(reset - time.time(), 1)
+
+                if remaining <= 0:
+                    self.block(seconds)
+                elif remaining / seconds < self.rate:
+                    self.current_rate = remaining / seconds
+                    self.slowed_until = now + seconds
+
+                self.tokens = min(self.tokens, remaining)
+
+            if retry_after is not None:
+                self.block(retry_after)
+
+    def get_stats(self):
+        "Returns a dict of the totals so far."
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "waiting_time": self.waiting_time,
+                "sending_time": self.sending_time,
+            }
+
+
+def get_number(headers, names):
+    "Returns the value of the first of the headers that's set, or None."
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def get_reset_time(headers):
+    """
+    Returns when the rate limit resets, as a timestamp, or None.
+    Twitter and Bluesky send a timestamp, Mastodon sends an ISO 8601 time.
+    """
+    for name in RESET_HEADERS:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+            try:
+                return datetime.datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                return None
+    return None
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+A compact, prebuilt index of the posts in the posts/ directory.
+
+For each year directory (eg posts/1660/) we store every valid post in time
+order, as four parallel arrays:
+
+    keys    - the post's month, day, hour and minute as one integer
+    flags   - 1 if the post is a reply, otherwise 0
+    months  - which month file the post is in (1-12)
+    offsets - the byte offset of the post's line within that month file
+
+Finding the posts that are due is then a binary search on `keys`, and only
+the lines of posts that are actually due are read from disk.
+
+The keys are year-agnostic local wall-clock times, which is what
+Poster.modernize_time() compares, so an index stays valid whatever
+`years_ahead` and `timezone` are set to.
+
+Index files are kept in the .post_index/ directory. A year's index is rebuilt
+automatically whenever the contents of one of that year's files change.
+
+To build (or rebuild) the index for every year:
+
+    $ ./post_index.py
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from glob import glob
+from itertools import groupby
+
+from post_parser import parse_line, parse_posts
+
+logger = logging.getLogger(__name__)
+
+# Increase this if the format of the index files changes.
+INDEX_VERSION = 1
+
+INDEX_MAGIC = b"PEPYSIDX"
+
+# A key that's greater than that of any post in a year.
+END_KEY = 13 * 32 * 24 * 60
+
+
+def time_key(month, day, hour, minute):
+    """
+    Turns the parts of a time into a single integer that sorts in the same
+    order as the times do, within any one year.
+    """
+    return ((month * 32 + day) * 24 + hour) * 60 + minute
+
+
+def file_hash(path):
+    "Returns the SHA-256 hex digest of the file at `path`."
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def is_file_unchanged(path, source):
+    """
+    Is the file at `path` unchanged since `source`, a dict of its "mtime_ns",
+    "size" and "sha256", was made? We only hash the file's contents if its
+    size or mtime have changed. If they have, but its contents haven't,
+    source is updated with the new ones.
+    """
+    stat = os.stat(path)
+
+    if (stat.st_mtime_ns, stat.st_size) == (source["mtime_ns"], source["size"]):
+        return True
+
+    if file_hash(path) != source["sha256"]:
+        return False
+
+    # Same contents, just touched; remember the new stat.
+    source["mtime_ns"] = stat.st_mtime_ns
+    source["size"] = stat.st_size
+    return True
+
+
+def write_file(path, write, description):
+    """
+    Saves a file, by calling write() with it open for writing bytes, via a
+    temporary file so it's never half-written. If we can't (eg, a read-only
+    filesystem) we log a warning and carry on using what's in memory.
+
+    description - What the file is, for the warning, eg "post index".
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Couldn't write %s %s: %s", description, path, e)
+
+
+class YearIndex:
+    """
+    The index for a single year's directory of posts.
+    """
+
+    def __init__(self, year, keys, flags, months, offsets, sources):
+        self.year = year
+        # array of ints, in ascending order:
+        self.keys = keys
+        # bytearray, 1 for replies:
+        self.flags = flags
+        # bytearray of month numbers:
+        self.months = months
+        # array of byte offsets into each post's month file:
+        self.offsets = offsets
+        # dict of filename -> {"mtime_ns", "size", "sha256"}
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.keys)
+
+    def range(self, from_key, before_key):
+        """
+        Returns a range() of positions of all posts whose keys are
+        >= from_key and < before_key.
+        """
+        return range(
+            bisect_left(self.keys, from_key), bisect_left(self.keys, before_key)
+        )
+
+    def time(self, i):
+        "Returns the time of post i as a string, eg '1666-02-09 14:08'."
+        key = self.keys[i]
+        key, minute = divmod(key, 60)
+        key, hour = divmod(key, 24)
+        month, day = divmod(key, 32)
+        return f"{self.year}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}"
+
+    def is_reply(self, i):
+        return self.flags[i] == 1
+
+
+class PostIndex:
+    """
+    Loads, checks and (re)builds the per-year indexes of the posts in
+    `posts_dir`, keeping the ones it's loaded in memory.
+    """
+
+    def __init__(self, posts_dir, index_dir):
+        self.posts_dir = posts_dir
+        self.index_dir = index_dir
+        # year (int) -> YearIndex
+        self._years = {}
+        # Several Posters' threads might share this (see accounts.py).
+        self._lock = threading.Lock()
+
+    def get_year(self, year):
+        """
+        Returns the YearIndex for `year`, rebuilding it if any of its source
+        files have changed. Returns None if there's no directory of posts for
+        that year.
+        """
+        year_dir = os.path.join(self.posts_dir, str(year))
+
+        if not os.path.isdir(year_dir):
+            return None
+
+        with self._lock:
+            year_index = self._years.get(year)
+
+            if year_index is None:
+                year_index = self.read(year)
+
+            if year_index is None or not self.is_fresh(year_index):
+                year_index = self.build(year)
+                self.write(year_index)
+
+            self._years[year] = year_index
+            return year_index
+
+    def is_fresh(self, year_index):
+        """
+        Is year_index still correct for the post files on disk?
+        We only hash a file's contents if its size or mtime have changed.
+        """
+        current = self._list_sources(year_index.year)
+
+        if sorted(current) != sorted(year_index.sources):
+            return False
+
+        return all(
+            is_file_unchanged(path, year_index.sources[filename])
+            for filename, path in current.items()
+        )
+
+    def build(self, year):
+        "Parses all of a year's post files and returns a new YearIndex."
+        logger.info("Building post index for %s", year)
+
+        rows = []
+        sources = {}
+
+        for filename, path in self._list_sources(year).items():
+            month = int(filename[:2])
+
+            with open(path, "rb") as file:
+                content = file.read()
+
+            stat = os.stat(path)
+            sources[filename] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": hashlib.sha256(content).hexdigest(),
+            }
+
+            for post in parse_posts(content):
+                # Ignore any posts that have ended up in the wrong file.
+                if post.year == year and post.month == month:
+                    key = time_key(month, post.day, post.hour, post.minute)
+                    rows.append((key, post.is_reply, month, post.offset))
+
+        rows.sort()
+
+        return YearIndex(
+            year,
+            keys=array("L", (row[0] for row in rows)),
+            flags=bytearray(row[1] for row in rows),
+            months=bytearray(row[2] for row in rows),
+            offsets=array("L", (row[3] for row in rows)),
+            sources=sources,
+        )
+
+    def read(self, year):
+        "Reads a year's index from disk, or returns None if we can't."
+        path = self._index_path(year)
+
+        try:
+            with open(path, "rb") as file:
+                if file.readline().rstrip(b"\n") != INDEX_MAGIC:
+                    return None
+                header = json.loads(file.readline())
+                if header["version"] != INDEX_VERSION:
+                    return None
+                count = header["count"]
+
+                keys = array("L")
+                keys.fromfile(file, count)
+                flags = bytearray(file.read(count))
+                months = bytearray(file.read(count))
+                offsets = array("L")
+                offsets.fromfile(file, count)
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            logger.debug("Couldn't read post index %s: %s", path, e)
+            return None
+
+        return YearIndex(year, keys, flags, months, offsets, header["sources"])
+
+    def write(self, year_index):
+        "Saves a year's index to disk, if we can; see write_file()."
+        header = {
+            "version": INDEX_VERSION,
+            "count": len(year_index),
+            "sources": year_index.sources,
+        }
+
+        def write(file):
+            file.write(INDEX_MAGIC + b"\n")
+            file.write(json.dumps(header).encode() + b"\n")
+            year_index.keys.tofile(file)
+            file.write(year_index.flags)
+            file.write(year_index.months)
+            year_index.offsets.tofile(file)
+
+        write_file(self._index_path(year_index.year), write, "post index")
+
+    def read_text(self, year_index, i):
+        "Reads the text of post i from its month file."
+        path = os.path.join(
+            self.posts_dir, str(year_index.year), f"{year_index.months[i]:02d}.txt"
+        )
+
+        with open(path, "rb") as file:
+            file.seek(year_index.offsets[i])
+            line = file.readline()
+
+        return parse_line(line).text.strip()
+
+    def read_texts(self, year_index):
+        """
+        Returns a list of the text of every post in the year's index, in
+        order, reading each month file only once.
+        """
+        texts = []
+
+        # Posts are in time order, so each month's are together.
+        for month, positions in groupby(
+            range(len(year_index)), key=year_index.months.__getitem__
+        ):
+            filename = f"{month:02d}.txt"
+            path = os.path.join(self.posts_dir, str(year_index.year), filename)
+            with open(path, "rb") as file:
+                for i in positions:
+                    file.seek(year_index.offsets[i])
+                    texts.append(parse_line(file.readline()).text.strip())
+
+        return texts
+
+    def _list_sources(self, year):
+        "Returns a dict of filename -> path for all of a year's post files."
+        year_dir = os.path.join(self.posts_dir, str(year))
+        return {
+            os.path.basename(path): path
+            for path in sorted(glob(os.path.join(year_dir, "[0-1][0-9].txt")))
+        }
+
+    def _index_path(self, year):
+        return os.path.join(self.index_dir, f"{year}.idx")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    project_root = os.path.abspath(os.path.dirname(__file__))
+    post_index = PostIndex(
+        os.path.join(project_root, "posts"), os.path.join(project_root, ".post_index")
+    )
+
+    for year_dir in sorted(glob(os.path.join(project_root, "posts", "[0-9]" * 4))):
+        year_index = post_index.get_year(int(os.path.basename(year_dir)))
+        logger.info("%s: %s posts", year_index.year, len(year_index))
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Parses the posts files. Used by poster.py, tester.py and post_index.py.
+
+A line is like one of:
+
+    1666-02-09 14:08 This is my text
+    1666-02-09 14:08   This is my text
+    1666-02-09 14:08 r This is my text
+    1666-02-09 14:08 r   This is my text
+
+Lines that don't look like that are ignored.
+
+Files are parsed as bytes, so that each Post knows the byte offset of its
+line in the file, which is what the post index stores. Either all at once
+(parse_posts()) or a chunk at a time (read_posts()).
+"""
+
+import re
+from typing import NamedTuple
+
+# [^\S\n] is any whitespace except a newline, so a match can't run on to
+# the next line.
+POST_PATTERN = re.compile(
+    rb"""
+    ^
+    [^\S\n]*                    # Optional indentation
+    (\d\d\d\d)-(\d\d)-(\d\d)    # Date like 1666-02-09
+    [^\S\n]
+    (\d\d):(\d\d)               # Time like 14:08
+    (?:
+        [^\S\n]
+        (\w)                    # A literal 'r' (probably)
+    )?                          # The 'r ' is optional
+    [^\S\n]+
+    ([^\r\n]*)                  # The post text
+    \r?$
+    """,
+    re.VERBOSE | re.MULTILINE,
+)
+
+
+class Post(NamedTuple):
+    "One post from a posts file."
+
+    year: int
+    month: int
+    day: int
+    hour: int
+    minute: int
+    # eg "r", or None:
+    kind: str | None
+    # As it is in the file; may have leading or trailing spaces:
+    text: str
+    # Byte offset of the post's line within its file:
+    offset: int
+
+    @property
+    def time(self):
+        "eg '1666-02-09 14:08'"
+        return (
+            f"{self.year:04d}-{self.month:02d}-{self.day:02d} "
+            f"{self.hour:02d}:{self.minute:02d}"
+        )
+
+    @property
+    def is_reply(self):
+        return self.kind == "r"
+
+
+def parse_posts(content, start=0):
+    """
+    Yields a Post for each post line in `content`, the bytes of a posts file.
+    start - The offset of `content` within the file.
+    """
+    for line_match in POST_PATTERN.finditer(content):
+        y, m, d, hh, mm, kind, text = line_match.groups()
+        yield Post(
+            int(y),
+            int(m),
+            int(d),
+            int(hh),
+            int(mm),
+            None if kind is None else kind.decode(),
+            text.decode("utf-8"),
+            start + line_match.start(),
+        )
+
+
+def read_posts(file, chunk_size=16 * 1024):
+    """
+    Yields a Post for each post line in `file`, which must be opened in
+    binary mode. The file is read a chunk at a time, as the Posts are asked
+    for, so if we stop early we won't have read the rest of it.
+    """
+    start = 0
+    buffer = b""
+
+    while chunk := file.read(chunk_size):
+        buffer += chunk
+        # Only parse complete lines; keep any partial line for next time.
+        end = buffer.rfind(b"\n") + 1
+
+        if end > 0:
+            yield from parse_posts(buffer[:end], start)
+            start += end
+            buffer = buffer[end:]
+
+    yield from parse_posts(buffer, start)
+
+
+def parse_line(line):
+    "Returns a Post for a single line of bytes, or None if it's not a post."
+    return next(parse_posts(line), None)
+
+
+def parse_time(t):
+    """
+    Turns a time string like '1666-02-09 14:08' into a tuple of ints, eg
+    (1666, 2, 9, 14, 8). Raises ValueError if it's not a valid time.
+    """
+    if len(t) != 16 or t[4] != "-" or t[7] != "-" or t[10] != " " or t[13] != ":":
+        msg = f"Not a valid time: {t!r}"
+        raise ValueError(msg)
+
+    return int(t[0:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16])
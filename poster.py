@@ -1,41 +1,83 @@
 #!/usr/bin/env python
+import argparse
 import configparser
 import datetime
 import logging
 import os
-import re
 import sys
 import time
 import urllib.parse as urlparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+# tweepy, Mastodon.py and, especially, atproto are slow to import, so each is
+# only imported inside the methods for its network, when that's configured.
 import redis
-import tweepy
-from atproto import Client
-from atproto.exceptions import AtProtocolError, InvokeTimeoutError, UnauthorizedError
-from mastodon import Mastodon, MastodonError
+from redis.exceptions import WatchError
+
+from backlog import Backlog
+from lease import Lease, LeaseLostError
+from ledger import Ledger
+from logs import RunLogger, setup_logging
+from metrics import REDIS_KEY as METRICS_KEY
+from metrics import Metrics, TimedFile
+from outbox import Outbox
+from pacer import Pacer, RateLimitedError
+from post_index import END_KEY, PostIndex, time_key
+from post_parser import parse_posts, parse_time, read_posts
+from profiling import Profiler
+from render import LIMITS, RenderIndex, get_parts, render
+from schedule import Schedule
+from state import NetworkState
 
 logging.basicConfig()
 
+# tweepy always sends requests here; see make_base_url_adapter().
+TWITTER_API_URL = "https://api.twitter.com"
+
+
+def make_base_url_adapter(from_url, to_url):
+    """
+    Returns a requests adapter that sends requests for from_url to to_url
+    instead. tweepy doesn't let us change its API's URL, so this is how we
+    point it at another server, like fake_servers.py.
+    """
+    from requests.adapters import HTTPAdapter
+
+    class BaseUrlAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = to_url.rstrip("/") + request.url.removeprefix(from_url)
+            return super().send(request, **kwargs)
+
+    return BaseUrlAdapter()
+
 
 class Poster:
     twitter_consumer_key = ""
     twitter_consumer_secret = ""
     twitter_access_token = ""
     twitter_access_token_secret = ""
+    twitter_api_base_url = TWITTER_API_URL
 
     mastodon_client_id = ""
     mastodon_client_secret = ""
     mastodon_access_token = ""
     mastodon_api_base_url = "https://mastodon.social"
+    # The most characters a post can have; this depends on the server.
+    mastodon_max_characters = LIMITS["mastodon"]
 
     atproto_handle = ""
     atproto_password = ""
+    atproto_base_url = "https://bsky.social"
 
     # 1 will output INFO logging and above.
     # 2 will output DEBUG logging and above.
     verbose = 0
 
+    # "text", or "json" for one JSON object per line; see logs.py.
+    log_format = "text"
+
     # How many years ahead are we of the dated posts?
     years_ahead = 0
 
@@ -49,6 +91,52 @@ class Poster:
     # possible strings.
     timezone = "Europe/London"
 
+    # Should we find due posts using the prebuilt index of posts (see
+    # post_index.py) rather than parsing the whole of the month's file?
+    use_post_index = True
+
+    # Should we find due posts in the schedule kept in Redis, so that we
+    # don't need the posts directory? See schedule.py.
+    use_schedule = False
+
+    # Keep a record of every post sent, and check it before sending, so no
+    # post is sent twice; see ledger.py.
+    use_posted_ledger = True
+
+    # If set, profile runs, writing the results to this directory; see
+    # profiling.py. profile_rate is the fraction of runs to profile, and
+    # profile_memory whether to trace memory allocations too.
+    profile_dir = ""
+    profile_rate = 1.0
+    profile_memory = True
+
+    # How clock.py decides when to run:
+    # "interval" - once a minute.
+    # "due" - when the next post is due (see due_scheduler.py).
+    clock_mode = "interval"
+
+    # Should posts be queued in the outbox, for worker.py to publish, rather
+    # than being sent directly? See outbox.py.
+    use_outbox = False
+
+    # Should posts that were missed, because we didn't run for longer than
+    # max_time_window, be sent later, catch_up_rate posts a minute, along
+    # with the posts that are due then? See backlog.py.
+    catch_up = False
+    catch_up_rate = 1.0
+
+    # If set, long-running processes (clock.py and worker.py) serve metrics
+    # at http://0.0.0.0:<metrics_port>/metrics. See metrics.py.
+    metrics_port = 0
+    # Should one-shot runs of poster.py add their metrics to a Redis hash?
+    # See metrics.py.
+    push_metrics = False
+
+    # How many seconds the lease on running start() lasts, so that if several
+    # processes run at once only one sends posts. 0 to not use a lease.
+    # See lease.py.
+    run_lease_seconds = 90
+
     # Only used if we're using Redis.
     redis_hostname = "localhost"
     redis_port = 6666
@@ -56,55 +144,134 @@ class Poster:
     # Will be the redis.Redis() object:
     redis = None
 
-    def __init__(self):
-        self.logger = logging.getLogger(__name__)
-        stdout = logging.StreamHandler(stream=sys.stdout)
-        formatter = logging.Formatter(
-            # "%(name)s: %(asctime)s | %(levelname)s | %(filename)s:%(lineno)s | "
-            # "%(process)d >>> %(message)s"
-            "%(asctime)s | %(levelname)s | %(message)s"
+    def __init__(self, settings=None, name="", shared=None):
+        """
+        With no arguments, the config is read from config.cfg, or the
+        environment. To run several accounts in one process (see accounts.py):
+
+        settings - A mapping of config settings, like config.cfg's [DEFAULT]
+            section, to use instead.
+        name - The account's name. Its keys in Redis start with "<name>:".
+        shared - A SharedClients object (see accounts.py) of connection pools
+            and post indexes to share with other Posters.
+        """
+        self.settings = settings
+        self.name = name
+        self.shared = shared
+        self.redis_prefix = f"{name}:" if name else ""
+
+        # Every Poster in this process logs through one handler; see logs.py.
+        self.logger = RunLogger(
+            logging.getLogger(f"{__name__}.{name}" if name else __name__), name
         )
-        stdout.setFormatter(formatter)
 
         self.project_root = os.path.abspath(os.path.dirname(__file__))
+        self.posts_dir = os.path.join(self.project_root, "posts")
+
+        # Kept for the life of the Poster, so they add up over many runs.
+        self.metrics = Metrics()
 
         self.config_file = os.path.join(self.project_root, "config.cfg")
 
         self.load_config()
+        setup_logging(__name__, self.log_format)
+        self.logger.set_verbose(self.verbose)
+        self.profiler = self.make_profiler()
 
-        if self.verbose:
-            if self.verbose == 1:
-                stdout.setLevel(logging.INFO)
-            elif self.verbose == 2:
-                stdout.setLevel(logging.DEBUG)
+        self.post_index = None
+        self.setup_index()
 
-        self.logger.addHandler(stdout)
+        self.setup_clients()
 
-        self.redis = redis.Redis(
-            host=self.redis_hostname,
-            port=self.redis_port,
-            password=self.redis_password,
-            decode_responses=True,
-        )
+    def setup_index(self):
+        """
+        Create the PostIndex of posts_dir, unless we already have it, and the
+        renders of its posts for the current limits.
+        """
+        if self.post_index is None or self.post_index.posts_dir != self.posts_dir:
+            index_dir = get_index_dir(self.posts_dir)
+            if self.shared is not None:
+                self.post_index = self.shared.get_post_index(self.posts_dir, index_dir)
+            else:
+                self.post_index = PostIndex(self.posts_dir, index_dir)
+
+        # What each post will be on each network; see render.py.
+        if self.shared is not None:
+            self.renders = self.shared.get_render_index(
+                self.post_index, self.get_limits()
+            )
+        else:
+            self.renders = RenderIndex(self.post_index, self.get_limits())
+
+    def setup_clients(self):
+        """
+        Create the Redis and API clients, and the timezone, from the config.
+        These are kept for the life of the Poster, so that a long-running
+        process (see clock.py) can reuse their connections.
+        """
+        if self.shared is not None:
+            self.redis = self.shared.get_redis(
+                self.redis_hostname, self.redis_port, self.redis_password
+            )
+        else:
+            self.redis = redis.Redis(
+                host=self.redis_hostname,
+                port=self.redis_port,
+                password=self.redis_password,
+                decode_responses=True,
+            )
+        self.setup_state()
+        self.outbox = Outbox(self.redis, self.logger, prefix=self.redis_prefix)
+
+        # Each network's rate limiting; see pacer.py.
+        self.pacers = {
+            "twitter": Pacer("twitter", self.logger, self.is_retryable_tweet_error),
+            "mastodon": Pacer("mastodon", self.logger, self.is_retryable_toot_error),
+            "bluesky": Pacer("bluesky", self.logger, self.is_retryable_skeet_error),
+        }
 
         self.twitter_api = None
         self.mastodon_api = None
+        # Logged in when it's first needed; see get_atproto_client():
+        self.atproto_client = None
 
         if self.twitter_consumer_key:
+            import tweepy
+
             self.twitter_api = tweepy.Client(
                 consumer_key=self.twitter_consumer_key,
                 consumer_secret=self.twitter_consumer_secret,
                 access_token=self.twitter_access_token,
                 access_token_secret=self.twitter_access_token_secret,
             )
+            self.twitter_api.session.hooks["response"].append(
+                self.pacers["twitter"].response_hook
+            )
+            if self.shared is not None:
+                self.shared.use_http_pool(self.twitter_api.session)
+            if self.twitter_api_base_url != TWITTER_API_URL:
+                self.twitter_api.session.mount(
+                    TWITTER_API_URL,
+                    make_base_url_adapter(TWITTER_API_URL, self.twitter_api_base_url),
+                )
 
         if self.mastodon_client_id:
+            from mastodon import Mastodon
+
             self.mastodon_api = Mastodon(
                 client_id=self.mastodon_client_id,
                 client_secret=self.mastodon_client_secret,
                 access_token=self.mastodon_access_token,
                 api_base_url=self.mastodon_api_base_url,
+                # Raise MastodonRatelimitError rather than sleeping; the
+                # pacer decides how long to wait.
+                ratelimit_method="throw",
+            )
+            self.mastodon_api.session.hooks["response"].append(
+                self.pacers["mastodon"].response_hook
             )
+            if self.shared is not None:
+                self.shared.use_http_pool(self.mastodon_api.session)
 
         try:
             self.local_tz = ZoneInfo(self.timezone)
@@ -112,35 +279,156 @@ class Poster:
             self.logger.error("Unknown or no timezone in settings: %s", self.timezone)
             sys.exit(0)
 
+    def setup_state(self):
+        """
+        Create the objects that keep each network's state in self.redis.
+        """
+        # The state needed to thread replies on each network, each kept in
+        # one Redis hash. The legacy keys are where we used to store them.
+        key = self.redis_key
+        self.tweet_state = NetworkState(
+            self.redis,
+            key("tweet"),
+            {"time": key("previous_tweet_time"), "id": key("previous_tweet_id")},
+        )
+        self.toot_state = NetworkState(
+            self.redis,
+            key("toot"),
+            {"time": key("previous_toot_time"), "id": key("previous_toot_id")},
+        )
+        self.skeet_state = NetworkState(
+            self.redis,
+            key("skeet"),
+            {
+                "time": key("previous_skeet_time"),
+                "uri": key("previous_skeet_uri"),
+                "cid": key("previous_skeet_cid"),
+                "root_uri": key("root_skeet_uri"),
+                "root_cid": key("root_skeet_cid"),
+            },
+        )
+        # Posts we missed and have still to send, if catch_up is on.
+        self.backlog = Backlog(self.redis, key("backlog"))
+        # The posts that are due around now, if use_schedule is on.
+        self.schedule = Schedule(self.redis, key("schedule"))
+        # Every post sent to each network, if use_posted_ledger is on.
+        self.ledger = None
+        if self.use_posted_ledger:
+            self.ledger = Ledger(
+                self.redis, self.logger, key("posted"), self.years_ahead
+            )
+
+        # So that only one process at a time runs start():
+        self.run_lease = None
+        if self.run_lease_seconds:
+            self.run_lease = Lease(
+                self.redis, key("run_lease"), self.run_lease_seconds, self.logger
+            )
+
+    def redis_key(self, name):
+        "Returns the Redis key for `name`, eg 'last_run_time', for this account."
+        return f"{self.redis_prefix}{name}"
+
     def load_config(self):
-        if os.path.isfile(self.config_file):
+        if self.settings is not None:
+            self.config_mtime = None
+            self.load_config_from_settings(self.settings)
+        elif os.path.isfile(self.config_file):
+            self.config_mtime = os.stat(self.config_file).st_mtime_ns
             self.load_config_from_file()
         else:
+            self.config_mtime = None
             self.load_config_from_env()
 
+        if self.catch_up_rate <= 0:
+            msg = (
+                "CatchUpRate / CATCH_UP_RATE should be more than 0, "
+                f"not {self.catch_up_rate}"
+            )
+            raise ValueError(msg)
+
+    def refresh(self):
+        """
+        For long-running processes, which reuse one Poster for every run.
+
+        If the config file has changed since we loaded it, load it again and
+        recreate the clients. Otherwise do nothing.
+        """
+        if self.settings is not None or not os.path.isfile(self.config_file):
+            return
+
+        if os.stat(self.config_file).st_mtime_ns != self.config_mtime:
+            self.logger.info("Config file has changed; reloading")
+            # Our new lease will have a new owner, so let it be taken.
+            if self.run_lease is not None:
+                self.run_lease.release()
+            self.load_config()
+            setup_logging(__name__, self.log_format)
+            self.logger.set_verbose(self.verbose)
+            self.profiler = self.make_profiler()
+            self.setup_index()
+            self.setup_clients()
+
     def load_config_from_file(self):
         config = configparser.ConfigParser()
         config.read(self.config_file)
 
-        settings = config["DEFAULT"]
+        self.load_config_from_settings(config["DEFAULT"])
 
-        self.twitter_consumer_key = settings["TwitterConsumerKey"]
-        self.twitter_consumer_secret = settings["TwitterConsumerSecret"]
-        self.twitter_access_token = settings["TwitterAccessToken"]
-        self.twitter_access_token_secret = settings["TwitterAccessTokenSecret"]
+    def load_config_from_settings(self, settings):
+        "Load the config from a mapping like config.cfg's [DEFAULT] section."
+        self.twitter_consumer_key = settings.get("TwitterConsumerKey", "")
+        self.twitter_consumer_secret = settings.get("TwitterConsumerSecret", "")
+        self.twitter_access_token = settings.get("TwitterAccessToken", "")
+        self.twitter_access_token_secret = settings.get("TwitterAccessTokenSecret", "")
+        self.twitter_api_base_url = settings.get(
+            "TwitterApiBaseUrl", self.twitter_api_base_url
+        )
 
-        self.mastodon_client_id = settings["MastodonClientId"]
-        self.mastodon_client_secret = settings["MastodonClientSecret"]
-        self.mastodon_access_token = settings["MastodonAccessToken"]
-        self.mastodon_api_base_url = settings["MastodonApiBaseUrl"]
+        self.mastodon_client_id = settings.get("MastodonClientId", "")
+        self.mastodon_client_secret = settings.get("MastodonClientSecret", "")
+        self.mastodon_access_token = settings.get("MastodonAccessToken", "")
+        self.mastodon_api_base_url = settings.get(
+            "MastodonApiBaseUrl", self.mastodon_api_base_url
+        )
+        self.mastodon_max_characters = int(
+            settings.get("MastodonMaxCharacters", self.mastodon_max_characters)
+        )
 
-        self.atproto_handle = settings["ATProtoHandle"]
-        self.atproto_password = settings["ATProtoPassword"]
+        self.atproto_handle = settings.get("ATProtoHandle", "")
+        self.atproto_password = settings.get("ATProtoPassword", "")
+        self.atproto_base_url = settings.get("ATProtoBaseUrl", self.atproto_base_url)
 
         self.verbose = int(settings.get("Verbose", self.verbose))
+        self.log_format = settings.get("LogFormat", self.log_format)
         self.years_ahead = int(settings.get("YearsAhead", self.years_ahead))
+        self.posts_dir = os.path.join(
+            self.project_root, settings.get("PostsDir", self.posts_dir)
+        )
         self.timezone = settings.get("Timezone", self.timezone)
         self.max_time_window = int(settings.get("MaxTimeWindow", self.max_time_window))
+        self.use_post_index = bool(
+            int(settings.get("UsePostIndex", self.use_post_index))
+        )
+        self.use_schedule = bool(int(settings.get("UseSchedule", self.use_schedule)))
+        self.use_posted_ledger = bool(
+            int(settings.get("UsePostedLedger", self.use_posted_ledger))
+        )
+        profile_dir = settings.get("ProfileDir", self.profile_dir)
+        self.profile_dir = profile_dir and os.path.join(self.project_root, profile_dir)
+        self.profile_rate = float(settings.get("ProfileRate", self.profile_rate))
+        self.profile_memory = bool(
+            int(settings.get("ProfileMemory", self.profile_memory))
+        )
+        self.clock_mode = settings.get("ClockMode", self.clock_mode)
+        self.use_outbox = bool(int(settings.get("UseOutbox", self.use_outbox)))
+        self.catch_up = bool(int(settings.get("CatchUp", self.catch_up)))
+        self.catch_up_rate = float(settings.get("CatchUpRate", self.catch_up_rate))
+        self.metrics_port = int(settings.get("MetricsPort", self.metrics_port))
+        self.push_metrics = bool(int(settings.get("PushMetrics", self.push_metrics)))
+        self.run_lease_seconds = float(
+            settings.get("RunLeaseSeconds", self.run_lease_seconds)
+        )
 
         redis_url = urlparse.urlparse(settings.get("RedisURL"))
         self.redis_hostname = redis_url.hostname
@@ -152,21 +440,56 @@ class Poster:
         self.twitter_consumer_secret = os.environ.get("TWITTER_CONSUMER_SECRET")
         self.twitter_access_token = os.environ.get("TWITTER_ACCESS_TOKEN")
         self.twitter_access_token_secret = os.environ.get("TWITTER_ACCESS_TOKEN_SECRET")
+        self.twitter_api_base_url = os.environ.get(
+            "TWITTER_API_BASE_URL", self.twitter_api_base_url
+        )
 
         self.mastodon_client_id = os.environ.get("MASTODON_CLIENT_ID")
         self.mastodon_client_secret = os.environ.get("MASTODON_CLIENT_SECRET")
         self.mastodon_access_token = os.environ.get("MASTODON_ACCESS_TOKEN")
         self.mastodon_api_base_url = os.environ.get("MASTODON_API_BASE_URL")
+        self.mastodon_max_characters = int(
+            os.environ.get("MASTODON_MAX_CHARACTERS", self.mastodon_max_characters)
+        )
 
         self.atproto_handle = os.environ.get("ATPROTO_HANDLE")
         self.atproto_password = os.environ.get("ATPROTO_PASSWORD")
+        self.atproto_base_url = os.environ.get(
+            "ATPROTO_BASE_URL", self.atproto_base_url
+        )
 
         self.verbose = int(os.environ.get("VERBOSE", self.verbose))
+        self.log_format = os.environ.get("LOG_FORMAT", self.log_format)
         self.years_ahead = int(os.environ.get("YEARS_AHEAD", self.years_ahead))
+        self.posts_dir = os.path.join(
+            self.project_root, os.environ.get("POSTS_DIR", self.posts_dir)
+        )
         self.timezone = os.environ.get("TIMEZONE", self.timezone)
         self.max_time_window = int(
             os.environ.get("MAX_TIME_WINDOW", self.max_time_window)
         )
+        self.use_post_index = bool(
+            int(os.environ.get("USE_POST_INDEX", self.use_post_index))
+        )
+        self.use_schedule = bool(int(os.environ.get("USE_SCHEDULE", self.use_schedule)))
+        self.use_posted_ledger = bool(
+            int(os.environ.get("USE_POSTED_LEDGER", self.use_posted_ledger))
+        )
+        profile_dir = os.environ.get("PROFILE_DIR", self.profile_dir)
+        self.profile_dir = profile_dir and os.path.join(self.project_root, profile_dir)
+        self.profile_rate = float(os.environ.get("PROFILE_RATE", self.profile_rate))
+        self.profile_memory = bool(
+            int(os.environ.get("PROFILE_MEMORY", self.profile_memory))
+        )
+        self.clock_mode = os.environ.get("CLOCK_MODE", self.clock_mode)
+        self.use_outbox = bool(int(os.environ.get("USE_OUTBOX", self.use_outbox)))
+        self.catch_up = bool(int(os.environ.get("CATCH_UP", self.catch_up)))
+        self.catch_up_rate = float(os.environ.get("CATCH_UP_RATE", self.catch_up_rate))
+        self.metrics_port = int(os.environ.get("METRICS_PORT", self.metrics_port))
+        self.push_metrics = bool(int(os.environ.get("PUSH_METRICS", self.push_metrics)))
+        self.run_lease_seconds = float(
+            os.environ.get("RUN_LEASE_SECONDS", self.run_lease_seconds)
+        )
 
         redis_url = urlparse.urlparse(os.environ.get("REDIS_URL"))
         self.redis_hostname = redis_url.hostname
@@ -174,76 +497,458 @@ class Poster:
         self.redis_password = redis_url.password
 
     def start(self):
+        """
+        Send, or queue, any posts that are due. If we're using a lease, only
+        if we can take it (or already have it) so no other process is
+        running this at the same time.
+        """
+        # So every line logged during this run can be found by its ID:
+        run_id = self.logger.new_run()
+        profile = self.profiler.profile(run_id) if self.profiler else nullcontext()
+
+        try:
+            if self.run_lease is None:
+                with profile:
+                    self.run()
+                return
+
+            if not self.run_lease.acquire():
+                self.logger.debug("Another process has the run lease; not running")
+                return
+
+            try:
+                with profile:
+                    self.run()
+            except (LeaseLostError, WatchError):
+                self.logger.error("Lost the run lease; stopped without saving state")
+            finally:
+                self.run_lease.done()
+        finally:
+            self.logger.end_run()
+
+    def run(self):
         self.logger.debug("Running start()")
+        self.metrics.inc("poster_runs_total")
 
         # eg datetime.datetime(2014, 4, 25, 18, 59, 51, tzinfo=<UTC>)
-        last_run_time = self.get_last_run_time()
+        with self.metrics.timer("poster_stage_seconds", stage="state_read"):
+            last_run_time = self.load_state()
         self.logger.debug("Last run time: %s", last_run_time)
 
         # We need to have a last_run_time set before we can send any posts.
         # So the first time this is run, we can't do anythning.
         if last_run_time is None:
-            self.set_last_run_time()
+            pipe = self.get_state_pipeline()
+            self.set_last_run_time(pipe)
+            pipe.execute()
             self.logger.warning(
                 "No last_run_time in database.\n"
                 "This must be the first time this has been run.\n"
                 "Settinge last_run_time now.\n"
                 "Run the script again in a minute or more, and it should work."
             )
-            sys.exit(0)
+            return
 
-        local_time_now = datetime.datetime.now(self.local_tz)
+        local_time_now = self.now(self.local_tz)
 
-        year_dir = str(int(local_time_now.strftime("%Y")) - self.years_ahead)
-        month_file = "{}.txt".format(local_time_now.strftime("%m"))
+        # Stage name -> seconds, for the stages of finding the due posts:
+        timings = {}
+        select_start = time.perf_counter()
 
-        # eg posts/1660/01.txt
-        path = os.path.join(self.project_root, "posts", year_dir, month_file)
+        if self.use_schedule:
+            posts_to_send = self.get_posts_to_send_from_schedule(
+                last_run_time, local_time_now, timings
+            )
+        elif self.use_post_index:
+            posts_to_send = self.get_posts_to_send_from_index(
+                last_run_time, local_time_now, timings
+            )
+        else:
+            with closing(self.iter_month_posts(local_time_now, timings)) as month_posts:
+                posts_to_send = self.get_posts_to_send(
+                    month_posts, last_run_time, local_time_now
+                )
+
+        # Whatever time wasn't spent reading posts was spent choosing them:
+        timings["select"] = time.perf_counter() - select_start - sum(timings.values())
+        for stage, seconds in timings.items():
+            self.metrics.observe("poster_stage_seconds", seconds, stage=stage)
+
+        # We want to post the oldest one first, so reverse list. Any missed
+        # posts we're catching up with are older still, so they go first.
+        posts_to_send = posts_to_send[::-1]
+        if self.catch_up:
+            with self.metrics.timer("poster_stage_seconds", stage="backlog"):
+                posts_to_send = self.get_backlog_posts(last_run_time) + posts_to_send
+
+        if self.use_outbox:
+            # Queue the posts for worker.py to publish, oldest first, and set
+            # last_run_time, in one transaction. So if we die, either all of the
+            # posts are queued, or none are and the next run will find them.
+            with self.metrics.timer("poster_stage_seconds", stage="queue"):
+                pipe = self.get_state_pipeline()
+                self.outbox.queue_posts(pipe, posts_to_send, self.get_networks())
+                self.save_run_state(pipe)
+                pipe.execute()
+            return
 
-        with open(path) as file:
-            lines = [line.strip() for line in file]
+        with self.metrics.timer("poster_stage_seconds", stage="state_write"):
+            pipe = self.get_state_pipeline()
+            self.save_run_state(pipe)
+            pipe.execute()
+
+        with self.metrics.timer("poster_stage_seconds", stage="send"):
+            self.send_to_networks(posts_to_send)
+
+    def get_state_pipeline(self):
+        """
+        Returns a Redis transaction for saving the run's state. If we're using
+        a lease, it will only happen if we still have it.
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        if self.run_lease is not None:
+            self.run_lease.fence(pipe)
+        return pipe
+
+    def save_run_state(self, pipe):
+        """
+        Add the commands to save last_run_time and, if we're catching up,
+        the backlog, to a Redis pipeline.
+        """
+        self.set_last_run_time(pipe)
+        if self.catch_up:
+            self.backlog.save(pipe)
+
+    def get_backlog_posts(self, last_run_time):
+        """
+        Adds any posts we've missed since last_run_time, that are now too old
+        to send, to the backlog. Returns a list of dicts of those posts from
+        the backlog that we can send now (as for get_posts_to_send()), oldest
+        first, and removes them from it.
+        """
+        time_now = self.now()
+        window_start = time_now - datetime.timedelta(minutes=self.max_time_window)
+        # The live window sends posts from the minute at or after window_start
+        # (see get_index_key(round_up=True)), so the backlog ends before that.
+        if window_start.second or window_start.microsecond:
+            window_start = window_start.replace(second=0, microsecond=0)
+            window_start += datetime.timedelta(minutes=1)
+
+        if last_run_time < window_start:
+            # Posts at window_start will be sent as usual.
+            end = window_start - datetime.timedelta(seconds=1)
+            self.logger.warning(
+                "Missed posts due between %s and %s; adding them to the backlog",
+                last_run_time,
+                end,
+            )
+            self.backlog.add(last_run_time, end)
 
-        all_posts = self.get_all_posts(lines)
+        if not self.backlog.periods:
+            return []
 
-        posts_to_send = self.get_posts_to_send(all_posts, last_run_time, local_time_now)
+        allowance = self.backlog.take_allowance(time_now, self.catch_up_rate)
+        posts = []
 
-        self.set_last_run_time()
+        while self.backlog.periods and len(posts) < allowance:
+            start, end = self.backlog.periods[0]
+            found = self.get_missed_posts(start, end, allowance - len(posts))
+            posts.extend(found)
 
-        # We want to tweet the oldest one first, so reverse list:
-        self.send_tweets(posts_to_send[::-1])
+            if len(posts) < allowance:
+                # There are no more in this period.
+                self.backlog.sent_up_to(None)
+            else:
+                self.backlog.sent_up_to(
+                    self.modernize_time(found[-1]["time"]).astimezone(datetime.UTC)
+                )
 
-        # And the same with Mastodon toots:
-        self.send_toots(posts_to_send[::-1])
+        remaining = sum(
+            self.count_missed_posts(start, end) for start, end in self.backlog.periods
+        )
+        self.logger.info(
+            "Backlog: sending %s missed posts now, %s left to send, "
+            "which will take about %.0f minutes at %s a minute",
+            len(posts),
+            remaining,
+            remaining / self.catch_up_rate,
+            self.catch_up_rate,
+        )
 
-        # Adn the same with Bluesky skeets:
-        self.send_skeets(posts_to_send[::-1])
+        return posts
 
-    def get_all_posts(self, lines):
+    def iter_missed_positions(self, start, end):
         """
-        Go through all the lines in the file and, for any that contain
-        valid post data, add them to a list to return.
+        Yields a (year_index, i) tuple for each post in the post index whose
+        modern time is after `start` and no later than `end` (UTC datetimes),
+        oldest first. The index is used whatever use_post_index is set to.
+        """
+        local_start = start.astimezone(self.local_tz)
+        local_end = end.astimezone(self.local_tz)
+
+        for year in range(
+            local_start.year - self.years_ahead, local_end.year - self.years_ahead + 1
+        ):
+            year_index = self.post_index.get_year(year)
+            if year_index is None:
+                continue
+
+            from_key = self.get_index_key(local_start, year) + 1
+            before_key = self.get_index_key(local_end, year) + 1
 
-        Returns a list of dicts, each one data about a post.
+            for i in year_index.range(from_key, before_key):
+                yield year_index, i
+
+    def get_missed_posts(self, start, end, limit):
+        """
+        Returns a list of up to `limit` dicts of posts (as for
+        get_posts_to_send()) whose modern times are after `start` and no
+        later than `end` (UTC datetimes), oldest first.
         """
         posts = []
 
-        for line in lines:
-            if line != "":
-                post = self.parse_post_line(line)
+        for year_index, i in self.iter_missed_positions(start, end):
+            post_time = year_index.time(i)
+            if not self.modernize_time(post_time):
+                continue
 
-                if post:
-                    posts.append(post)
-                else:
-                    # An invalid line format or invalid post time.
-                    continue
+            posts.append(
+                {
+                    "time": post_time,
+                    "text": self.post_index.read_text(year_index, i),
+                    "is_reply": year_index.is_reply(i),
+                    "in_reply_to_time": self.get_index_reply_time(year_index, i),
+                }
+            )
+            if len(posts) == limit:
+                break
 
         return posts
 
+    def count_missed_posts(self, start, end):
+        "Returns how many posts there are between `start` and `end`, as above."
+        return sum(1 for _ in self.iter_missed_positions(start, end))
+
+    def send_to_networks(self, posts):
+        """
+        Send the posts to Twitter, Mastodon and Bluesky at the same time, each
+        in its own thread, so that one network being slow or failing doesn't
+        hold up the others. Each network still sends the posts in order.
+
+        `posts` should be in the order in which they need to be posted.
+        """
+        if len(posts) == 0:
+            return
+
+        senders = {
+            "twitter": self.send_tweets,
+            "mastodon": self.send_toots,
+            "bluesky": self.send_skeets,
+        }
+
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(
+            max_workers=len(senders), thread_name_prefix="send"
+        ) as executor:
+            futures = {
+                network: executor.submit(self.timed_send, network, sender, posts)
+                for network, sender in senders.items()
+            }
+
+        for network, future in futures.items():
+            e = future.exception()
+            if e is not None:
+                self.logger.error("Error sending to %s: %s", network, e, exc_info=e)
+
+        self.logger.info(
+            "Sent %s posts to all networks in %.2f seconds",
+            len(posts),
+            time.perf_counter() - start,
+        )
+
+    def get_networks(self):
+        "Returns a list of the names of the networks we're configured to post to."
+        networks = []
+        if self.twitter_api is not None:
+            networks.append("twitter")
+        if self.mastodon_api is not None:
+            networks.append("mastodon")
+        if self.atproto_handle:
+            networks.append("bluesky")
+        return networks
+
+    def send_one(self, network, post):
+        """
+        Send a single post to one network, eg "mastodon". Used by worker.py.
+        Returns True if it was sent (or had already been sent), False if not.
+        """
+        state = {
+            "twitter": self.tweet_state,
+            "mastodon": self.toot_state,
+            "bluesky": self.skeet_state,
+        }[network]
+
+        # Other workers might have posted since we last looked.
+        state.load()
+
+        if state.get("time") == post["time"]:
+            # We must have sent this but died before it was marked as done.
+            self.logger.info("Already sent %s to %s", post["time"], network)
+            return True
+
+        if network == "twitter":
+            return self.measure_send(network, self.send_tweet, post)
+        elif network == "mastodon":
+            return self.measure_send(network, self.send_toot, post)
+
+        from atproto.exceptions import AtProtocolError
+
+        try:
+            client = self.get_atproto_client()
+        except (AtProtocolError, RateLimitedError) as e:
+            self.logger.error(e)
+            self.metrics.inc("poster_send_errors_total", network=network)
+            return False
+        return self.measure_send(
+            network, lambda post: self.send_skeet(client, post), post
+        )
+
+    def measure_send(self, network, send, post):
+        """
+        Returns send(post), recording how long that took, whether it worked,
+        and how long after its modernized time the post was published.
+        If the ledger says the post has already been sent, it's not sent
+        again, and this returns True.
+        """
+        if self.run_lease is not None and self.run_lease.lost:
+            self.logger.error("Lost the run lease; not sending %s", post["time"])
+            self.metrics.inc("poster_send_errors_total", network=network)
+            return False
+
+        if self.ledger is not None and self.ledger.has(network, post):
+            self.logger.warning("Already sent %s to %s", post["time"], network)
+            self.metrics.inc("poster_posts_skipped_total", network=network)
+            return True
+
+        start = time.perf_counter()
+        sent = send(post)
+        self.metrics.observe(
+            "poster_send_seconds", time.perf_counter() - start, network=network
+        )
+
+        if not sent:
+            self.metrics.inc("poster_send_errors_total", network=network)
+            return sent
+
+        self.metrics.inc("poster_posts_sent_total", network=network)
+        if self.ledger is not None:
+            self.ledger.add(network, post)
+
+        target_time = self.modernize_time(post["time"])
+        if target_time:
+            drift = self.now(self.local_tz) - target_time
+            self.metrics.observe(
+                "poster_publish_drift_seconds",
+                drift.total_seconds(),
+                network=network,
+            )
+        return sent
+
+    def timed_send(self, network, sender, posts):
+        """
+        Calls sender(posts) and logs how long it took, and how much of that
+        was spent waiting because of rate limits.
+        """
+        before = self.pacers[network].get_stats()
+        start = time.perf_counter()
+        sender(posts)
+        after = self.pacers[network].get_stats()
+        self.logger.info(
+            "Sent %s posts to %s in %.2f seconds "
+            "(%.2f waiting, %.2f sending, %s retries)",
+            len(posts),
+            network,
+            time.perf_counter() - start,
+            after["waiting_time"] - before["waiting_time"],
+            after["sending_time"] - before["sending_time"],
+            after["retries"] - before["retries"],
+        )
+
+    def is_retryable_tweet_error(self, e):
+        "Is this exception from tweepy worth retrying the request after?"
+        import tweepy
+
+        return isinstance(e, (tweepy.TooManyRequests, tweepy.TwitterServerError))
+
+    def is_retryable_toot_error(self, e):
+        "Is this exception from Mastodon.py worth retrying the request after?"
+        from mastodon import (
+            MastodonNetworkError,
+            MastodonRatelimitError,
+            MastodonServerError,
+        )
+
+        return isinstance(
+            e, (MastodonRatelimitError, MastodonServerError, MastodonNetworkError)
+        )
+
+    def is_retryable_skeet_error(self, e):
+        "Is this exception from atproto worth retrying the request after?"
+        from atproto.exceptions import RequestErrorBase
+
+        if not isinstance(e, RequestErrorBase):
+            return False
+        if e.response is None:
+            # A timeout or network error.
+            return True
+        return e.response.status_code == 429 or e.response.status_code >= 500
+
+    def get_month_path(self, local_time_now):
+        "Returns the path to the posts file for the month we're in now."
+        year_dir = str(int(local_time_now.strftime("%Y")) - self.years_ahead)
+        month_file = "{}.txt".format(local_time_now.strftime("%m"))
+
+        # eg posts/1660/01.txt
+        return os.path.join(self.posts_dir, year_dir, month_file)
+
+    def iter_month_posts(self, local_time_now, timings=None):
+        """
+        Yields the Posts in the posts file for the month we're in now, newest
+        first, skipping any whose time doesn't map to a valid modern time.
+
+        The file is only read and parsed as far as the Posts are asked for,
+        so call close() on this if you don't use them all.
+
+        timings - Optional dict. When we're done, the seconds spent reading
+            the file and parsing it are set as "month_load" and "month_parse".
+        """
+        clock = time.perf_counter
+        start = clock()
+        # Seconds spent in here, not counting while the caller has a Post:
+        seconds = 0.0
+        file = None
+
+        try:
+            with open(self.get_month_path(local_time_now), "rb") as raw_file:
+                file = TimedFile(raw_file, seconds=clock() - start)
+                for post in read_posts(file):
+                    if self.modernize_time(post):
+                        seconds += clock() - start
+                        yield post
+                        start = clock()
+                seconds += clock() - start
+        finally:
+            if timings is not None and file is not None:
+                timings["month_load"] = file.seconds
+                timings["month_parse"] = seconds - file.seconds
+
     def get_posts_to_send(self, all_posts, last_run_time, local_time_now):
         """
         Work out which of all the posts in the month need to be sent.
 
-        all_posts - List of dicts, one per post
+        all_posts - Iterable of Posts, newest first. We stop taking Posts from
+            it once we reach those that are too old to send.
         last_run_time - datetime object for when the script was last run
         local_time_now - timezone-aware datetime for now
 
@@ -254,8 +959,14 @@ class Poster:
 
         local_last_run_time = last_run_time.astimezone(self.local_tz)
 
-        for n, post in enumerate(all_posts):
-            local_modern_post_time = self.modernize_time(post["time"])
+        posts = iter(all_posts)
+        post = next(posts, None)
+
+        while post is not None:
+            # The next, older, post, if we've had to get it already:
+            next_post = None
+
+            local_modern_post_time = self.modernize_time(post)
             now_minus_post = (local_time_now - local_modern_post_time).total_seconds()
 
             if now_minus_post > 0:
@@ -270,15 +981,14 @@ class Poster:
                 ):
                     # And post is since we last ran and within our max time window.
 
-                    if post["is_reply"] is True:
+                    in_reply_to_time = None
+
+                    if post.is_reply:
                         # Get the time of the previous post, which is the one
                         # this post is replying to.
-                        prev_post = all_posts[n + 1]
-                        in_reply_to_time = prev_post["time"]
-                    else:
-                        in_reply_to_time = None
-
-                    post["in_reply_to_time"] = in_reply_to_time
+                        next_post = next(posts, None)
+                        if next_post is not None:
+                            in_reply_to_time = next_post.time
 
                     self.logger.info(
                         "Preparing: '%s...' "
@@ -288,80 +998,241 @@ class Poster:
                         "local_modern_post_time: %s, "
                         "post_minus_last_run: %s, "
                         "in_reply_to_time: %s",
-                        post["text"][:20],
-                        post["time"],
-                        post["is_reply"],
+                        post.text.strip()[:20],
+                        post.time,
+                        post.is_reply,
                         local_last_run_time,
                         local_modern_post_time,
                         post_minus_last_run,
                         in_reply_to_time,
                     )
 
-                    posts_to_send.append(post)
+                    posts_to_send.append(
+                        {
+                            "time": post.time,
+                            "text": post.text.strip(),
+                            "is_reply": post.is_reply,
+                            "in_reply_to_time": in_reply_to_time,
+                        }
+                    )
                 else:
                     break
 
+            post = next_post or next(posts, None)
+
         return posts_to_send
 
-    def parse_post_line(self, line):
+    def get_posts_to_send_from_index(self, last_run_time, local_time_now, timings=None):
         """
-        Given one line from a text file, try to parse it out into time and
-        post text.
+        Does the same job as get_posts_to_send() but using the prebuilt
+        index of posts, so we only read the lines of posts that are due.
+
+        last_run_time - datetime object for when the script was last run
+        local_time_now - timezone-aware datetime for now
+        timings - Optional dict. The seconds spent loading (and, if needed,
+            building) the year's index are set in it as "index_load".
+
+        Returns a list of dicts of the posts that need sending, most recent
+        first.
+        """
+        year = local_time_now.year - self.years_ahead
+        start = time.perf_counter()
+        year_index = self.post_index.get_year(year)
+        if timings is not None:
+            timings["index_load"] = time.perf_counter() - start
+
+        if year_index is None:
+            self.logger.error("No posts directory for %s", year)
+            return []
+
+        local_last_run_time = last_run_time.astimezone(self.local_tz)
+        window_start = local_time_now - datetime.timedelta(minutes=self.max_time_window)
 
-        Returns a dict of data if successful, otherwise False
+        # Posts must be since we last ran, within our max time window,
+        # and before now:
+        from_key = max(
+            self.get_index_key(local_last_run_time, year) + 1,
+            self.get_index_key(window_start, year, round_up=True),
+        )
+        before_key = self.get_index_key(local_time_now, year, round_up=True)
+
+        posts_to_send = []
+
+        for i in reversed(year_index.range(from_key, before_key)):
+            post_time = year_index.time(i)
+            local_modern_post_time = self.modernize_time(post_time)
 
-        A line is like one of:
+            if not local_modern_post_time:
+                continue
 
-        1666-02-09 14:08 This is my text
-        1666-02-09 14:08   This is my text
-        1666-02-09 14:08 r This is my text
-        1666-02-09 14:08 r   This is my text
+            in_reply_to_time = self.get_index_reply_time(year_index, i)
+
+            post = {
+                "time": post_time,
+                "text": self.post_index.read_text(year_index, i),
+                "is_reply": year_index.is_reply(i),
+                "in_reply_to_time": in_reply_to_time,
+            }
+
+            self.logger.info(
+                "Preparing: '%s...' "
+                "timed %s, "
+                "is_reply: %s, "
+                "local_last_run_time: %s, "
+                "local_modern_post_time: %s, "
+                "in_reply_to_time: %s",
+                post["text"][:20],
+                post["time"],
+                post["is_reply"],
+                local_last_run_time,
+                local_modern_post_time,
+                in_reply_to_time,
+            )
+
+            posts_to_send.append(post)
+
+        return posts_to_send
+
+    def get_posts_to_send_from_schedule(
+        self, last_run_time, local_time_now, timings=None
+    ):
         """
-        post = False
+        Does the same job as get_posts_to_send() but using the schedule in
+        Redis. If we have the posts directory, the schedule is updated first.
 
-        pattern = r"""
-            ^                           # Start of line
-            (
-                \d\d\d\d-\d\d-\d\d      # Date like 1666-02-09
-                \s
-                \d\d\:\d\d              # Time like 14:08
-            )                           # GROUP 1: Date and time
-            (?:                         # Don't count this group
-                \s                      # A space before the 'r'
-                (
-                    \w                   # A literal 'r' (probably).
-                )                       # GROUP 2: r (or None)
-            )?                          # The 'r ' is optional
-            \s+                         # One or more spaces
-            (.*?)                       # The post text
-            $                           # End of line
+        last_run_time - datetime object for when the script was last run
+        local_time_now - timezone-aware datetime for now
+        timings - Optional dict. The seconds spent updating the schedule are
+            set in it as "schedule_load".
+
+        Returns a list of dicts of the posts that need sending, most recent
+        first.
         """
+        if os.path.isdir(self.posts_dir):
+            start = time.perf_counter()
+            self.schedule.update(self, local_time_now)
+            if timings is not None:
+                timings["schedule_load"] = time.perf_counter() - start
+
+        window_start = local_time_now - datetime.timedelta(minutes=self.max_time_window)
+
+        # Posts must be since we last ran, within our max time window,
+        # and before now:
+        if window_start > last_run_time:
+            posts_to_send = self.schedule.get_posts(
+                window_start, local_time_now, include_start=True
+            )
+        else:
+            posts_to_send = self.schedule.get_posts(last_run_time, local_time_now)
 
-        line_match = re.search(pattern, line, re.VERBOSE)
+        for post in posts_to_send:
+            self.logger.info(
+                "Preparing: '%s...' timed %s, is_reply: %s, in_reply_to_time: %s",
+                post["text"][:20],
+                post["time"],
+                post["is_reply"],
+                post["in_reply_to_time"],
+            )
 
-        if line_match:
-            [post_time, post_kind, post_text] = line_match.groups()
+        return posts_to_send
 
-            # Check the time maps to a valid modern time:
-            local_modern_post_time = self.modernize_time(post_time)
+    def get_index_reply_time(self, year_index, i):
+        """
+        If post i in the year's index is a reply, returns the time of the post
+        it replies to. Otherwise returns None.
+        """
+        if not year_index.is_reply(i):
+            return None
 
-            if local_modern_post_time:
-                is_reply = bool(post_kind == "r")
+        # The post this replies to is the previous valid post, which might be
+        # in the previous month's file.
+        for j in range(i - 1, -1, -1):
+            if self.modernize_time(year_index.time(j)):
+                return year_index.time(j)
 
-                post = {
-                    "time": post_time,
-                    "text": post_text.strip(),
-                    "is_reply": is_reply,
-                }
+        return None
 
-        return post
+    def get_index_key(self, local_time, year, *, round_up=False):
+        """
+        Returns the post_index key for a modern, local, datetime, as if it
+        were in the dated posts' `year`.
+
+        If round_up is True, any seconds round the time up to the next minute.
+        Times before or after `year` return keys before or after any post.
+        """
+        if round_up and (local_time.second or local_time.microsecond):
+            local_time = local_time.replace(second=0, microsecond=0)
+            local_time += datetime.timedelta(minutes=1)
+
+        local_year = local_time.year - self.years_ahead
+
+        if local_year < year:
+            return -1
+        elif local_year > year:
+            return END_KEY
+
+        return time_key(
+            local_time.month, local_time.day, local_time.hour, local_time.minute
+        )
+
+    def make_profiler(self):
+        "Returns a Profiler for our runs, or None if we're not profiling."
+        if not self.profile_dir:
+            return None
+
+        return Profiler(
+            self.profile_dir,
+            f"poster-{self.name}" if self.name else "poster",
+            {
+                # get_posts_to_send() includes reading iter_month_posts().
+                "find due posts": [
+                    self.get_posts_to_send,
+                    self.get_posts_to_send_from_index,
+                    self.get_posts_to_send_from_schedule,
+                ],
+                "parse posts": [parse_posts],
+                "modernize_time": [self.modernize_time],
+                "redis": [os.path.dirname(redis.__file__)],
+                "send_tweet": [self.send_tweet],
+                "send_toot": [self.send_toot],
+                "send_skeet": [self.send_skeet],
+            },
+            rate=self.profile_rate,
+            memory=self.profile_memory,
+        )
+
+    def get_limits(self):
+        "Returns a dict of each network's name -> the longest a post can be."
+        return {**LIMITS, "mastodon": self.mastodon_max_characters}
+
+    def get_rendered(self, network, post):
+        """
+        Returns a dict of what `post` will be on `network` (see render.py):
+        its length and, if it's too long, the thread of posts to send instead.
+        """
+        rendered = self.renders.get(network, post["time"])
+        if rendered is None:
+            # We don't have the posts directory (eg, we're using the schedule).
+            rendered = render(network, post["text"], self.get_limits()[network])
+        return rendered
+
+    def now(self, tz=datetime.UTC):
+        """
+        Returns the current time, in timezone `tz`. Everything that needs to
+        know the time uses this, so a simulation (see simulate.py) can replace
+        it with a virtual clock.
+        """
+        return datetime.datetime.now(tz)
 
-    def set_last_run_time(self):
+    def set_last_run_time(self, pipe=None):
         """
         Set the 'last run time' in the database to now, in UTC.
+        If `pipe` is a Redis pipeline the command is added to that instead.
         """
-        time_now = datetime.datetime.now(datetime.UTC)
-        self.redis.set("last_run_time", time_now.strftime("%Y-%m-%d %H:%M:%S"))
+        time_now = self.now()
+        (pipe or self.redis).set(
+            self.redis_key("last_run_time"), time_now.strftime("%Y-%m-%d %H:%M:%S")
+        )
 
     def get_last_run_time(self):
         """
@@ -370,8 +1241,35 @@ class Poster:
         datetime.datetime(2014, 4, 25, 18, 59, 51, tzinfo=<UTC>)
         or `None` if it isn't currently set.
         """
-        last_run_time = self.redis.get("last_run_time")
+        return self.parse_last_run_time(self.redis.get(self.redis_key("last_run_time")))
+
+    def load_state(self):
+        """
+        Get the 'last run time', every network's state and, if we're catching
+        up, the backlog, from the database, all in one round trip.
+        Returns the last run time, as get_last_run_time() does.
+        """
+        states = (self.tweet_state, self.toot_state, self.skeet_state)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.redis_key("last_run_time"))
+        for state in states:
+            state.queue_load(pipe)
+        if self.catch_up:
+            self.backlog.queue_load(pipe)
+
+        results = pipe.execute()
+
+        last_run_time = results.pop(0)
+        for state in states:
+            state.loaded(results.pop(0), results.pop(0))
+        if self.catch_up:
+            self.backlog.loaded(results.pop(0))
+
+        return self.parse_last_run_time(last_run_time)
 
+    def parse_last_run_time(self, last_run_time):
+        "Turns the string stored in the database into a datetime, or None."
         if last_run_time:
             return datetime.datetime.strptime(
                 last_run_time, "%Y-%m-%d %H:%M:%S"
@@ -381,22 +1279,26 @@ class Poster:
 
     def modernize_time(self, t):
         """
-        Takes a time string like `1661-04-28 12:34` and translates it to the
-        modern equivalent in local time, eg:
+        Takes a time string like `1661-04-28 12:34`, or a Post, and translates
+        it to the modern equivalent in local time, eg:
         datetime.datetime(
             2014, 4, 28, 12, 34, 00,
             tzinfo=<DstTzInfo 'Europe/London' BST+1:00:00 DST>)
         Returns False if something goes wrong.
         """
-        naive_time = datetime.datetime.strptime(t, "%Y-%m-%d %H:%M")  # noqa: DTZ007
+        if isinstance(t, str):
+            year, month, day, hour, minute = parse_time(t)
+        else:
+            year, month, day, hour, minute = t[:5]
+            t = t.time
+
         try:
             local_modern_time = datetime.datetime(
-                naive_time.year + self.years_ahead,
-                naive_time.month,
-                naive_time.day,
-                naive_time.hour,
-                naive_time.minute,
-                naive_time.second,
+                year + self.years_ahead,
+                month,
+                day,
+                hour,
+                minute,
                 tzinfo=self.local_tz,
             )
         except ValueError as e:
@@ -426,34 +1328,55 @@ class Poster:
             return
 
         for post in posts:
-            previous_status_id = None
+            self.measure_send("twitter", self.send_tweet, post)
 
-            if post["in_reply_to_time"] is not None:
-                # This tweet is a reply, so check that it's a reply to the
-                # immediately previous tweet.
-                # It *should* be, but if something went wrong, maybe not.
-                previous_status_time = self.redis.get("previous_tweet_time")
+    def send_tweet(self, post):
+        """
+        Tweet a single post (a dict, as for send_tweets()).
+        Returns True if it was sent, False if not.
+        """
+        previous_status_id = None
 
-                if post["in_reply_to_time"] == previous_status_time:
-                    previous_status_id = self.redis.get("previous_tweet_id")
+        if post["in_reply_to_time"] is not None:
+            # This tweet is a reply, so check that it's a reply to the
+            # immediately previous tweet.
+            # It *should* be, but if something went wrong, maybe not.
+            previous_status_time = self.tweet_state.get("time")
 
-            self.logger.info(
-                "Tweeting: %s [%s characters]", post["text"], len(post["text"])
-            )
+            if post["in_reply_to_time"] == previous_status_time:
+                previous_status_id = self.tweet_state.get("id")
+
+        rendered = self.get_rendered("twitter", post)
+        self.logger.info(
+            "Tweeting: %s [%s characters]", post["text"], rendered["length"]
+        )
+
+        import tweepy
 
+        # If the post is too long it's sent as a thread, each part replying to
+        # the one before.
+        parts = get_parts(rendered, post["text"])
+        status_id = previous_status_id
+        sent_parts = 0
+
+        for text, _ in parts:
             try:
-                response = self.twitter_api.create_tweet(
-                    text=post["text"], in_reply_to_tweet_id=previous_status_id
+                response = self.pacers["twitter"].call(
+                    self.twitter_api.create_tweet,
+                    text=text,
+                    in_reply_to_tweet_id=status_id,
                 )
-            except tweepy.TweepyException as e:
+            except (tweepy.TweepyException, RateLimitedError) as e:
                 self.logger.error(e)
-            else:
-                # Set these so that we can see if the next tweet is a reply
-                # to this one, and then which ID this one was.
-                self.redis.set("previous_tweet_time", post["time"])
-                self.redis.set("previous_tweet_id", response.data["id"])
+                break
+            status_id = response.data["id"]
+            sent_parts += 1
 
-            time.sleep(2)
+        if sent_parts:
+            # Set these so that we can see if the next tweet is a reply
+            # to this one, and then which ID this one (or its last part) was.
+            self.tweet_state.update(time=post["time"], id=status_id)
+        return sent_parts == len(parts)
 
     def send_toots(self, posts):
         """
@@ -472,34 +1395,55 @@ class Poster:
             return
 
         for post in posts:
-            previous_status_id = None
+            self.measure_send("mastodon", self.send_toot, post)
 
-            if post["in_reply_to_time"] is not None:
-                # This toot is a reply, so check that it's a reply to the
-                # immediately previous toot.
-                # It *should* be, but if something went wrong, maybe not.
-                previous_status_time = self.redis.get("previous_toot_time")
+    def send_toot(self, post):
+        """
+        Toot a single post (a dict, as for send_toots()).
+        Returns True if it was sent, False if not.
+        """
+        previous_status_id = None
 
-                if post["in_reply_to_time"] == previous_status_time:
-                    previous_status_id = self.redis.get("previous_toot_id")
+        if post["in_reply_to_time"] is not None:
+            # This toot is a reply, so check that it's a reply to the
+            # immediately previous toot.
+            # It *should* be, but if something went wrong, maybe not.
+            previous_status_time = self.toot_state.get("time")
 
-            self.logger.info(
-                "Tooting: %s [%s characters]", post["text"], len(post["text"])
-            )
+            if post["in_reply_to_time"] == previous_status_time:
+                previous_status_id = self.toot_state.get("id")
+
+        rendered = self.get_rendered("mastodon", post)
+        self.logger.info(
+            "Tooting: %s [%s characters]", post["text"], rendered["length"]
+        )
+
+        from mastodon import MastodonError
 
+        # If the post is too long it's sent as a thread, each part replying to
+        # the one before.
+        parts = get_parts(rendered, post["text"])
+        status_id = previous_status_id
+        sent_parts = 0
+
+        for text, _ in parts:
             try:
-                status = self.mastodon_api.status_post(
-                    post["text"], in_reply_to_id=previous_status_id
+                status = self.pacers["mastodon"].call(
+                    self.mastodon_api.status_post,
+                    text,
+                    in_reply_to_id=status_id,
                 )
-            except MastodonError as e:
+            except (MastodonError, RateLimitedError) as e:
                 self.logger.error(e)
-            else:
-                # Set these so that we can see if the next toot is a reply
-                # to this one, and then which ID this one was.
-                self.redis.set("previous_toot_time", post["time"])
-                self.redis.set("previous_toot_id", status.id)
+                break
+            status_id = status.id
+            sent_parts += 1
 
-            time.sleep(2)
+        if sent_parts:
+            # Set these so that we can see if the next toot is a reply
+            # to this one, and then which ID this one (or its last part) was.
+            self.toot_state.update(time=post["time"], id=status_id)
+        return sent_parts == len(parts)
 
     def send_skeets(self, posts):
         """
@@ -518,68 +1462,227 @@ class Poster:
             return
 
         if len(posts) > 0:
-            client = Client()
+            from atproto.exceptions import AtProtocolError
+
             try:
-                client.login(self.atproto_handle, self.atproto_password)
-            except UnauthorizedError as e:
+                client = self.get_atproto_client()
+            except (AtProtocolError, RateLimitedError) as e:
                 self.logger.error(e)
+                self.metrics.inc(
+                    "poster_send_errors_total", len(posts), network="bluesky"
+                )
             else:
                 for post in posts:
-                    reply_to = {}
-
-                    if post["in_reply_to_time"] is not None:
-                        # This skeet is a reply, so check that it's a reply to the
-                        # immediately previous skeet.
-                        # It *should* be, but if something went wrong, maybe not.
-                        previous_status_time = self.redis.get("previous_skeet_time")
-
-                        if post["in_reply_to_time"] == previous_status_time:
-                            # The root and parent should be the same if this is the
-                            # first reply. Subsequent replies should have different
-                            # root and parent.
-                            root_uri = self.redis.get("root_skeet_uri")
-                            root_cid = self.redis.get("root_skeet_cid")
-                            parent_uri = self.redis.get("previous_skeet_uri")
-                            parent_cid = self.redis.get("previous_skeet_cid")
-                            reply_to = {
-                                "root": {"uri": root_uri, "cid": root_cid},
-                                "parent": {"uri": parent_uri, "cid": parent_cid},
-                            }
+                    self.measure_send(
+                        "bluesky", lambda post: self.send_skeet(client, post), post
+                    )
 
-                    self.logger.info(
-                        "Skeeting: %s [%s characters]", post["text"], len(post["text"])
+    def send_skeet(self, client, post):
+        """
+        Skeet a single post (a dict, as for send_skeets()) using a logged-in
+        atproto Client.
+        Returns True if it was sent, False if not.
+        """
+        reply_to = {}
+
+        if post["in_reply_to_time"] is not None:
+            # This skeet is a reply, so check that it's a reply to the
+            # immediately previous skeet.
+            # It *should* be, but if something went wrong, maybe not.
+            previous_status_time = self.skeet_state.get("time")
+
+            if post["in_reply_to_time"] == previous_status_time:
+                # The root and parent should be the same if this is the
+                # first reply. Subsequent replies should have different
+                # root and parent.
+                root_uri = self.skeet_state.get("root_uri")
+                root_cid = self.skeet_state.get("root_cid")
+                parent_uri = self.skeet_state.get("uri")
+                parent_cid = self.skeet_state.get("cid")
+                reply_to = {
+                    "root": {"uri": root_uri, "cid": root_cid},
+                    "parent": {"uri": parent_uri, "cid": parent_cid},
+                }
+
+        rendered = self.get_rendered("bluesky", post)
+        self.logger.info(
+            "Skeeting: %s [%s characters]", post["text"], rendered["length"]
+        )
+
+        from atproto.exceptions import (
+            AtProtocolError,
+            BadRequestError,
+            InvokeTimeoutError,
+            UnauthorizedError,
+        )
+
+        # If the post is too long it's sent as a thread, each part replying to
+        # the one before.
+        parts = get_parts(rendered, post["text"])
+        fields = {}
+        sent_parts = 0
+
+        for text, facets in parts:
+            kwargs = {"text": text}
+            if reply_to:
+                kwargs["reply_to"] = reply_to
+            if facets:
+                kwargs["facets"] = facets
+
+            try:
+                status = self.pacers["bluesky"].call(client.send_post, **kwargs)
+            except (AtProtocolError, InvokeTimeoutError, RateLimitedError) as e:
+                self.logger.error(e)
+
+                if isinstance(e, (UnauthorizedError, BadRequestError)):
+                    # The session might have expired beyond refreshing
+                    # (which is a 400 ExpiredToken error), so get a new
+                    # client next time.
+                    self.atproto_client = None
+                break
+
+            # Set these so that we can see if the next skeet is a reply
+            # to this one, and then which ID and URL this one was.
+            fields.update(time=post["time"], uri=status["uri"], cid=status["cid"])
+
+            if not reply_to:
+                # It wasn't a reply, so save its details as 'root' in case
+                # the next skeet(s), or parts, reply to it or its descendants.
+                fields["root_uri"] = status["uri"]
+                fields["root_cid"] = status["cid"]
+
+            root = reply_to.get("root") or {
+                "uri": status["uri"],
+                "cid": status["cid"],
+            }
+            reply_to = {
+                "root": root,
+                "parent": {"uri": status["uri"], "cid": status["cid"]},
+            }
+            sent_parts += 1
+
+        if fields:
+            self.skeet_state.update(**fields)
+        return sent_parts == len(parts)
+
+    def get_atproto_client(self):
+        """
+        Returns a logged-in atproto Client.
+
+        Logging in with a password creates a new session, and Bluesky strictly
+        limits how often that can happen. So the session is saved in Redis
+        (in skeet_state) and reused by later runs, and other processes, until
+        it can no longer be refreshed. Then only one process at a time logs
+        in with the password, while the others wait and use its new session.
+        """
+        if self.atproto_client is not None:
+            return self.atproto_client
+
+        client = self.make_atproto_client()
+        client.on_session_change(self.save_atproto_session)
+
+        session_string = self.skeet_state.get("session")
+
+        if not self.login_with_atproto_session(client, session_string):
+            with self.redis.lock(
+                self.redis_key("skeet_login_lock"), timeout=60, blocking_timeout=60
+            ):
+                # Another process might have logged in while we waited.
+                self.skeet_state.load()
+                new_session_string = self.skeet_state.get("session")
+
+                if new_session_string == session_string or (
+                    not self.login_with_atproto_session(client, new_session_string)
+                ):
+                    self.logger.info("Logging in to Bluesky as %s", self.atproto_handle)
+                    self.pacers["bluesky"].call(
+                        client.login, self.atproto_handle, self.atproto_password
                     )
 
-                    try:
-                        if len(reply_to.keys()) > 0:
-                            status = client.send_post(
-                                text=post["text"], reply_to=reply_to
-                            )
-                        else:
-                            status = client.send_post(text=post["text"])
-                    except (AtProtocolError, InvokeTimeoutError) as e:
-                        self.logger.error(e)
-                    else:
-                        # Set these so that we can see if the next skeet is a reply
-                        # to this one, and then which ID and URL this one was.
-                        self.redis.set("previous_skeet_time", post["time"])
-                        self.redis.set("previous_skeet_uri", status["uri"])
-                        self.redis.set("previous_skeet_cid", status["cid"])
-
-                        if post["in_reply_to_time"] is None:
-                            # It wasn't a reply, so save its details as 'root' in case
-                            # the next skeet(s) reply to it or its descendants.
-                            self.redis.set("root_skeet_uri", status["uri"])
-                            self.redis.set("root_skeet_cid", status["cid"])
-
-            time.sleep(2)
+        self.atproto_client = client
+        return client
+
+    def login_with_atproto_session(self, client, session_string):
+        """
+        Try to log in the client using a saved session string, which will be
+        refreshed if it's expired. Returns True if that worked.
+        """
+        if not session_string:
+            return False
+
+        from atproto.exceptions import AtProtocolError
+
+        try:
+            client.login(session_string=session_string)
+        except AtProtocolError as e:
+            self.logger.info("Couldn't reuse saved Bluesky session: %s", e)
+            return False
+
+        return True
+
+    def save_atproto_session(self, event, session):
+        """
+        Called by the atproto Client whenever its session changes, so that we
+        can save new and refreshed sessions for reuse.
+        """
+        from atproto import SessionEvent
+
+        if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+            self.skeet_state.update(session=session.export())
+
+    def make_atproto_client(self):
+        "Returns a new, not logged-in, atproto Client."
+        from atproto import Client, Request
+
+        # So that the pacer sees the rate limit headers of every response.
+        kwargs = {}
+        if self.shared is not None:
+            kwargs["transport"] = self.shared.httpx_transport
+        request = Request(
+            event_hooks={"response": [self.pacers["bluesky"].response_hook]},
+            **kwargs,
+        )
+        return Client(base_url=self.atproto_base_url, request=request)
+
+
+def get_index_dir(posts_dir):
+    """
+    Returns the directory to keep the post index for posts_dir in. Next to
+    it, and called .post_index, or eg .post_index-diary2 for a posts_dir
+    called diary2.
+    """
+    parent, name = os.path.split(os.path.normpath(posts_dir))
+    if name == "posts":
+        return os.path.join(parent, ".post_index")
+    return os.path.join(parent, f".post_index-{name}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Send any posts that are due.")
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile this run, writing the results to DIR (see profiling.py)",
+    )
+    args = parser.parse_args()
+
     poster = Poster()
 
+    if args.profile:
+        poster.profile_dir = args.profile
+        poster.profile_rate = 1.0
+        poster.profiler = poster.make_profiler()
+
     poster.start()
 
+    # Let another process run straight away, rather than when the lease ends.
+    if poster.run_lease is not None:
+        poster.run_lease.release()
+
+    # We won't be around to be asked for our metrics, so save them.
+    if poster.push_metrics:
+        poster.metrics.push(poster.redis, poster.redis_key(METRICS_KEY))
+
 
 if __name__ == "__main__":
     main()
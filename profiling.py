@@ -0,0 +1,230 @@
+"""
+Profiles runs of Poster.start() (or tester.py) with cProfile and, optionally,
+tracemalloc, and writes what it finds to a directory. For each profiled run:
+
+    poster-20250101-120030-3f2a9c1b7d4e.prof - cProfile's stats, to load with
+        pstats, or a viewer like snakeviz.
+    poster-20250101-120030-3f2a9c1b7d4e.txt - A summary: the time taken, and
+        memory allocated, by each group of functions we care about (eg,
+        parsing posts, Redis, sending to each network), then the functions
+        that took the most time, and the lines that allocated the most memory.
+
+Profiling makes a run slower, especially with tracemalloc, so `rate` can be
+set to only profile some runs, eg 0.01 for one in a hundred, which can be
+left on all the time. Python 3.13's cProfile sees every thread, so time spent
+in other threads (like each network's sending) is included.
+
+Only one profile can run at once in a process, so if several Posters (see
+accounts.py) run at the same time, only one of them is profiled.
+"""
+
+import cProfile
+import datetime
+import inspect
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# How many frames of each allocation's traceback to keep, so allocations can
+# be put in the group of a function that called the one that allocated:
+TRACEBACK_FRAMES = 10
+
+# Only one cProfile can be enabled at a time in a process:
+_running = threading.Lock()
+
+
+class Profiler:
+    """
+    directory - Where to write the profiles.
+    name - What to start each file's name with, eg "poster".
+    groups - Dict of a label -> list of the functions, or directories of
+        packages (eg, Redis's), whose time and memory to add up under it.
+    rate - The fraction of runs to profile, from 0 to 1.
+    top - How many functions and lines to list in each summary.
+    memory - Trace memory allocations too?
+    """
+
+    def __init__(self, directory, name, groups=None, *, rate=1.0, top=20, memory=True):
+        self.directory = directory
+        self.name = name
+        self.groups = groups or {}
+        self.rate = rate
+        self.top = top
+        self.memory = memory
+
+    @contextmanager
+    def profile(self, run_id=None):
+        """
+        Profile the code in the with block, if this run is one of the `rate`
+        that are sampled, and write its files, named with run_id.
+        """
+        if random.random() >= self.rate or not _running.acquire(blocking=False):
+            yield
+            return
+
+        try:
+            started_tracing = False
+            if self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEBACK_FRAMES)
+                started_tracing = True
+            if self.memory:
+                tracemalloc.reset_peak()
+
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                seconds = time.perf_counter() - start
+                snapshot = peak = None
+                if self.memory:
+                    snapshot = tracemalloc.take_snapshot()
+                    peak = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+
+            self.write(profile, snapshot, peak, seconds, run_id)
+        finally:
+            _running.release()
+
+    def write(self, profile, snapshot, peak, seconds, run_id=None):
+        "Write the .prof and .txt files for one profiled run."
+        now = datetime.datetime.now(datetime.UTC)
+        filename = f"{self.name}-{now:%Y%m%d-%H%M%S}"
+        if run_id:
+            filename += f"-{run_id}"
+        path = os.path.join(self.directory, filename)
+
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(f"{path}.prof")
+        with open(f"{path}.txt", "w") as file:
+            file.write(self.summarize(profile, snapshot, peak, seconds, run_id))
+
+    def summarize(self, profile, snapshot, peak, seconds, run_id=None):
+        """
+        Returns the text of the summary of one profiled run.
+        snapshot - A tracemalloc Snapshot from the end of the run, or None.
+        peak - The most memory traced at once during the run, or None.
+        """
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+
+        out.write(f"Profile of {self.name} run {run_id or ''}\n")
+        out.write(f"{seconds:.3f} seconds")
+        if snapshot is not None:
+            allocated = sum(stat.size for stat in snapshot.statistics("filename"))
+            out.write(
+                f", {allocated / 1024:,.1f} KB allocated and not yet freed, "
+                f"{peak / 1024:,.1f} KB at most"
+            )
+        out.write("\n\n")
+
+        if self.groups:
+            out.write(
+                f"{'group':<24} {'calls':>8} {'seconds':>10} {'%':>7} "
+                f"{'KB allocated':>13}\n"
+            )
+            groups = {
+                label: [get_matcher(target) for target in targets]
+                for label, targets in self.groups.items()
+            }
+            memory = get_group_memory(snapshot, groups)
+            for label, matchers in groups.items():
+                calls, group_seconds = get_group_time(stats, matchers)
+                kb = memory[label] / 1024
+                share = group_seconds / seconds if seconds else 0
+                out.write(
+                    f"{label:<24} {calls:>8} {group_seconds:>10.4f} {share:>7.1%} "
+                    f"{kb:>13,.1f}\n"
+                )
+            out.write("\n")
+
+        out.write("Functions that took the most time, including what they called:\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        out.write("Functions that took the most time themselves:\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+
+        if snapshot is not None:
+            out.write("Lines that allocated the most memory that's not yet freed:\n")
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                out.write(f" {stat}\n")
+
+        return out.getvalue()
+
+
+def get_matcher(target):
+    """
+    Returns a function that's given a filename and line number, and returns
+    whether they're in `target`: a function, or a package's directory.
+    """
+    if isinstance(target, str):
+        directory = os.path.join(target, "")
+        return lambda filename, lineno: filename.startswith(directory)
+
+    code = inspect.unwrap(target).__code__
+    lines = [line for _, _, line in code.co_lines() if line is not None]
+    first, last = min(lines, default=0), max(lines, default=0)
+    first = min(first, code.co_firstlineno)
+    return lambda filename, lineno: (
+        filename == code.co_filename and first <= lineno <= last
+    )
+
+
+def in_group(matchers, key):
+    "Is the function with pstats key (filename, lineno, name) in the group?"
+    filename, lineno, _ = key
+    return any(matcher(filename, lineno) for matcher in matchers)
+
+
+def get_group_time(stats, matchers):
+    """
+    Returns (calls, seconds) of the functions in a group, leaving out those
+    only called by others in the group, so nothing's counted twice.
+    """
+    calls = 0
+    seconds = 0.0
+    for key, (_, total_calls, _, total_seconds, callers) in stats.stats.items():
+        if not in_group(matchers, key):
+            continue
+        if callers and all(in_group(matchers, caller) for caller in callers):
+            continue
+        calls += total_calls
+        seconds += total_seconds
+    return calls, seconds
+
+
+def get_group_memory(snapshot, groups):
+    """
+    Returns a dict of each group's label -> the bytes allocated, and not
+    freed, in or below its code. groups is a dict of label -> matchers.
+    """
+    totals = dict.fromkeys(groups, 0)
+    if snapshot is None:
+        return totals
+
+    # (filename, line number) -> labels of the groups it's in:
+    frame_groups = {}
+
+    for trace in snapshot.traces:
+        labels = set()
+        for frame in trace.traceback:
+            key = (frame.filename, frame.lineno)
+            if key not in frame_groups:
+                frame_groups[key] = [
+                    label
+                    for label, matchers in groups.items()
+                    if any(matcher(*key) for matcher in matchers)
+                ]
+            labels.update(frame_groups[key])
+
+        for label in labels:
+            totals[label] += trace.size
+
+    return totals
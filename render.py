@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""
+Works out what each post will look like on each network: how long it is by
+that network's rules, whether it has to be split into a thread of several
+posts to fit, and, for Bluesky, the facets that make its links clickable.
+
+    twitter  - 280, counting most characters outside Latin scripts (eg CJK
+               and emoji) as 2, and every link as 23.
+    mastodon - 500 by default, but it depends on the server, so it's the
+               MastodonMaxCharacters / MASTODON_MAX_CHARACTERS setting.
+               Every link counts as 23, and "@user@server" as "@user".
+    bluesky  - 300 graphemes (what a reader sees as one character).
+
+Each year's renders are kept next to its post index (see post_index.py), as
+eg .post_index/1660.render-3f2a9c1b.json, where "3f2a9c1b" is a hash of the
+limits, so accounts with different limits that share a PostsDir each have
+their own. They're rebuilt whenever the year's index is. So when sending, a
+post's render is only looked up. To build them all in advance:
+
+    $ ./render.py
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import unicodedata
+from glob import glob
+
+from post_index import write_file
+
+logger = logging.getLogger(__name__)
+
+RENDER_VERSION = 1
+
+# The most each network allows in one post, measured as in get_length():
+LIMITS = {"twitter": 280, "mastodon": 500, "bluesky": 300}
+
+# How long every link counts as, however long it is:
+TWITTER_URL_LENGTH = 23
+MASTODON_URL_LENGTH = 23
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"]*[^\s<>\".,;:!?)\]']")
+
+# "@user@server.social", which Mastodon counts as only "@user":
+MASTODON_MENTION_PATTERN = re.compile(r"(@\w+)@[\w.-]+\w")
+
+# Code points that Twitter counts as 1, rather than 2:
+TWITTER_LIGHT_RANGES = ((0, 4351), (8192, 8205), (8208, 8223), (8242, 8247))
+
+# Any one character that Twitter counts as 2:
+TWITTER_HEAVY_PATTERN = re.compile(
+    "[^"
+    + "".join(f"{chr(start)}-{chr(end)}" for start, end in TWITTER_LIGHT_RANGES)
+    + "]"
+)
+
+# Text made only of these characters (Latin, and punctuation like curly
+# quotes and dashes) has no characters that join the one before, so its
+# graphemes are its characters:
+SIMPLE_GRAPHEMES_PATTERN = re.compile("[\u0000-\u02ff\u2010-\u2027\u2030-\u205e]*")
+
+# Where to split a post that's too long, best first: after the end of a
+# sentence, after other punctuation, or at any space.
+SPLIT_PATTERNS = (
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"(?<=[,;:])\s+"),
+    re.compile(r"\s+"),
+)
+
+
+def twitter_length(text):
+    "Returns the length of text, weighted as Twitter counts it."
+    length = 0
+    for url in URL_PATTERN.findall(text):
+        length += TWITTER_URL_LENGTH
+        text = text.replace(url, "", 1)
+
+    if text.isascii():
+        return length + len(text)
+    return length + len(text) + len(TWITTER_HEAVY_PATTERN.findall(text))
+
+
+def mastodon_length(text):
+    "Returns the length of text as Mastodon counts it."
+    text = MASTODON_MENTION_PATTERN.sub(r"\1", text)
+    text = URL_PATTERN.sub("x" * MASTODON_URL_LENGTH, text)
+    return len(text)
+
+
+def count_graphemes(text):
+    """
+    Returns how many graphemes (user-perceived characters) are in text, as
+    Bluesky counts it. This follows the main rules of Unicode's grapheme
+    clusters: combining marks, variation selectors, skin tones, tags, and
+    anything after a zero width joiner belong to the character before, and
+    flags are pairs of regional indicators.
+    """
+    if SIMPLE_GRAPHEMES_PATTERN.fullmatch(text):
+        # Every character is a grapheme (a post is one line, so has no "\r\n").
+        return len(text)
+
+    count = 0
+    joined = False
+    regional_indicators = 0
+
+    for character in text:
+        point = ord(character)
+
+        if joined:
+            joined = False
+            continue
+
+        if point == 0x200D:
+            joined = True
+            continue
+
+        if (
+            unicodedata.combining(character)
+            or unicodedata.category(character) in ("Mn", "Me", "Mc")
+            or 0xFE00 <= point <= 0xFE0F
+            or 0x1F3FB <= point <= 0x1F3FF
+            or 0xE0020 <= point <= 0xE007F
+        ):
+            continue
+
+        if 0x1F1E6 <= point <= 0x1F1FF:
+            regional_indicators += 1
+            if regional_indicators % 2 == 0:
+                continue
+        else:
+            regional_indicators = 0
+
+        count += 1
+
+    return count
+
+
+LENGTHS = {
+    "twitter": twitter_length,
+    "mastodon": mastodon_length,
+    "bluesky": count_graphemes,
+}
+
+
+def get_length(network, text):
+    "Returns the length of text by the rules of `network`, eg 'bluesky'."
+    return LENGTHS[network](text)
+
+
+def get_facets(text):
+    """
+    Returns a list of Bluesky facets that make the links in text clickable,
+    with their positions as byte offsets in its UTF-8.
+    """
+    facets = []
+    for match in URL_PATTERN.finditer(text):
+        start = len(text[: match.start()].encode())
+        facets.append(
+            {
+                "index": {
+                    "byteStart": start,
+                    "byteEnd": start + len(match.group().encode()),
+                },
+                "features": [
+                    {"$type": "app.bsky.richtext.facet#link", "uri": match.group()}
+                ],
+            }
+        )
+    return facets
+
+
+def split_text(network, text, limit):
+    """
+    Returns a list of the parts of text, each no longer than `limit` by
+    `network`'s rules, split after sentences if possible, or else after other
+    punctuation, or at spaces. A better place to split is only used if it
+    leaves the part at least half of `limit` long.
+    """
+    parts = []
+
+    while get_length(network, text) > limit:
+        cut = None
+        for pattern in SPLIT_PATTERNS:
+            last = None
+            for match in pattern.finditer(text):
+                if get_length(network, text[: match.start()]) > limit:
+                    break
+                if match.start():
+                    last = match
+
+            if last is not None:
+                if cut is None or last.start() > cut.start():
+                    cut = last
+                if get_length(network, text[: cut.start()]) * 2 >= limit:
+                    break
+
+        if cut is None:
+            # One very long word. Cut it as late as we can.
+            end = len(text)
+            while end > 1 and get_length(network, text[:end]) > limit:
+                end -= 1
+            parts.append(text[:end])
+            text = text[end:]
+        else:
+            parts.append(text[: cut.start()])
+            text = text[cut.end() :]
+
+    parts.append(text)
+    return parts
+
+
+def render(network, text, limit):
+    """
+    Returns a dict of what `text` will be on `network`:
+
+        length - Its length, by the network's rules.
+        parts - Only if it's longer than `limit`: a list of the texts of the
+            thread of posts it'll be sent as.
+        facets - Only for Bluesky, and only if there are links: a list of the
+            facets for each part (or for the whole text, if it's not split).
+    """
+    rendered = {"length": get_length(network, text)}
+    parts = [text]
+
+    if rendered["length"] > limit:
+        parts = rendered["parts"] = split_text(network, text, limit)
+
+    if network == "bluesky" and URL_PATTERN.search(text):
+        rendered["facets"] = [get_facets(part) for part in parts]
+
+    return rendered
+
+
+def get_parts(rendered, text):
+    """
+    Returns a list of (text, facets) tuples, one for each post `text` is sent
+    as, using `rendered`, as returned by render(). facets is None unless the
+    part has links and is for Bluesky.
+    """
+    parts = rendered.get("parts", [text])
+    facets = rendered.get("facets", [None] * len(parts))
+    return [
+        (part, part_facets or None)
+        for part, part_facets in zip(parts, facets, strict=True)
+    ]
+
+
+class RenderIndex:
+    """
+    Loads, and if need be builds, the renders of every post in each year of
+    a PostIndex, for each network, keeping the ones it's loaded in memory.
+
+    post_index - The PostIndex the posts are in.
+    limits - Dict of network name -> its limit, as for LIMITS.
+    """
+
+    def __init__(self, post_index, limits):
+        self.post_index = post_index
+        self.limits = limits
+        # So renders for different limits are kept in different files:
+        self.limits_hash = hashlib.sha256(
+            json.dumps(limits, sort_keys=True).encode()
+        ).hexdigest()[:8]
+        # year (int) -> (YearIndex it was made from, post time -> network ->
+        # rendered dict):
+        self._years = {}
+        self._lock = threading.Lock()
+
+    def get(self, network, post_time):
+        """
+        Returns the rendered dict of the post at post_time (eg
+        '1660-01-01 12:00') for `network`, or None if there's no such post.
+        """
+        year_index = self.post_index.get_year(int(post_time[:4]))
+        if year_index is None:
+            return None
+
+        posts = self.get_year(year_index)
+        return posts.get(post_time, {}).get(network)
+
+    def get_year(self, year_index):
+        "Returns a dict of post time -> network -> rendered for the year."
+        with self._lock:
+            cached = self._years.get(year_index.year)
+            if cached is not None and cached[0] is year_index:
+                return cached[1]
+
+            posts = self.read(year_index)
+            if posts is None:
+                posts = self.build(year_index)
+                self.write(year_index, posts)
+
+            self._years[year_index.year] = (year_index, posts)
+            return posts
+
+    def build(self, year_index):
+        "Renders every post in year_index for every network."
+        logger.info("Rendering posts for %s", year_index.year)
+        texts = self.post_index.read_texts(year_index)
+        return {
+            year_index.time(i): {
+                network: render(network, text, limit)
+                for network, limit in self.limits.items()
+            }
+            for i, text in enumerate(texts)
+        }
+
+    def read(self, year_index):
+        """
+        Reads a year's renders from disk, or returns None if we can't, or
+        they're out of date.
+        """
+        path = self._render_path(year_index.year)
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.debug("Couldn't read renders %s: %s", path, e)
+            return None
+
+        if data.get("header") != self._get_header(year_index):
+            return None
+        return data["posts"]
+
+    def write(self, year_index, posts):
+        "Saves a year's renders to disk, if we can; see write_file()."
+        data = {"header": self._get_header(year_index), "posts": posts}
+        write_file(
+            self._render_path(year_index.year),
+            lambda file: file.write(json.dumps(data, separators=(",", ":")).encode()),
+            "renders",
+        )
+
+    def _get_header(self, year_index):
+        "What a year's renders were made from, to tell if they're out of date."
+        return {
+            "version": RENDER_VERSION,
+            "limits": self.limits,
+            "sources": {
+                filename: source["sha256"]
+                for filename, source in sorted(year_index.sources.items())
+            },
+        }
+
+    def _render_path(self, year):
+        return os.path.join(
+            self.post_index.index_dir, f"{year}.render-{self.limits_hash}.json"
+        )
+
+
+def main():
+    # Before importing poster, which sets up logging without a level:
+    logging.basicConfig(level=logging.INFO)
+
+    import poster
+
+    p = poster.Poster()
+
+    for year_dir in sorted(glob(os.path.join(p.posts_dir, "[0-9]" * 4))):
+        year_index = p.post_index.get_year(int(os.path.basename(year_dir)))
+        posts = p.renders.get_year(year_index)
+        for network in p.renders.limits:
+            threads = sum(1 for post in posts.values() if "parts" in post[network])
+            logger.info(
+                "%s: %s posts, %s sent to %s as threads",
+                year_index.year,
+                len(posts),
+                threads,
+                network,
+            )
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+The posts that are due around now, kept in Redis, so that any process can find
+the due posts without having the posts/ directory. Only used if UseSchedule /
+USE_SCHEDULE is 1.
+
+Posts are kept in a sorted set, "schedule", whose members are each post's
+JSON, like:
+
+    {"in_reply_to_time": null, "is_reply": false, "text": "...",
+     "time": "1660-01-02 11:20"}
+
+and whose scores are the post's modern time, as a UTC timestamp, worked out
+with the same years_ahead and timezone rules as Poster.modernize_time(). So
+the posts that are due are fetched with a single ZREVRANGEBYSCORE.
+
+The posts for the year before, the year of, and the year after the posts
+that are due now are kept in the set. Which years those are, and what
+they're each made from, are kept in the "schedule:years" hash, eg:
+
+    1660 = {"signature": "<sha256>", "min": 1704067200, "max": 1735689540}
+
+where the signature is a hash of years_ahead, the timezone, and the year's
+post files. Any process that has the posts/ directory updates the schedule
+at the start of each run. A year is only reloaded if its signature has
+changed, and as time, or years_ahead, moves on, the set rolls forward to the
+new years. Each update is one transaction, so it's safe to repeat, and
+processes reading the schedule never see it half-loaded.
+
+To load the schedule now:
+
+    $ ./schedule.py
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Schedule:
+    """
+    redis - A redis.Redis object
+    key - The Redis key of the sorted set. The years are kept in
+        "<key>:years".
+    """
+
+    def __init__(self, redis, key="schedule"):
+        self.redis = redis
+        self.key = key
+        self.years_key = f"{key}:years"
+        # Year -> signature of the years we last loaded, or found were loaded,
+        # so that we only check Redis if something's changed:
+        self.loaded = {}
+
+    def update(self, poster, local_time_now):
+        """
+        Make sure the schedule has the posts for the years either side of, and
+        including, the year of the posts due at local_time_now, using Poster
+        `poster`'s post index and settings. Returns the number of years loaded.
+        """
+        year = local_time_now.year - poster.years_ahead
+
+        # Year -> (YearIndex, signature):
+        wanted = {}
+        for y in (year - 1, year, year + 1):
+            year_index = poster.post_index.get_year(y)
+            if year_index is not None:
+                wanted[y] = (year_index, get_signature(poster, year_index))
+
+        signatures = {y: signature for y, (_, signature) in wanted.items()}
+        if signatures == self.loaded:
+            return 0
+
+        stored = {
+            int(y): json.loads(value)
+            for y, value in self.redis.hgetall(self.years_key).items()
+        }
+        changed = [
+            y
+            for y, signature in signatures.items()
+            if y not in stored or stored[y]["signature"] != signature
+        ]
+
+        pipe = self.redis.pipeline(transaction=True)
+
+        # Remove the posts of years we no longer want, or that have changed:
+        for y, details in stored.items():
+            if y not in wanted or y in changed:
+                pipe.zremrangebyscore(self.key, details["min"], details["max"])
+                pipe.hdel(self.years_key, y)
+
+        for y in changed:
+            year_index, signature = wanted[y]
+            posts = self.get_scored_posts(poster, year_index)
+            if posts:
+                pipe.zadd(self.key, posts)
+            details = {
+                "signature": signature,
+                "min": min(posts.values(), default=0),
+                "max": max(posts.values(), default=-1),
+            }
+            pipe.hset(self.years_key, y, json.dumps(details))
+            logger.info("Loading %s posts from %s into the schedule", len(posts), y)
+
+        pipe.execute()
+
+        self.loaded = signatures
+        return len(changed)
+
+    def get_scored_posts(self, poster, year_index):
+        """
+        Returns a dict of JSON of each post in year_index -> its modern time,
+        as a UTC timestamp. Posts that have no modern time (eg, the 29th of
+        February in a year that doesn't have one) are left out.
+        """
+        texts = poster.post_index.read_texts(year_index)
+        posts = {}
+
+        for i, text in enumerate(texts):
+            post_time = year_index.time(i)
+            local_modern_post_time = poster.modernize_time(post_time)
+
+            if not local_modern_post_time:
+                continue
+
+            post = {
+                "time": post_time,
+                "text": text,
+                "is_reply": year_index.is_reply(i),
+                "in_reply_to_time": poster.get_index_reply_time(year_index, i),
+            }
+            posts[json.dumps(post, sort_keys=True)] = int(
+                local_modern_post_time.timestamp()
+            )
+
+        return posts
+
+    def get_posts(self, start, end, *, include_start=False):
+        """
+        Returns a list of dicts of the posts timed after `start` (or at it,
+        if include_start is True) and no later than `end`, both
+        timezone-aware datetimes. Most recent first.
+        """
+        start = start.timestamp()
+        return [
+            json.loads(post)
+            for post in self.redis.zrevrangebyscore(
+                self.key, end.timestamp(), start if include_start else f"({start}"
+            )
+        ]
+
+
+def get_signature(poster, year_index):
+    """
+    Returns a hash of everything the schedule of year_index's posts depends
+    on: years_ahead, the timezone, and the contents of the post files.
+    """
+    parts = [str(poster.years_ahead), str(poster.local_tz)]
+    parts.extend(
+        f"{filename} {source['sha256']}"
+        for filename, source in sorted(year_index.sources.items())
+    )
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def main():
+    # Before importing poster, which sets up logging without a level:
+    logging.basicConfig(level=logging.INFO)
+
+    import poster
+
+    p = poster.Poster()
+    p.schedule.update(p, datetime.datetime.now(p.local_tz))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# ruff: noqa: T201
+"""
+Replays every minute of a year (or --days of it) through Poster, as fast as
+it can, to check that every post is sent once, on time, and threaded as a
+reply when it should be, across month and year boundaries.
+
+Poster's clock (Poster.now()) is replaced with a virtual one, that moves on a
+minute at each tick, Redis with fakes.FakeRedis, and the networks with the
+fake clients in fakes.py. So nothing leaves this machine, and a year of
+525,600 ticks takes minutes.
+
+With --skip-rate some ticks don't happen, as if the process was down, so we
+can see how max_time_window (and, with --catch-up, the backlog) behave.
+
+At the end it reports, for each network, how many posts were missed, sent
+more than once, sent late, or weren't threaded as replies, and how much CPU
+time each tick took.
+
+    $ ./simulate.py --year 2025 --years-ahead 365
+    $ ./simulate.py --days 31 --month-file --skip-rate 0.01
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import logging
+import random
+import statistics
+import time
+from zoneinfo import ZoneInfo
+
+import benchmark
+
+NETWORKS = ("twitter", "mastodon", "bluesky")
+
+
+class VirtualClock:
+    "A clock that only moves when we move it."
+
+    def __init__(self, time_now):
+        # A timezone-aware datetime:
+        self.time = time_now
+
+    def now(self, tz=datetime.UTC):
+        return self.time.astimezone(tz)
+
+
+class Recorder:
+    """
+    Records every post Poster sends to each network, when (by the virtual
+    clock) it was sent, and whether it was sent as a reply to the post it
+    should reply to.
+    """
+
+    def __init__(self, poster, clock):
+        self.poster = poster
+        self.clock = clock
+        # network -> post time -> list of virtual times it was sent at:
+        self.sent = {network: collections.defaultdict(list) for network in NETWORKS}
+        # network -> the ID (or URI) each post time was given:
+        self.ids = {network: {} for network in NETWORKS}
+        # network -> post time -> the ID (or URI) it was sent in reply to:
+        self.replied_to = {network: {} for network in NETWORKS}
+
+        self.measure_send = poster.measure_send
+        poster.measure_send = self.record
+
+    def record(self, network, send, post):
+        p = self.poster
+        client = {
+            "twitter": p.twitter_api,
+            "mastodon": p.mastodon_api,
+            "bluesky": p.atproto_client,
+        }[network]
+        # Where this post's first part will be, if it's sent as a thread:
+        first = len(client.posts) if client is not None else 0
+
+        sent = self.measure_send(network, send, post)
+        client = client or p.atproto_client
+        if not sent or len(client.posts) == first:
+            # It failed, or the ledger says it's already been sent.
+            return sent
+
+        self.sent[network][post["time"]].append(self.clock.time)
+        reply_to = client.posts[first][1]
+
+        if network == "twitter":
+            self.ids[network][post["time"]] = p.tweet_state.get("id")
+        elif network == "mastodon":
+            self.ids[network][post["time"]] = p.toot_state.get("id")
+        else:
+            self.ids[network][post["time"]] = p.skeet_state.get("uri")
+            reply_to = reply_to["parent"]["uri"] if reply_to else None
+
+        if reply_to is not None:
+            self.replied_to[network][post["time"]] = str(reply_to)
+        return sent
+
+
+def make_sim_poster(args, clock):
+    "A Poster with a virtual clock, fake Redis, fake clients and no pacing."
+    p = benchmark.make_burst_poster(latency=0)
+    p.logger.setLevel(logging.WARNING)
+
+    p.now = clock.now
+    p.years_ahead = args.years_ahead
+    p.timezone = args.timezone
+    p.local_tz = ZoneInfo(args.timezone)
+    p.max_time_window = args.max_time_window
+    p.use_post_index = not args.month_file
+    p.use_outbox = False
+    p.catch_up = args.catch_up
+    p.catch_up_rate = args.catch_up_rate
+
+    benchmark.make_unpaced(p)
+    return p
+
+
+def get_expected_posts(p, start, end):
+    """
+    Returns a dict of the time of every post that should be sent from `start`
+    until (but not including) `end` -> (its modern time, the time of the post
+    it should reply to, or None).
+    """
+    expected = {}
+
+    for year in range(start.year - p.years_ahead, end.year - p.years_ahead + 1):
+        year_index = p.post_index.get_year(year)
+        if year_index is None:
+            continue
+
+        for i in range(len(year_index)):
+            modern_time = p.modernize_time(year_index.time(i))
+            if modern_time and start <= modern_time < end:
+                expected[year_index.time(i)] = (
+                    modern_time,
+                    p.get_index_reply_time(year_index, i),
+                )
+
+    return expected
+
+
+def simulate(args):
+    "Runs the simulation and returns a dict of its results."
+    tz = ZoneInfo(args.timezone)
+    start = datetime.datetime(args.year, 1, 1, tzinfo=tz).astimezone(datetime.UTC)
+    if args.days:
+        end = start + datetime.timedelta(days=args.days)
+    else:
+        end = datetime.datetime(args.year + 1, 1, 1, tzinfo=tz).astimezone(datetime.UTC)
+    # The seconds past each minute that we run at:
+    offset = datetime.timedelta(seconds=args.offset)
+
+    clock = VirtualClock(start)
+    p = make_sim_poster(args, clock)
+    recorder = Recorder(p, clock)
+    rng = random.Random(args.seed)
+
+    p.redis.set(
+        p.redis_key("last_run_time"),
+        (start - datetime.timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+    tick_seconds = []
+    skipped = 0
+    minute = datetime.timedelta(minutes=1)
+    real_start = time.perf_counter()
+
+    clock.time = start + offset
+    while clock.time < end + offset:
+        if rng.random() < args.skip_rate:
+            skipped += 1
+        else:
+            cpu_start = time.process_time()
+            p.start()
+            tick_seconds.append(time.process_time() - cpu_start)
+        clock.time += minute
+
+    real_seconds = time.perf_counter() - real_start
+
+    expected = get_expected_posts(p, start, end)
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "ticks": len(tick_seconds),
+        "skipped_ticks": skipped,
+        "expected_posts": len(expected),
+        "real_seconds": real_seconds,
+        "tick_cpu_seconds": summarize(tick_seconds),
+        "networks": {
+            network: check_network(recorder, network, expected, args.late_after)
+            for network in NETWORKS
+        },
+    }
+
+
+def check_network(recorder, network, expected, late_after):
+    "Returns a dict of what went wrong with the posts sent to `network`."
+    sent = recorder.sent[network]
+    ids = recorder.ids[network]
+    replied_to = recorder.replied_to[network]
+
+    lateness = []
+    late = []
+    unthreaded = []
+
+    for post_time, (modern_time, in_reply_to_time) in expected.items():
+        if post_time not in sent:
+            continue
+
+        seconds = (sent[post_time][0] - modern_time).total_seconds()
+        lateness.append(seconds)
+        if seconds > late_after:
+            late.append(post_time)
+
+        # A reply should be threaded if the post it replies to was sent.
+        if in_reply_to_time in ids and replied_to.get(post_time) != str(
+            ids[in_reply_to_time]
+        ):
+            unthreaded.append(post_time)
+
+    return {
+        "sent": len(sent),
+        "missed": sorted(set(expected) - set(sent)),
+        "duplicated": sorted(t for t, times in sent.items() if len(times) > 1),
+        "unexpected": sorted(set(sent) - set(expected)),
+        "late": sorted(late),
+        "unthreaded_replies": sorted(unthreaded),
+        "lateness_seconds": summarize(lateness),
+    }
+
+
+def summarize(values):
+    "Returns a dict of the mean, median, 99th percentile and max of values."
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        "mean": statistics.fmean(values),
+        "p50": values[len(values) // 2],
+        "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+        "max": values[-1],
+    }
+
+
+def print_results(results, examples):
+    cpu = results["tick_cpu_seconds"]
+    print(f"Simulated {results['start']} to {results['end']}")
+    print(
+        f"{results['ticks']} ticks ({results['skipped_ticks']} skipped) in "
+        f"{results['real_seconds']:.1f} seconds, "
+        f"{results['ticks'] / results['real_seconds']:.0f} ticks per second"
+    )
+    if cpu:
+        print(
+            f"CPU per tick: mean {cpu['mean'] * 1000:.3f} ms, "
+            f"p50 {cpu['p50'] * 1000:.3f} ms, p99 {cpu['p99'] * 1000:.3f} ms, "
+            f"max {cpu['max'] * 1000:.3f} ms"
+        )
+    print(f"{results['expected_posts']} posts were due\n")
+
+    print(
+        f"{'network':<10} {'sent':>7} {'missed':>7} {'dupes':>7} {'late':>7} "
+        f"{'unthreaded':>11} {'mean late s':>12} {'max late s':>11}"
+    )
+    for network, n in results["networks"].items():
+        lateness = n["lateness_seconds"]
+        print(
+            f"{network:<10} {n['sent']:>7} {len(n['missed']):>7} "
+            f"{len(n['duplicated']):>7} {len(n['late']):>7} "
+            f"{len(n['unthreaded_replies']):>11} "
+            f"{lateness.get('mean', 0):>12.1f} {lateness.get('max', 0):>11.1f}"
+        )
+
+    for network, n in results["networks"].items():
+        for problem in ("missed", "duplicated", "unexpected", "late"):
+            if n[problem][:examples]:
+                print(f"\n{network} {problem}: {', '.join(n[problem][:examples])}")
+        if n["unthreaded_replies"][:examples]:
+            print(
+                f"\n{network} unthreaded replies: "
+                f"{', '.join(n['unthreaded_replies'][:examples])}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    now = datetime.datetime.now(datetime.UTC)
+    parser.add_argument(
+        "--year", type=int, default=now.year, help="The modern year to simulate"
+    )
+    parser.add_argument(
+        "--days", type=int, default=0, help="Only simulate this many days of it"
+    )
+    parser.add_argument(
+        "--years-ahead",
+        type=int,
+        default=now.year - 1660,
+        help="YearsAhead (default: this year's posts from the 1660s)",
+    )
+    parser.add_argument("--timezone", default="Europe/London", help="Timezone")
+    parser.add_argument(
+        "--max-time-window", type=int, default=20, help="MaxTimeWindow (20)"
+    )
+    parser.add_argument(
+        "--month-file",
+        action="store_true",
+        help="Parse the month's file rather than use the post index",
+    )
+    parser.add_argument("--catch-up", action="store_true", help="CatchUp")
+    parser.add_argument(
+        "--catch-up-rate", type=float, default=1.0, help="CatchUpRate (1)"
+    )
+    parser.add_argument(
+        "--offset",
+        type=float,
+        default=30,
+        help="Seconds past each minute that runs happen at (30)",
+    )
+    parser.add_argument(
+        "--skip-rate",
+        type=float,
+        default=0,
+        help="Fraction of ticks that don't run, as if we were down (0)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="For --skip-rate")
+    parser.add_argument(
+        "--late-after",
+        type=float,
+        default=60,
+        help="Count posts sent more than this many seconds late (60)",
+    )
+    parser.add_argument(
+        "--examples", type=int, default=5, help="Post times to list per problem"
+    )
+    parser.add_argument("--json", help="Write the full results to this file")
+    args = parser.parse_args()
+
+    results = simulate(args)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    print_results(results, args.examples)
+
+
+if __name__ == "__main__":
+    main()
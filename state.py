@@ -0,0 +1,80 @@
+"""
+Keeps each network's threading state (the time and ID of the last post we
+sent, etc) in a single Redis hash, eg:
+
+    tweet_state = {"time": "1666-02-09 14:08", "id": "1234567890"}
+
+The hash is read once per run (see Poster.load_state()) and kept in memory.
+Each update is written to memory and, in one MULTI/EXEC transaction, to
+Redis, so a post's state is never half-saved.
+"""
+
+
+class NetworkState:
+    """
+    redis - A redis.Redis object
+    name - eg "tweet", which means the Redis key will be "tweet_state"
+    legacy_keys - dict of field name -> the separate Redis key that field
+        used to be stored in, so that existing state is still used until
+        this hash has been written. The first write copies all of them into
+        the hash, so fields it doesn't change (eg a thread's root) are kept.
+    """
+
+    def __init__(self, redis, name, legacy_keys=None):
+        self.redis = redis
+        self.name = name
+        self.key = f"{name}_state"
+        self.legacy_keys = legacy_keys or {}
+        # Will be a dict of the hash's fields once loaded:
+        self.data = None
+        # Whether self.data came from the legacy keys, not yet written to the hash:
+        self.from_legacy = False
+
+    def queue_load(self, pipe):
+        """
+        Add the commands needed to load this state to a Redis pipeline.
+        Pass the two results to loaded() once it's been executed.
+        """
+        pipe.hgetall(self.key)
+        if self.legacy_keys:
+            pipe.mget(list(self.legacy_keys.values()))
+
+    def loaded(self, data, legacy_values=None):
+        "Use the results of the commands added by queue_load()."
+        self.from_legacy = False
+        if not data and legacy_values:
+            data = {
+                field: value
+                for field, value in zip(self.legacy_keys, legacy_values, strict=True)
+                if value is not None
+            }
+            self.from_legacy = bool(data)
+        self.data = data
+
+    def load(self):
+        "Load this state from Redis on its own."
+        pipe = self.redis.pipeline(transaction=False)
+        self.queue_load(pipe)
+        self.loaded(*pipe.execute())
+
+    def get(self, field):
+        if self.data is None:
+            self.load()
+        return self.data.get(field)
+
+    def update(self, **fields):
+        "Set one or more fields, in memory and, atomically, in Redis."
+        fields = {field: str(value) for field, value in fields.items()}
+
+        if self.data is None:
+            self.load()
+
+        if self.from_legacy:
+            fields = {**self.data, **fields}
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self.key, mapping=fields)
+        pipe.execute()
+
+        self.data.update(fields)
+        self.from_legacy = False
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Generates synthetic month files of posts, in the same format as those in
+posts/, for benchmarking with more (or fewer) posts than the real ones.
+
+Posts are spread evenly across the month, newest first. If there are more
+posts than minutes in the month, several posts share each minute. About one
+in ten is a reply.
+
+    $ ./synthetic_posts.py /tmp/corpus --lines 1000000
+    $ ./synthetic_posts.py /tmp/corpus --lines 500 --year 1661 --month 2
+
+would write /tmp/corpus/posts/1660/01.txt and /tmp/corpus/posts/1661/02.txt.
+"""
+
+import argparse
+import calendar
+import os
+import random
+
+TEXT = (
+    "and to the office where I did find my Lord Sir William Pen Mr. Creed "
+    "dined at home with my wife upon a good piece of beef then abroad by "
+    "water to Whitehall and so home to supper and to bed"
+)
+WORDS = TEXT.split(" ")
+
+
+def generate_month(year, month, lines, seed=1):
+    "Yields the lines of a synthetic month file, newest post first."
+    rng = random.Random(seed)
+    minutes = calendar.monthrange(year, month)[1] * 24 * 60
+
+    for n in range(lines):
+        minute_of_month = minutes - 1 - (n * minutes // lines)
+        day, minute_of_day = divmod(minute_of_month, 24 * 60)
+        hour, minute = divmod(minute_of_day, 60)
+
+        kind = "r" if rng.random() < 0.1 else " "
+        words = rng.choices(WORDS, k=rng.randint(5, 45))
+        text = " ".join(words)
+
+        yield (
+            f"{year:04d}-{month:02d}-{day + 1:02d} {hour:02d}:{minute:02d} "
+            f"{kind} {text[0].upper()}{text[1:]}.\n\n"
+        )
+
+
+def write_month(root, year, month, lines, seed=1):
+    """
+    Writes a synthetic month file to root/posts/YYYY/MM.txt.
+    Returns its path.
+    """
+    year_dir = os.path.join(root, "posts", f"{year:04d}")
+    os.makedirs(year_dir, exist_ok=True)
+    path = os.path.join(year_dir, f"{month:02d}.txt")
+
+    with open(path, "w") as file:
+        file.writelines(generate_month(year, month, lines, seed))
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("root", help="Directory to create posts/ in")
+    parser.add_argument(
+        "--lines", type=int, default=1000, help="How many posts to write (1000)"
+    )
+    parser.add_argument("--year", type=int, default=1660, help="(1660)")
+    parser.add_argument("--month", type=int, default=1, help="(1)")
+    parser.add_argument("--seed", type=int, default=1, help="(1)")
+    args = parser.parse_args()
+
+    write_month(args.root, args.year, args.month, args.lines, args.seed)
+
+
+if __name__ == "__main__":
+    main()
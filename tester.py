@@ -1,39 +1,111 @@
 #!/usr/bin/env python
 # ruff: noqa: T201
-import datetime
+"""
+Checks the formatting of all the posts files. See the Tester class.
+
+Files are checked in parallel, one per process. A file that had no errors
+last time, and hasn't changed since, isn't checked again; that's remembered
+in .tester_cache.json.
+
+    $ ./tester.py
+    $ ./tester.py --all        # Check every file, ignoring the cache
+    $ ./tester.py --jobs 4     # Use at most 4 processes
+    $ ./tester.py --watch      # Check each file again whenever it's saved
+    $ ./tester.py --rules order,twitter-length   # Only run some of the checks
+    $ ./tester.py --list-rules
+    $ ./tester.py --all --profile profiles  # Profile it; see profiling.py
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
 import os
-import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from glob import glob
 
+from post_index import file_hash, is_file_unchanged
+from post_parser import parse_posts
+from profiling import Profiler
+from tester_rules import RULES, RuleSet
+
+# Files whose code affects the results; if they change, the cache is ignored.
+CODE_FILES = ("tester.py", "tester_rules.py", "post_parser.py", "render.py")
+
 
 class Tester:
     """
-    Test all the text files to ensure:
+    Test all the text files to ensure, for example:
         * Posts are all in order - within each file the most recent should
           be first.
-        * All posts are <= 280 characters in length.
+        * All posts fit in one post on each network (eg, 280 characters,
+          as Twitter counts them).
         * All posts start with something that's not a lowercase character.
         * All posts end with something that's not a lowercase character.
 
-    Outputs a report listing all errors.
+    The checks are the rules in tester_rules.py.
+
+    Outputs a report listing all errors, and how long each rule took.
+
+    jobs - Most processes to use; defaults to the number of CPUs.
+    use_cache - Skip files that had no errors last time and haven't changed.
+    rules - List of the names of the rules to run; defaults to all of them.
     """
 
-    def __init__(self):
+    def __init__(self, jobs=None, *, use_cache=True, rules=None):
         self.project_root = os.path.abspath(os.path.dirname(__file__))
+        self.cache_path = os.path.join(self.project_root, ".tester_cache.json")
+
+        self.jobs = jobs
+        self.use_cache = use_cache
+        self.rules = rules
+        # Raises ValueError if any of the rules don't exist:
+        self.rule_set = RuleSet(rules)
 
         # Will be a list of dicts:
         self.errors = []
 
         self.post_count = 0
 
-    def start(self):
-        # Cycle through every directory in /posts/ whose name is four digits:
-        for d in glob("{}/posts/{}".format(self.project_root, "[0-9]" * 4)):
-            for f in os.listdir(d):
-                # Test every .txt file:
-                if f.endswith(".txt"):
-                    self.test_file(os.path.join(self.project_root, "posts", d, f))
+        # How many files we skipped because they're unchanged:
+        self.skipped_count = 0
 
+    def start(self):
+        paths = self.get_paths()
+        cache = self.load_cache()
+
+        # Only test files that have changed since they last passed:
+        to_test = [path for path in paths if not self.is_unchanged(cache, path)]
+        self.skipped_count = len(paths) - len(to_test)
+
+        for path in paths:
+            if path not in to_test:
+                self.post_count += cache["files"][self.get_cache_key(path)]["posts"]
+
+        test = partial(test_one_file, rules=self.rules)
+
+        if len(to_test) > 1 and self.jobs != 1:
+            # One file per task; map() returns the results in the same order.
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(test, to_test))
+        else:
+            results = [test(path) for path in to_test]
+
+        for path, (errors, post_count, sha256, timings) in zip(
+            to_test, results, strict=True
+        ):
+            self.errors.extend(errors)
+            self.post_count += post_count
+            self.add_timings(timings)
+            self.update_cache(cache, path, sha256, post_count, errors)
+
+        self.save_cache(cache)
+        self.report()
+
+    def report(self):
         last_file = None
 
         # Output all errors, if any.
@@ -51,171 +123,247 @@ class Tester:
 
         print(f"\n{self.post_count:,} posts checked.")
 
+        if self.skipped_count > 0:
+            print(
+                f"({self.skipped_count:,} unchanged files that were OK last time "
+                "weren't checked again.)"
+            )
+
+        self.report_timings()
+
         if len(self.errors) == 0:
             print("\nEverything is OK.")
 
+    def report_timings(self):
+        "Output how long each rule took, slowest first."
+        timings = self.rule_set.timings
+        total = sum(timings.values())
+
+        if total == 0:
+            return
+
+        print("\nTime taken by each rule:")
+        for name, seconds in sorted(timings.items(), key=lambda t: -t[1]):
+            print(f" {name:<18} {seconds * 1000:8.1f} ms  {seconds / total:6.1%}")
+
+    def add_timings(self, timings):
+        "Add the rule timings from testing some files to our totals."
+        for name, seconds in timings.items():
+            self.rule_set.timings[name] += seconds
+
+    def watch(self, interval=1):
+        "Check each file again whenever it changes, until interrupted."
+        mtimes = {path: os.stat(path).st_mtime_ns for path in self.get_paths()}
+
+        print("Watching posts/ for changes. Press Ctrl-C to stop.")
+
+        while True:
+            time.sleep(interval)
+
+            for path in self.get_paths():
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                if mtimes.get(path) == mtime:
+                    continue
+                mtimes[path] = mtime
+
+                name = os.path.relpath(path, self.project_root)
+                print(f"\n{time.strftime('%H:%M:%S')} Checking {name}")
+                self.errors = []
+                self.post_count = 0
+                self.skipped_count = 0
+                self.rule_set = RuleSet(self.rules)
+                sha256 = file_hash(path)
+                self.test_file(path)
+                self.report()
+
+                cache = self.load_cache()
+                self.update_cache(cache, path, sha256, self.post_count, self.errors)
+                self.save_cache(cache)
+
+    def get_paths(self):
+        "Returns a sorted list of the paths of all the posts files."
+        # Every .txt file in every directory in /posts/ whose name is four digits:
+        return sorted(
+            glob(os.path.join(self.project_root, "posts", "[0-9]" * 4, "*.txt"))
+        )
+
+    def load_cache(self):
+        """
+        Returns the cache of files that passed, or an empty one if we're not
+        using it, it doesn't exist, or the testing code has changed.
+        """
+        empty = {"code": self.get_code_hash(), "files": {}}
+
+        if not self.use_cache:
+            return empty
+
+        try:
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return empty
+
+        if cache.get("code") != empty["code"]:
+            return empty
+
+        return cache
+
+    def save_cache(self, cache):
+        try:
+            with open(self.cache_path, "w") as file:
+                json.dump(cache, file, indent=1, sort_keys=True)
+        except OSError as e:
+            print(f"Couldn't save {self.cache_path}: {e}")
+
+    def is_unchanged(self, cache, path):
+        """
+        Is the file at `path` in the cache and unchanged since it was added?
+        See is_file_unchanged().
+        """
+        entry = cache["files"].get(self.get_cache_key(path))
+        return entry is not None and is_file_unchanged(path, entry)
+
+    def update_cache(self, cache, path, sha256, post_count, errors):
+        "Add the file to the cache if it passed, or remove it if it didn't."
+        key = self.get_cache_key(path)
+
+        if errors:
+            cache["files"].pop(key, None)
+            return
+
+        stat = os.stat(path)
+        cache["files"][key] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": sha256,
+            "posts": post_count,
+        }
+
+    def get_cache_key(self, path):
+        "eg '1660/01.txt'"
+        return os.path.relpath(path, os.path.join(self.project_root, "posts"))
+
+    def get_code_hash(self):
+        "A hash of the code that does the testing, and which rules we're using."
+        sha256 = hashlib.sha256()
+        for filename in CODE_FILES:
+            with open(os.path.join(self.project_root, filename), "rb") as file:
+                sha256.update(file.read())
+        for rule in self.rule_set.rules:
+            sha256.update(rule.name.encode())
+        return sha256.hexdigest()
+
     def test_file(self, filepath):
         "Test an individual file."
 
-        with open(filepath) as file:
-            lines = [line for line in file]
-
-        prev_time = None
-
-        for line in lines:
-            if line != "":
-                # Use same match as in poster.py, and only test matching lines.
-
-                pattern = r"""
-                    ^                           # Start of line
-                    (
-                        \d\d\d\d-\d\d-\d\d      # Date like 1666-02-09
-                        \s
-                        \d\d\:\d\d              # Time like 14:08
-                    )                           # GROUP 1: Date and time
-                    (?:                         # Don't count this group
-                        \s                      # A space before the 'r'
-                        (
-                            \w                  # A literal 'r' (probably).
-                        )                       # GROUP 2: r (or None)
-                    )?                          # The 'r ' is optional
-                    \s+                         # One or more spaces
-                    (.*?)                       # The post text
-                    $                           # End of line
-                """
-
-                line_match = re.search(pattern, line, re.VERBOSE)
-
-                if line_match:
-                    [post_time, post_kind, post_text] = line_match.groups()
-
-                    self.post_count += 1
-
-                    # Check times are in the correct order.
-
-                    try:
-                        t = datetime.datetime.strptime(
-                            post_time, "%Y-%m-%d %H:%M"
-                        ).astimezone(datetime.UTC)
-                    except ValueError as e:
-                        self.add_error(filepath, post_time, e)
-                        # Have to return as we won't have a valid value for t.
-                        return
-
-                    if prev_time is not None:
-                        if t > prev_time:
-                            self.add_error(
-                                filepath,
-                                post_time,
-                                f"Time is after previous time ({prev_time}).",
-                            )
-                        elif t == prev_time:
-                            self.add_error(
-                                filepath,
-                                post_time,
-                                f"Time is the same as previous time ({prev_time}).",
-                            )
-                    prev_time = t
-
-                    # Test valid kinds
-
-                    if post_kind is not None and post_kind != "r":
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            f"Kind should be nothing or 'r'. It was: '{post_kind}'.",
-                        )
-
-                    # Test post length.
-
-                    if len(post_text) > 280:
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            f"Post is {len(post_text)} characters long.",
-                        )
-
-                    # Test first/last characters.
-
-                    if post_text[0].islower():
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            (
-                                "Post begins with lowercase character "
-                                f'("{post_text[:20]}...")'
-                            ),
-                        )
-
-                    if post_text[-1].islower():
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            (
-                                "Post ends with lowercase character, not punctuation "
-                                f'("...{post_text[-20:]}")'
-                            ),
-                        )
-
-                    if post_text.endswith(" "):
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            f'Post ends with a space ("...{post_text[-20:]}")',
-                        )
-
-                    # Catch any footnote numbers left in, like "at a limner1 that he"
-                    post_match = re.search(r"([^\s^\d^,^\(+]\d+)", post_text)
-                    if post_match:
-                        span = post_match.span()
-                        start = span[0] - 10
-                        end = span[1] + 10
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            f'Post contains footnote ("{post_text[start:end]}")',
-                        )
-
-                    # Catch any [bits in square brackets] left in:
-                    post_match = re.search(r"(\[.*?\])", post_text)
-                    if post_match:
-                        span = post_match.span()
-                        start = span[0] - 5
-                        end = span[1] + 5
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            (
-                                "Post contains square brackets "
-                                f'("{post_text[start:end]}"))'
-                            ),
-                        )
-
-                    # Tests for errors that I had to correct.
-
-                    # 'jj' or 'kk' from making a mistake in vim:
-                    post_match = re.search(r"\W?(jj|kk)\W?", post_text)
-                    if post_match:
-                        span = post_match.span()
-                        start = span[0] - 10
-                        end = span[1] + 10
-                        self.add_error(
-                            filepath,
-                            post_time,
-                            (
-                                f'"{post_match.groups()[0]}" found: '
-                                f'"{post_text[start:end]}")'
-                            ),
-                        )
+        with open(filepath, "rb") as file:
+            content = file.read()
+
+        prev_post = None
+
+        # Use same parser as in poster.py, and only test matching lines.
+        for post in parse_posts(content):
+            self.post_count += 1
+
+            for message in self.rule_set.check(post, prev_post):
+                self.add_error(filepath, post.time, message)
+
+            prev_post = post
 
     def add_error(self, filepath, dt, txt):
         self.errors.append({"filepath": filepath, "time": dt, "text": txt})
 
 
-def main():
-    tester = Tester()
+def test_one_file(filepath, rules=None):
+    """
+    Test one file with a new Tester; this is what each process does.
+    Returns a tuple of (list of errors, number of posts, SHA-256 of the file,
+    dict of rule name -> seconds taken).
+    """
+    # Hash it first, so if it changes while we're testing it, the cached
+    # hash won't match next time.
+    sha256 = file_hash(filepath)
+    tester = Tester(rules=rules)
+    tester.test_file(filepath)
+    return tester.errors, tester.post_count, sha256, tester.rule_set.timings
+
+
+def make_profiler(directory):
+    "Returns a Profiler for a run of Tester.start() that writes to directory."
+    return Profiler(
+        directory,
+        "tester",
+        {
+            "parse posts": [parse_posts],
+            "check rules": [RuleSet.check],
+            "cache": [
+                Tester.load_cache,
+                Tester.save_cache,
+                Tester.is_unchanged,
+                Tester.update_cache,
+            ],
+            "report": [Tester.report],
+        },
+    )
 
-    tester.start()
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the posts files.")
+    parser.add_argument(
+        "--all", action="store_true", help="Check every file, ignoring the cache"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="Most processes to use (all CPUs)"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, checking each file again whenever it's saved",
+    )
+    parser.add_argument(
+        "--rules",
+        help="Comma-separated names of the rules to run (all of them)",
+    )
+    parser.add_argument(
+        "--list-rules", action="store_true", help="List the rules and exit"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the run, in one process, writing the results to DIR",
+    )
+    args = parser.parse_args()
+
+    if args.list_rules:
+        for rule in RULES.values():
+            print(f"{rule.name:<18} {rule.description}")
+        return
+
+    rules = args.rules.split(",") if args.rules else None
+
+    try:
+        tester = Tester(jobs=args.jobs, use_cache=not args.all, rules=rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.watch:
+        with contextlib.suppress(KeyboardInterrupt):
+            tester.watch()
+        return
+
+    if args.profile:
+        # Other processes' work wouldn't be in the profile.
+        tester.jobs = 1
+        with make_profiler(args.profile).profile():
+            tester.start()
+    else:
+        tester.start()
+
+    sys.exit(1 if tester.errors else 0)
 
 
 if __name__ == "__main__":
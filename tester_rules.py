@@ -0,0 +1,226 @@
+"""
+The checks that tester.py runs on every post.
+
+Each check is a function registered with @rule. It's given a Post (see
+post_parser.py) and the post before it in the same file (or None), and
+yields a message for each error it finds. eg:
+
+    @rule("ampersands", "Posts contain no ampersands")
+    def check_ampersands(post, prev_post):
+        if "&" in post.text:
+            yield "Post contains an ampersand"
+
+Checks that look for a regular expression in a post's text are registered
+with @pattern_rule instead, and are given the match rather than the previous
+post. All of those are combined into one pattern, so most posts, which match
+none of them, are only scanned once. Because a regex that can start matching
+at almost any character is slow to scan for, a rule can also give a `hint`:
+a simpler pattern that's found wherever its real pattern would match (eg, a
+digit, for a footnote number). The hints are what's combined.
+"""
+
+import datetime
+import re
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+
+from render import LIMITS, get_length
+
+# The name that the time spent on the combined pattern is recorded under:
+PATTERN_SCAN = "(pattern scan)"
+
+
+class Rule(NamedTuple):
+    name: str
+    description: str
+    check: Callable
+    # Only for pattern rules, compiled regular expressions:
+    pattern: re.Pattern | None = None
+    hint: re.Pattern | None = None
+
+
+# Every rule, by name, in the order they're run:
+RULES = {}
+
+
+def rule(name, description):
+    "Decorator to register a check function."
+
+    def register(check):
+        RULES[name] = Rule(name, description, check)
+        return check
+
+    return register
+
+
+def pattern_rule(name, description, pattern, hint=None):
+    "Decorator to register a check function that's called for a regex match."
+
+    def register(check):
+        RULES[name] = Rule(
+            name, description, check, re.compile(pattern), re.compile(hint or pattern)
+        )
+        return check
+
+    return register
+
+
+class RuleSet:
+    """
+    Runs a selection of rules on posts, keeping track of how long each takes.
+
+    names - List of rule names to run, or None for all of them.
+    """
+
+    def __init__(self, names=None):
+        if names is None:
+            names = list(RULES)
+
+        unknown = [name for name in names if name not in RULES]
+        if unknown:
+            msg = f"Unknown rule(s): {', '.join(unknown)}"
+            raise ValueError(msg)
+
+        self.rules = [RULES[name] for name in RULES if name in names]
+        self.post_rules = [r for r in self.rules if r.pattern is None]
+        self.pattern_rules = [r for r in self.rules if r.pattern is not None]
+
+        # One pattern that matches wherever any of the pattern rules might:
+        self.combined_pattern = None
+        if self.pattern_rules:
+            self.combined_pattern = re.compile(
+                "|".join(f"(?:{r.hint.pattern})" for r in self.pattern_rules)
+            )
+
+        # Rule name -> total seconds spent running it:
+        self.timings = {r.name: 0.0 for r in self.rules}
+        if self.pattern_rules:
+            self.timings[PATTERN_SCAN] = 0.0
+
+    def check(self, post, prev_post):
+        "Returns a list of error messages for the post."
+        errors = []
+        clock = time.perf_counter
+
+        for r in self.post_rules:
+            start = clock()
+            errors.extend(r.check(post, prev_post))
+            self.timings[r.name] += clock() - start
+
+        if self.combined_pattern is not None:
+            start = clock()
+            found = self.combined_pattern.search(post.text)
+            self.timings[PATTERN_SCAN] += clock() - start
+
+            if found:
+                # At least one might match, so see which.
+                for r in self.pattern_rules:
+                    start = clock()
+                    post_match = r.pattern.search(post.text)
+                    if post_match:
+                        errors.extend(r.check(post, post_match))
+                    self.timings[r.name] += clock() - start
+
+        return errors
+
+
+@rule("valid-time", "Post times are real dates and times")
+def check_valid_time(post, prev_post):
+    try:
+        datetime.datetime(*post[:5])  # noqa: DTZ001
+    except ValueError as e:
+        yield str(e)
+
+
+@rule("order", "Within each file the most recent post is first")
+def check_order(post, prev_post):
+    if prev_post is None:
+        return
+    if post[:5] > prev_post[:5]:
+        yield f"Time is after previous time ({prev_post.time})."
+    elif post[:5] == prev_post[:5]:
+        yield f"Time is the same as previous time ({prev_post.time})."
+
+
+@rule("kind", "The kind of post is nothing or 'r'")
+def check_kind(post, prev_post):
+    if post.kind is not None and post.kind != "r":
+        yield f"Kind should be nothing or 'r'. It was: '{post.kind}'."
+
+
+def make_length_rule(network):
+    "Registers a rule that posts fit in one post on `network`."
+    limit = LIMITS[network]
+
+    @rule(
+        f"{network}-length",
+        f"Posts are <= {limit} characters in length, as {network} counts them",
+    )
+    def check_length(post, prev_post):
+        length = get_length(network, post.text)
+        if length > limit:
+            yield (
+                f"Post is {length} characters long on {network}, so will be "
+                "sent as a thread."
+            )
+
+    return check_length
+
+
+for network in LIMITS:
+    make_length_rule(network)
+
+
+@rule("lowercase-start", "Posts don't start with a lowercase character")
+def check_lowercase_start(post, prev_post):
+    if post.text[:1].islower():
+        yield f'Post begins with lowercase character ("{post.text[:20]}...")'
+
+
+@rule("lowercase-end", "Posts don't end with a lowercase character")
+def check_lowercase_end(post, prev_post):
+    if post.text[-1:].islower():
+        yield (
+            "Post ends with lowercase character, not punctuation "
+            f'("...{post.text[-20:]}")'
+        )
+
+
+@rule("trailing-space", "Posts don't end with a space")
+def check_trailing_space(post, prev_post):
+    if post.text.endswith(" "):
+        yield f'Post ends with a space ("...{post.text[-20:]}")'
+
+
+@pattern_rule(
+    "footnotes",
+    'No footnote numbers are left in, like "at a limner1 that he"',
+    r"[^\s^\d^,^\(+]\d+",
+    hint=r"\d",
+)
+def check_footnotes(post, post_match):
+    start, end = post_match.span()
+    yield f'Post contains footnote ("{post.text[start - 10 : end + 10]}")'
+
+
+@pattern_rule(
+    "square-brackets",
+    "No [bits in square brackets] are left in",
+    r"\[.*?\]",
+    hint=r"\[",
+)
+def check_square_brackets(post, post_match):
+    start, end = post_match.span()
+    yield f'Post contains square brackets ("{post.text[start - 5 : end + 5]}"))'
+
+
+@pattern_rule(
+    "vim-typos",
+    "No 'jj' or 'kk' from making a mistake in vim",
+    r"\W?(jj|kk)\W?",
+    hint=r"jj|kk",
+)
+def check_vim_typos(post, post_match):
+    start, end = post_match.span()
+    yield f'"{post_match.group(1)}" found: "{post.text[start - 10 : end + 10]}")'
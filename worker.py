@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Publishes the posts that Poster has queued in the outbox (see outbox.py).
+
+Only used if UseOutbox / USE_OUTBOX is set to 1. Then clock.py (or poster.py)
+queues posts that are due, and one or more of these processes publish them.
+Each process publishes to every configured network, each in its own thread.
+
+    $ ./worker.py
+"""
+
+import logging
+import signal
+import threading
+
+import poster
+
+logging.basicConfig()
+
+
+def main():
+    p = poster.Poster()
+    stopping = threading.Event()
+
+    if p.metrics_port:
+        p.metrics.serve(p.metrics_port)
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    threads = []
+
+    for network in p.get_networks():
+
+        def send(post, network=network):
+            return p.send_one(network, post)
+
+        threads.append(
+            threading.Thread(
+                target=p.outbox.work,
+                args=(network, send, stopping),
+                name=f"worker-{network}",
+            )
+        )
+
+    if len(threads) == 0:
+        p.logger.error("No networks are configured; nothing to do")
+        return
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()